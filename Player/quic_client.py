@@ -1,11 +1,14 @@
 import asyncio
 import json
-import math
+import os
+import pickle
 import socket
 import ssl
 import struct
+import threading
 import time
 import uuid
+import zlib
 import pygame
 import sys
 from aioquic.asyncio import connect, QuicConnectionProtocol
@@ -13,12 +16,15 @@ from aioquic.quic.configuration import QuicConfiguration
 from aioquic.quic.events import HandshakeCompleted, StreamDataReceived
 from collections import deque
 
-IMAGE = 'men-stands.png'
-MAP_PATH = "new_map.txt"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from gc_pause import GcPacer
+from map_chunks import MapChunkCache, chunk_request
+from movement import (CROUCH, DIR_MASK, DOWN, INTENT_DELTAS, INTENT_MASK, LEFT, MAP_HALF_HEIGHT,
+                      MAP_HALF_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH, RIGHT, SPRINT, UP, collide)
+from terrain import TerrainLayer
 
-SPEED = 3
-SPRINT_SPEED = 6
-CROUCH_SPEED = 1
+IMAGE = 'men-stands.png'
+MAP_CACHE_DIR = "map_cache"  # chunks of the server's map from earlier sessions
 
 WIDTH = 1200
 HEIGHT = 700
@@ -26,22 +32,9 @@ HEIGHT = 700
 SERVER_TIMEOUT = 6.0
 PING_INTERVAL = 2.0
 
-UP = 1 << 0
-LEFT = 1 << 1
-DOWN = 1 << 2
-RIGHT = 1 << 3
-SPRINT = 1 << 4
-CROUCH = 1 << 5
-
-DIR_MASK = UP | LEFT | DOWN | RIGHT
-
-MAP_WIDTH = 1920 * 40 # 76800 pixels
-MAP_HEIGHT = 1080 * 40 # 43200 pixels
-MAP_HALF_WIDTH = MAP_WIDTH // 2
-MAP_HALF_HEIGHT = MAP_HEIGHT // 2
-
-PLAYER_WIDTH = 37
-PLAYER_HEIGHT = 56
+FRAME_RATE = 60
+GC_PACED = True  # freeze what was loaded at start and collect garbage in the time left after a frame
+GC_PACER = GcPacer()
 
 HP_BAR_WIDTH = 40
 HP_BAR_HEIGHT = 6
@@ -52,6 +45,7 @@ TILE_DEFS = {
     '.': ("ground.png", True),
 
     '#': ("lava.png", False),
+    '■': ("rock.png", False),  # solid, see terrain.SOLID_TILES
 
     '←': ("grnd_lava_left.png", True),
     '→': ("grnd_lava_right.png", True),
@@ -68,7 +62,9 @@ TILE_DEFS = {
     '⇧': ("grnd_lava_left_down_right.png", True),
     '⇩': ("grnd_lava_left_up_right.png", True),
 }
-TILE_DICT = {}
+TILE_DICT = {}  # only the tiles of the chunks around the camera
+TERRAIN = TerrainLayer(TILE_SIZE)  # the server's solid rectangles, built from the same chunks
+MAP_CHUNKS = MapChunkCache(MAP_CACHE_DIR)
 HALF_TILE = TILE_SIZE // 2
 
 LAVA_DAMAGE = 2.5
@@ -78,6 +74,19 @@ SEQ_BITS = 16
 SEQ_MAX = 1 << SEQ_BITS
 SEQ_HALF = SEQ_MAX >> 1
 
+NPC_FORGET_DISTANCE = 1500  # pixels (|dx| + |dy|), the server sends NPCs up to 1200 away
+
+PREDICTION_HISTORY = 256  # predicted positions kept, one per input sequence
+RECONCILE_EPSILON = 0.25  # pixels the server may differ by before we re-simulate
+
+# session token from the login screen, without one we join as a guest and progress is not saved.
+# It comes as hex on stdin: on the command line ps would show it to every user of the machine
+TOKEN_STDIN_FLAG = "--token-stdin"
+SESSION_TOKEN = bytes.fromhex(sys.stdin.readline().strip()) if TOKEN_STDIN_FLAG in sys.argv[1:] else b""
+
+TICKET_PATH = "session.ticket"  # TLS session ticket from the last connection
+ZERO_RTT_JOIN = True  # send the join as 0-RTT early data when resuming
+
 
 class Player:
     def __init__(self):
@@ -94,6 +103,7 @@ class GameClientProtocol(QuicConnectionProtocol):
 
         self.player = Player()
         self.players = {}
+        self.npcs = {}  # npc id -> Player, drawn but never collided with, see forget_far_npcs
 
         self.image = pygame.image.load(IMAGE)
         self.rect = self.image.get_rect()
@@ -101,17 +111,20 @@ class GameClientProtocol(QuicConnectionProtocol):
         self.rect.y = HEIGHT//2 - 28
 
         self.input_seq = 0
-        self.pending_inputs = []
+        self.predictions = [None] * PREDICTION_HISTORY  # seq % size -> (seq, intent, x, y)
 
         self.control_stream_id = None
         self.input_stream_id = None
+        self.join_sent = False
 
         self.recv_buffer = bytearray()
 
         self.last_server_activity = time.monotonic()
         self.last_ping_sent = 0.0
+        self.ping_sent_at = None
+        self.rtt = 0.0  # from ping to pong, reported back to the server
 
-        self.message_queue = deque()
+        self.message_queue = deque()  # filled by the network thread, drained by the render loop
 
         self.initialized = False
 
@@ -124,14 +137,16 @@ class GameClientProtocol(QuicConnectionProtocol):
         if isinstance(event, HandshakeCompleted):
             print("connected to server")
             self.connected = True
-            self.input_stream_id = self._quic.get_next_available_stream_id(True)
+            if not self.join_sent:  # otherwise it already went out as 0-RTT
+                self.send_join()
 
         elif isinstance(event, StreamDataReceived):
+            self.last_server_activity = time.monotonic()
             self.recv_buffer.extend(event.data)
             self._process_buffer(event)
 
     def _process_buffer(self, event):
-        """process all complete messages in the buffer"""
+        """process all complete messages in the buffer (network thread)"""
         while True:
             if len(self.recv_buffer) < 2:
                 return  # Not enough for length
@@ -144,6 +159,12 @@ class GameClientProtocol(QuicConnectionProtocol):
             payload = self.recv_buffer[2:2 + msg_len]
             del self.recv_buffer[:2 + msg_len]
 
+            if payload[0] == 6:  # pong, timed here so a slow frame does not count as RTT
+                if self.ping_sent_at is not None:
+                    self.rtt = time.monotonic() - self.ping_sent_at
+                    self.ping_sent_at = None
+                continue
+
             self.message_queue.append((payload, event.stream_id))
 
     def process_pending_messages(self):
@@ -152,18 +173,45 @@ class GameClientProtocol(QuicConnectionProtocol):
             payload, stream_id = self.message_queue.popleft()
             self._handle_message(payload, stream_id)
 
+    # ===========================
+    # SENDING
+    # ===========================
+    # The QUIC connection belongs to the network thread. Everything that
+    # writes to it runs there; the render loop hands writes over with post().
+
+    def post(self, callback, *args):
+        """run callback on the network thread"""
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def write_message(self, stream_id, payload, end_stream=False):
+        packet = struct.pack("!H", len(payload)) + payload
+        self.write_packets(stream_id, packet, end_stream)
+
+    def write_packets(self, stream_id, packets, end_stream=False):
+        """already framed messages, in one write"""
+        self._quic.send_stream_data(stream_id, packets, end_stream=end_stream)
+        self.transmit()
+
+    def send_join(self):
+        # the join is idempotent on the server, so it is safe as 0-RTT early data
+        if self.input_stream_id is None:
+            self.input_stream_id = self._quic.get_next_available_stream_id(True)
+        self.join_sent = True
+
+        payload = struct.pack("!B", 9) + SESSION_TOKEN  # msg_type 9 = join
+        self.write_message(self.input_stream_id, payload)
+
     def send_heartbeat(self):
         if not self.connected or self.input_stream_id is None:
             return
 
-        payload = struct.pack("!B", 5)  # msg_type 5 = ping
-        packet = struct.pack("!H", len(payload)) + payload
-        self._quic.send_stream_data(self.input_stream_id, packet, end_stream=False)
-        self.transmit()
+        # msg_type 5 = ping, carries our last RTT in ms so the server can size our updates
+        payload = struct.pack("!BH", 5, min(0xFFFF, int(self.rtt * 1000)))
+        self.ping_sent_at = time.monotonic()
+        self.write_message(self.input_stream_id, payload)
 
 
     def _handle_message(self, data, stream_id):
-        self.last_server_activity = time.monotonic()
         msg_type = data[0]
 
         if msg_type == 1:  # check if it's a world update (1 = world update from server)
@@ -191,46 +239,25 @@ class GameClientProtocol(QuicConnectionProtocol):
             self.players[client_id][0].hp = hp
             self.initialized = True
 
-        elif msg_type == 3:  # a player disconnected
+        elif msg_type == 3:  # a player disconnected or went out of our range
             raw_id = struct.unpack("!16s", data[1:])[0]
             client_id = uuid.UUID(bytes=raw_id)
             self.players.pop(client_id, None)
 
-        elif msg_type == 2:  # players already online
+        elif msg_type == 2:  # a player joined
             raw_id, x, y, hp = struct.unpack("!16sfff", data[1:])
-            client_id = uuid.UUID(bytes=raw_id)
-            if client_id != self.client_id:
-                if client_id not in self.players:
-                    player = Player()
-                    rect = self.image.get_rect()
-                    self.players[client_id] = [player, rect]
-                    self.players[client_id][0].hp = hp
-                    self.players[client_id][0].x = x
-                    self.players[client_id][0].y = y
-                    self.players[client_id][1].x = self.players[self.client_id][0].x - int(x)
-                    self.players[client_id][1].y = self.players[self.client_id][0].y - int(y)
+            self._add_player(uuid.UUID(bytes=raw_id), x, y, hp)
+
+        elif msg_type == 10:  # roster of players already online, sent once on join
+            entries = zlib.decompress(data[3:])  # data[1:3] is the player count
+            for raw_id, x, y, hp in struct.iter_unpack("!16sfff", entries):
+                self._add_player(uuid.UUID(bytes=raw_id), x, y, hp)
 
         elif msg_type == 4:  # local movement update
             raw_id, x, y, last_seq = struct.unpack("!16sffH", data[1:])
             client_id = uuid.UUID(bytes=raw_id)
             if client_id == self.client_id:
-                self.players[self.client_id][0].x = x
-                self.players[self.client_id][0].y = y
-
-                self.pending_inputs = [
-                    (seq, intent)
-                    for (seq, intent) in self.pending_inputs
-                    if seq_newer(seq, last_seq)
-                ]
-                # these lines discard the old intents already confirmed by the server
-                # and keeps the ones that have not yet been confirmed by the server
-
-                for _, intent in self.pending_inputs:
-                    if intent & DIR_MASK:
-                        self._prediction(intent)
-
-        elif msg_type == 6:
-            pass
+                self.reconcile(x, y, last_seq)
 
         elif msg_type == 7: # local hp change
             raw_id, hp, server_seq = struct.unpack("!16sfH", data[1:])
@@ -259,9 +286,41 @@ class GameClientProtocol(QuicConnectionProtocol):
         elif msg_type == 8:
             raw_id, hp, server_seq = struct.unpack("!16sfH", data[1:])
             cid = uuid.UUID(bytes=raw_id)
-            if cid != self.client_id:
+            if cid != self.client_id and cid in self.players:  # players out of view may be unknown
                 self.players[cid][0].hp = hp
 
+        elif msg_type == 14:  # an NPC moved, kept apart from players so prediction ignores it
+            raw_id, x, y, hp = struct.unpack("!16sfff", data[1:])
+            npc = self.npcs.get(raw_id)
+            if npc is None:
+                npc = self.npcs[raw_id] = Player()
+            npc.x = x
+            npc.y = y
+            npc.hp = hp
+
+        elif msg_type == 11:  # map manifest, sent once on join
+            for cx, cy in MAP_CHUNKS.set_manifest(data):
+                unload_chunk(cx, cy, MAP_CHUNKS.chunk_tiles)
+
+        elif msg_type == 13:  # a map chunk we asked for
+            chunk = MAP_CHUNKS.receive(data)
+            if chunk is not None:
+                load_chunk(*chunk, MAP_CHUNKS.chunk_tiles)
+
+        elif msg_type == 15:  # our join waits in the server's queue, this keeps us from timing out
+            position = struct.unpack("!H", data[1:])[0]
+            print(f"waiting to join, position {position} in the queue")
+
+    def _add_player(self, client_id, x, y, hp):
+        if client_id == self.client_id or client_id in self.players:
+            return
+
+        player = Player()
+        player.x = x
+        player.y = y
+        player.hp = hp
+        self.players[client_id] = [player, self.image.get_rect()]
+
     def send_intent(self, intent):
         if not self.initialized:
             return
@@ -272,30 +331,66 @@ class GameClientProtocol(QuicConnectionProtocol):
         if not self.connected or self.input_stream_id is None:
             return
 
-        self.input_seq += 1
-        self.pending_inputs.append((self.input_seq, intent))
+        self.input_seq = (self.input_seq + 1) & (SEQ_MAX - 1)
 
         self._prediction(intent)
+        self.record_prediction(self.input_seq, intent)
         payload = struct.pack("!BBH", 1, intent, self.input_seq)  # H stands for unsigned short
-        packet = struct.pack("!H", len(payload)) + payload
-        self._quic.send_stream_data(self.input_stream_id, packet, end_stream=False)
-        self.transmit()
-
-    def draw(self, screen):
-        if not self.initialized:
-            return
+        self.post(self.write_message, self.input_stream_id, payload)
 
+    def forget_far_npcs(self):
+        """Drops NPCs far enough away that the server no longer sends them"""
         if self.client_id not in self.players:
             return
 
         local_player = self.players[self.client_id][0]
+        far = [npc_id for npc_id, npc in self.npcs.items()
+               if abs(npc.x - local_player.x) + abs(npc.y - local_player.y) > NPC_FORGET_DISTANCE]
+        for npc_id in far:
+            del self.npcs[npc_id]
+
+    def camera(self):
+        local_player = self.players[self.client_id][0]
 
-        # draw background using camera offset
         cam_x = local_player.x - (WIDTH // 2)
         cam_y = local_player.y - (HEIGHT // 2)
 
         cam_x = max(-MAP_HALF_WIDTH, min(cam_x, MAP_HALF_WIDTH - WIDTH))
         cam_y = max(-MAP_HALF_HEIGHT, min(cam_y, MAP_HALF_HEIGHT - HEIGHT))
+        return cam_x, cam_y
+
+    def stream_map(self):
+        """Loads the map chunks around the camera, asks the server for the ones the disk cache lacks"""
+        if not self.initialized or self.client_id not in self.players:
+            return
+
+        if not self.connected or self.input_stream_id is None:
+            return
+
+        cam_x, cam_y = self.camera()
+        left = int((cam_x + MAP_HALF_WIDTH) // TILE_SIZE)
+        top = int((cam_y + MAP_HALF_HEIGHT) // TILE_SIZE)
+        right = int((cam_x + WIDTH + MAP_HALF_WIDTH) // TILE_SIZE)
+        bottom = int((cam_y + HEIGHT + MAP_HALF_HEIGHT) // TILE_SIZE)
+
+        requests, loaded, dropped = MAP_CHUNKS.update(left, top, right, bottom)
+        for cx, cy in dropped:
+            unload_chunk(cx, cy, MAP_CHUNKS.chunk_tiles)
+        for cx, cy, rows in loaded:
+            load_chunk(cx, cy, rows, MAP_CHUNKS.chunk_tiles)
+        if requests:
+            payload = b"".join(chunk_request(cx, cy) for cx, cy in requests)
+            self.post(self.write_packets, self.input_stream_id, payload)
+
+    def draw(self, screen):
+        if not self.initialized:
+            return
+
+        if self.client_id not in self.players:
+            return
+
+        # draw background using camera offset
+        cam_x, cam_y = self.camera()
 
         world_left = cam_x
         world_right = cam_x + WIDTH
@@ -328,6 +423,9 @@ class GameClientProtocol(QuicConnectionProtocol):
 
         max_hp = 100
 
+        for npc in self.npcs.values():
+            screen.blit(self.image, (npc.x - cam_x, npc.y - cam_y))
+
         for pid, (player, _) in self.players.items():
             if pid != self.client_id:
                 screen_x = player.x - cam_x
@@ -374,100 +472,57 @@ class GameClientProtocol(QuicConnectionProtocol):
         if self.control_stream_id is not None:
             self.connected = False
             payload = struct.pack("!BB", 0, 0)
-            packet = struct.pack("!H", len(payload)) + payload
-            self._quic.send_stream_data(self.control_stream_id, packet, end_stream=True)
-            self.transmit()
+            self.write_message(self.control_stream_id, payload, end_stream=True)
 
     def _prediction(self, intent):
         if self.client_id not in self.players:
             return
 
-        dx = dy = 0
-
-        if intent & SPRINT and not intent & CROUCH:
-            if intent & UP:
-                dy -= SPRINT_SPEED
-            if intent & DOWN:
-                dy += SPRINT_SPEED
-            if intent & LEFT:
-                dx -= SPRINT_SPEED
-            if intent & RIGHT:
-                dx += SPRINT_SPEED
-        elif intent & CROUCH and not intent & SPRINT:
-            if intent & UP:
-                dy -= CROUCH_SPEED
-            if intent & DOWN:
-                dy += CROUCH_SPEED
-            if intent & LEFT:
-                dx -= CROUCH_SPEED
-            if intent & RIGHT:
-                dx += CROUCH_SPEED
-        else:
-            if intent & UP:
-                dy -= SPEED
-            if intent & DOWN:
-                dy += SPEED
-            if intent & LEFT:
-                dx -= SPEED
-            if intent & RIGHT:
-                dx += SPEED
-
-        if dx != 0 and dy != 0:
-            scale = 1/math.sqrt(2)
-            dx *= scale
-            dy *= scale
-
+        dx, dy = INTENT_DELTAS[intent & INTENT_MASK]
         if dx != 0 or dy != 0:
             self.collisions(dx, dy)
 
     def collisions(self, dx, dy):
-        # ---- Separate axis collisions ----
+        # same kernel as the server, so prediction matches the authoritative move
         local_player = self.players[self.client_id][0]
+        others = [(client.x, client.y) for pid, (client, _) in self.players.items()
+                  if pid != self.client_id]
+        solids = TERRAIN.boxes_near(local_player.x, local_player.y, dx, dy)
+        local_player.x, local_player.y = collide(local_player.x, local_player.y, dx, dy, others, solids)
 
-        allow_x = True
-        allow_y = True
+    # ===========================
+    # RECONCILIATION
+    # ===========================
 
-        for pid, (client, _) in self.players.items():
-            if pid == self.client_id:
-                continue
+    def record_prediction(self, seq, intent):
+        local_player = self.players[self.client_id][0]
+        self.predictions[seq % PREDICTION_HISTORY] = (seq, intent, local_player.x, local_player.y)
 
-            overlap_x = abs(local_player.x - client.x) < PLAYER_WIDTH
-            overlap_y = abs(local_player.y - client.y) < PLAYER_HEIGHT
+    def reconcile(self, x, y, last_seq):
+        """Check the server position for last_seq against what we predicted for it.
 
-            if overlap_x and overlap_y:
-                if dx != 0 and (local_player.x - client.x) * dx < 0:
-                    allow_x = False
-                if dy != 0 and (local_player.y - client.y) * dy < 0:
-                    allow_y = False
-                continue
+        If they agree, the inputs after it are still right and nothing is
+        replayed. Otherwise snap to the server and re-simulate the inputs it
+        has not seen yet.
+        """
+        entry = self.predictions[last_seq % PREDICTION_HISTORY]
 
-            if dx != 0:
-                test_x = local_player.x + dx
-                if abs(test_x - client.x) < PLAYER_WIDTH and abs(local_player.y - client.y) < PLAYER_HEIGHT:
-                    allow_x = False
-
-            if dy != 0:
-                test_y = local_player.y + dy
-                if abs(local_player.x - client.x) < PLAYER_WIDTH and abs(test_y - client.y) < PLAYER_HEIGHT:
-                    allow_y = False
-
-        if allow_x:
-            local_player.x += dx
-        if allow_y:
-            local_player.y += dy
-
-        new_x = max(
-            -MAP_HALF_WIDTH,
-            min(local_player.x, MAP_HALF_WIDTH - PLAYER_WIDTH)
-        )
-        new_y = max(
-            -MAP_HALF_HEIGHT,
-            min(local_player.y, MAP_HALF_HEIGHT - PLAYER_HEIGHT)
-        )
-
-        # Apply movement
-        self.players[self.client_id][0].x = new_x
-        self.players[self.client_id][0].y = new_y
+        if entry is not None and entry[0] == last_seq:
+            if abs(entry[2] - x) <= RECONCILE_EPSILON and abs(entry[3] - y) <= RECONCILE_EPSILON:
+                return
+
+        local_player = self.players[self.client_id][0]
+        local_player.x = x
+        local_player.y = y
+
+        unacked = min((self.input_seq - last_seq) & (SEQ_MAX - 1), PREDICTION_HISTORY - 1)
+        for offset in range(unacked, 0, -1):
+            seq = (self.input_seq - offset + 1) & (SEQ_MAX - 1)
+            entry = self.predictions[seq % PREDICTION_HISTORY]
+            if entry is None or entry[0] != seq:
+                continue
+            self._prediction(entry[1])
+            self.record_prediction(seq, entry[1])
 
     def convert_images(self):
         self.image = self.image.convert_alpha()
@@ -500,23 +555,33 @@ def seq_newer(a, b):
     return ((a - b) & (SEQ_MAX - 1)) < SEQ_HALF
 
 
-async def load_tile_map(path: str):
-    tile_dict = {}
+def load_chunk(cx, cy, rows, chunk_tiles):
+    """Puts a map chunk's tiles into TILE_DICT and its solid tiles into TERRAIN"""
+    tx0 = cx * chunk_tiles
+    ty0 = cy * chunk_tiles
 
-    with open(path, "r", encoding="utf-8") as f:
-        for ty, line in enumerate(f):
-            for tx, ch in enumerate(line.strip("\n")):
-                if ch not in TILE_DEFS:
-                    continue
+    for ty, line in enumerate(rows, ty0):
+        for tx, ch in enumerate(line, tx0):
+            if ch not in TILE_DEFS:
+                continue
+
+            image, walkable = TILE_DEFS[ch]
 
-                image, walkable = TILE_DEFS[ch]
+            world_x = tx * TILE_SIZE - MAP_HALF_WIDTH
+            world_y = ty * TILE_SIZE - MAP_HALF_HEIGHT
 
-                world_x = tx * TILE_SIZE - MAP_HALF_WIDTH
-                world_y = ty * TILE_SIZE - MAP_HALF_HEIGHT
+            TILE_DICT[(tx, ty)] = (image, world_x, world_y, walkable)
 
-                tile_dict[(tx, ty)] = (image, world_x, world_y, walkable)
+    TERRAIN.set_tiles(tx0, ty0, rows)
 
-    return tile_dict
+
+def unload_chunk(cx, cy, chunk_tiles):
+    tx0 = cx * chunk_tiles
+    ty0 = cy * chunk_tiles
+    for ty in range(ty0, ty0 + chunk_tiles):
+        for tx in range(tx0, tx0 + chunk_tiles):
+            TILE_DICT.pop((tx, ty), None)
+    TERRAIN.clear_tiles(tx0, ty0, tx0 + chunk_tiles, ty0 + chunk_tiles)
 
 
 async def display_fps(screen, clock):
@@ -526,7 +591,6 @@ async def display_fps(screen, clock):
 
 
 async def game_loop(client: GameClientProtocol):
-    global TILE_DICT
     pygame.init()
 
     width, height = 1200, 700
@@ -535,7 +599,9 @@ async def game_loop(client: GameClientProtocol):
     pygame.display.set_caption("MMO Game")
 
     client.convert_images()
-    TILE_DICT = await load_tile_map(MAP_PATH)
+    GC_PACER.watch()
+    if GC_PACED:
+        GC_PACER.take_over()  # the images stay until we quit, the map streams in as we move
 
     running = True
 
@@ -543,6 +609,7 @@ async def game_loop(client: GameClientProtocol):
     input_cooldown = 1 / 30
 
     while running:
+        frame_start = time.perf_counter()
         current_time = pygame.time.get_ticks() / 1000.0
         now = time.monotonic()
 
@@ -551,6 +618,8 @@ async def game_loop(client: GameClientProtocol):
                 running = False
 
         client.process_pending_messages()
+        client.stream_map()
+        client.forget_far_npcs()
         client.predict_lava_if_needed()
 
         if current_time - last_input_time >= input_cooldown:
@@ -581,8 +650,8 @@ async def game_loop(client: GameClientProtocol):
                 last_input_time = current_time
 
         if now - client.last_ping_sent >= PING_INTERVAL:
-            if client.initialized:
-                client.send_heartbeat()
+            if client.join_sent:  # a join waiting in the server's queue has to ping too
+                client.post(client.send_heartbeat)
                 client.last_ping_sent = now
 
         if now - client.last_server_activity > SERVER_TIMEOUT:
@@ -594,13 +663,73 @@ async def game_loop(client: GameClientProtocol):
         client.draw(screen)
         await display_fps(screen, clock)
         pygame.display.flip()
-        clock.tick(60)
-        await asyncio.sleep(0)
+        GC_PACER.collect_in_slack(frame_start + 1 / FRAME_RATE)
+        clock.tick(FRAME_RATE)  # only paces rendering, the network thread keeps running
 
     print("disconnecting...")
-    client.send_disconnect()
-    await asyncio.sleep(0.1)
-    pygame.quit()
+
+
+class NetworkThread(threading.Thread):
+    """Owns the QUIC connection and its event loop.
+
+    Packets, ACKs and pongs are handled as they arrive instead of once per
+    rendered frame. Decoded messages reach the render loop through the
+    client's message_queue.
+    """
+
+    def __init__(self, configuration, host, port, early_join):
+        super().__init__(name="network", daemon=True)
+        self.configuration = configuration
+        self.host = host
+        self.port = port
+        self.early_join = early_join
+
+        self.client = None
+        self.error = None
+        self.ready = threading.Event()  # set once connected, or on failure
+        self.loop = None
+        self.stop_event = None
+
+    def run(self):
+        try:
+            asyncio.run(self._connect())
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    async def _connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+
+        async with connect(
+            self.host,
+            self.port,
+            configuration=self.configuration,
+            create_protocol=GameClientProtocol,
+            session_ticket_handler=save_session_ticket,
+            wait_connected=not self.early_join,
+            stream_handler=None  # Optional: skips auto stream handling since we are custom
+        ) as client:
+            print("Client connecting...")
+
+            if self.early_join:
+                client.send_join()
+
+            while not client.connected:
+                await asyncio.sleep(0.01)
+
+            self.client = client
+            self.ready.set()
+
+            await self.stop_event.wait()
+            client.send_disconnect()
+            await asyncio.sleep(0.1)
+
+    def stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.join(timeout=1)
 
 
 async def discover_server(timeout=5):
@@ -618,6 +747,33 @@ async def discover_server(timeout=5):
         return None
 
 
+def load_session_ticket(path=TICKET_PATH):
+    """The saved ticket, or None for a full handshake"""
+    try:
+        with open(path, "rb") as f:
+            ticket = pickle.load(f)
+        if ticket.is_valid:
+            return ticket
+    except FileNotFoundError:
+        return None
+    except Exception as e:  # damaged, or written by another version: any unpickling error can come out
+        print("discarding the session ticket:", e)
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return None
+
+
+def save_session_ticket(ticket, path=TICKET_PATH):
+    # write then rename, so a crash never leaves half a ticket behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(ticket, f)
+    os.replace(tmp_path, path)
+
+
 async def main():
     configuration = QuicConfiguration(
         is_client=True,
@@ -636,23 +792,24 @@ async def main():
 
     configuration.server_name = server_host
 
-    try:
-        async with connect(
-            server_ip,
-            port,               # let os choose a free port
-            configuration=configuration,
-            create_protocol=GameClientProtocol,
-            stream_handler=None  # Optional: skips auto stream handling since we are custom
-        ) as client:
-            print("Client connecting...")
+    # resume the last session: no certificate check and no extra round trip
+    configuration.session_ticket = load_session_ticket()
+    early_join = ZERO_RTT_JOIN and configuration.session_ticket is not None
 
-            while not client.connected:
-                await asyncio.sleep(0.01)
+    network = NetworkThread(configuration, server_ip, port, early_join)
+    network.start()
+
+    try:
+        await asyncio.to_thread(network.ready.wait)
+        if network.client is None:
+            print("exception occurred", repr(network.error))
+            return
 
-            await game_loop(client)
+        await game_loop(network.client)
     except Exception as e:
         print("exception occurred", repr(e))
     finally:
+        network.stop()
         pygame.quit()
 
 
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+import session_token
+
+DB_PATH = "cyber.db"
+SESSION_KEY_PATH = "session.key"  # the game server reads the same file
+
+HASH_NAME = "sha256"
+HASH_ITERATIONS = 100_000
+SALT_SIZE = 16
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS players(
+    player_id INTEGER PRIMARY KEY, last_x INTEGER,
+    last_y INTEGER, health INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS login(
+    player_id INTEGER PRIMARY KEY, username TEXT, password TEXT,
+    FOREIGN KEY(player_id) REFERENCES players(player_id))""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS login_username ON login(username)",
+)
+
+# Statements are constant strings so sqlite3 keeps them prepared per connection
+FIND_ACCOUNT = "SELECT player_id, password FROM login WHERE username = ?"
+INSERT_PLAYER = "INSERT INTO players(last_x, last_y) VALUES (0, 0)"
+INSERT_ACCOUNT = "INSERT INTO login(player_id, username, password) VALUES (?, ?, ?)"
+UPDATE_PASSWORD = "UPDATE login SET password = ? WHERE player_id = ?"
+
+
+# ===========================
+# PASSWORD HASHING
+# ===========================
+
+def hash_password(password, salt=None, iterations=HASH_ITERATIONS):
+    if salt is None:
+        salt = os.urandom(SALT_SIZE)
+    digest = hashlib.pbkdf2_hmac(HASH_NAME, password.encode(), salt, iterations)
+    return f"pbkdf2_{HASH_NAME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """Check a password against a stored hash (or a legacy plaintext password)"""
+    if not stored.startswith("pbkdf2_"):
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    algorithm, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac(
+        algorithm[len("pbkdf2_"):], password.encode(), bytes.fromhex(salt), int(iterations)
+    )
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+def check_input(username, password):
+    if "'" not in username and '"' not in username and "'" not in password and '"' not in password:
+        return True
+    return False
+
+
+# ===========================
+# ACCOUNT SERVICE
+# ===========================
+
+
+class AccountService:
+    """Login and signup off the calling thread.
+
+    Every call runs in a small worker pool. Each worker keeps its own SQLite
+    connection for its whole life and does the indexed lookup and the
+    password hashing there, so neither the pygame UI nor the game server
+    ever waits on the database or on PBKDF2.
+    """
+
+    def __init__(self, path=DB_PATH, workers=4, session_key_path=SESSION_KEY_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.session_secret = session_token.load_secret(session_key_path)
+
+        with self._connect() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="accounts")
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+        return conn
+
+    # ===========================
+    # NON-BLOCKING API
+    # ===========================
+
+    def submit_login(self, username, password):
+        """Start a login, returns a concurrent.futures.Future of (message, player_id)"""
+        return self.pool.submit(self.login_blocking, username, password)
+
+    def submit_signup(self, username, password):
+        return self.pool.submit(self.signup_blocking, username, password)
+
+    def issue_token(self, player_id):
+        """Signed session token the game client presents when it joins"""
+        return session_token.issue_token(self.session_secret, player_id)
+
+    async def login(self, username, password):
+        return await asyncio.wrap_future(self.submit_login(username, password))
+
+    async def signup(self, username, password):
+        return await asyncio.wrap_future(self.submit_signup(username, password))
+
+    # ===========================
+    # WORKER SIDE
+    # ===========================
+
+    def find_account(self, username):
+        return self._conn().execute(FIND_ACCOUNT, (username,)).fetchone()
+
+    def login_blocking(self, username, password):
+        if not check_input(username, password):
+            return "invalid input", None
+
+        row = self.find_account(username)
+        if row is None:
+            return "username does not exist", None
+
+        player_id, stored = row
+        if not verify_password(password, stored):
+            return "wrong password", None
+
+        if not stored.startswith("pbkdf2_"):  # upgrade legacy plaintext passwords
+            conn = self._conn()
+            with conn:
+                conn.execute(UPDATE_PASSWORD, (hash_password(password), player_id))
+
+        return "hello welcome back", player_id
+
+    def signup_blocking(self, username, password):
+        if not check_input(username, password):
+            return "invalid input", None
+
+        if self.find_account(username) is not None:
+            return "username already exists", None
+
+        hashed = hash_password(password)  # outside the write transaction
+
+        conn = self._conn()
+        try:
+            with conn:
+                player_id = conn.execute(INSERT_PLAYER).lastrowid
+                conn.execute(INSERT_ACCOUNT, (player_id, username, hashed))
+        except sqlite3.IntegrityError:
+            return "username already exists", None  # lost a race with another signup
+
+        return "signup successful", player_id
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from account_service import AccountService, hash_password
+
+ACCOUNTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+LOOKUPS = 10_000
+LOGINS = 200
+SCANS = 3
+
+
+def fill(path, count):
+    # every account shares one hash, hashing a million passwords would be the benchmark
+    hashed = hash_password("secret")
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO players(player_id, last_x, last_y) VALUES (?, 0, 0)",
+            ((i,) for i in range(1, count + 1))
+        )
+        conn.executemany(
+            "INSERT INTO login(player_id, username, password) VALUES (?, ?, ?)",
+            ((i, f"user{i}", hashed) for i in range(1, count + 1))
+        )
+    conn.close()
+
+
+def old_scan(path, username):
+    # what login() used to do: fetch every row and compare in Python
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT username,password FROM login")
+    for row in c.fetchall():
+        if username == row[0]:
+            break
+    conn.close()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+async def concurrent_logins(service, names):
+    return await asyncio.gather(*(service.login(name, "secret") for name in names))
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    service = AccountService(path)
+
+    start = time.perf_counter()
+    fill(path, ACCOUNTS)
+    print(f"filled {ACCOUNTS} accounts in {time.perf_counter() - start:.1f}s")
+
+    names = [f"user{random.randint(1, ACCOUNTS)}" for _ in range(LOOKUPS)]
+
+    samples = []
+    for name in names:
+        start = time.perf_counter()
+        service.find_account(name)
+        samples.append(time.perf_counter() - start)
+    print(f"indexed lookup: p50 {percentile(samples, 0.5) * 1e6:.1f}us "
+          f"p99 {percentile(samples, 0.99) * 1e6:.1f}us")
+
+    samples = []
+    for name in names[:SCANS]:
+        start = time.perf_counter()
+        old_scan(path, name)
+        samples.append(time.perf_counter() - start)
+    print(f"full table scan: mean {statistics.mean(samples) * 1e3:.1f}ms")
+
+    start = time.perf_counter()
+    results = asyncio.run(concurrent_logins(service, names[:LOGINS]))
+    elapsed = time.perf_counter() - start
+    assert all(player_id is not None for _, player_id in results)
+    print(f"{LOGINS} concurrent logins with hashing: {elapsed:.2f}s "
+          f"({LOGINS / elapsed:.0f} logins/s)")
+
+    # how long the calling thread is busy per login, which is what the UI sees
+    start = time.perf_counter()
+    future = service.submit_login(names[0], "secret")
+    submit_cost = time.perf_counter() - start
+    future.result()
+    print(f"caller blocked per submit_login: {submit_cost * 1e6:.1f}us")
+
+    service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,40 @@
 import sqlite3
-import random
 
-from pyasn1_modules.rfc5280 import extension_OR_address_components
+from account_service import AccountService
 
-conn = sqlite3.connect('cyber.db')
-c = conn.cursor()
-table = """CREATE TABLE IF NOT EXISTS players(
-    player_id INTEGER PRIMARY KEY , last_x INTEGER,
-    last_y INTEGER health Integer)"""
-table_login = """CREATE TABLE IF NOT EXISTS login(
-                player_id INTEGER PRIMARY KEY, username TEXT, password TEXT, 
-                FOREIGN KEY(player_id) REFERENCES players(player_id))"""
-c.execute(table)
-c.execute(table_login)
+accounts = AccountService('cyber.db')  # creates the tables and the username index
 
 username = input("Enter username: ")
 password = input("Enter password: ")
-id = random.randint(1, 100)
-exists = False
 
 
 if "'" not in username and '"' not in username and"'" not in password and '"' not in password:
     username = username.lower()
     password = password.lower()
 
-    c.execute("SELECT username,password FROM login")
-    rows = c.fetchall()
-    print(rows)
-    for row in rows:
-        if username == row[0]:
-            if password == row[1]:
-                print("hello welcome back")
-                exists = True
-                break
-            else:
-                print("wrong password or username already exists")
-                exists = True
-                break
-        else:
-            exists = False
-    print(exists)
-    if not exists:
-        c.execute("INSERT INTO login(player_id, username, password) VALUES (?, ?, ?)", (id, username, password))
-
-
-        #add to players
-        x = 0
-        y = 0
-        c.execute("INSERT INTO players VALUES (?,?,?)", (id,x,y))
+    message, player_id = accounts.login_blocking(username, password)
+    if player_id is None and message == "username does not exist":
+        message, player_id = accounts.signup_blocking(username, password)
+    elif player_id is None:
+        message = "wrong password or username already exists"
+
+    print(message)
+    print(player_id)
 
     #get results
-    conn.commit()
+    conn = sqlite3.connect('cyber.db')
+    c = conn.cursor()
 
-    c.execute("SELECT * FROM login")
+    c.execute("SELECT * FROM login WHERE player_id = ?", (player_id,))
     result = c.fetchall()
     print(result)
 
-    c.execute("SELECT * FROM players")
+    c.execute("SELECT * FROM players WHERE player_id = ?", (player_id,))
     result = c.fetchall()
     print(result)
+
+    c.close()
+    conn.close()
 else:
     print("invalid input")
 
@@ -73,5 +49,4 @@ else:
 #conn.execute("DROP TABLE players")
 
 
-c.close()
-conn.close()
\ No newline at end of file
+accounts.close()
@@ -1,7 +1,9 @@
+import os
 import pygame
+import subprocess
 import sys
-import sqlite3
-import random
+
+from account_service import AccountService
 
 pygame.init()
 
@@ -30,6 +32,20 @@ BTN3_HOVER = (105, 135, 210)
 
 clock = pygame.time.Clock()
 
+ACCOUNTS = AccountService("cyber.db")
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Player")
+
+
+def start_game(player_id):
+    # the client joins the game server with this token instead of logging in again
+    # it goes over stdin, the command line of a process is readable by every user
+    token = ACCOUNTS.issue_token(player_id)
+    client = subprocess.Popen([sys.executable, "quic_client.py", "--token-stdin"],
+                              cwd=CLIENT_DIR, stdin=subprocess.PIPE)
+    client.stdin.write(token.hex().encode("ascii") + b"\n")
+    client.stdin.close()
+
 # -------- Helpers --------
 def draw_text(surface, txt, pos, color=TEXT, font=FONT):
     surface.blit(font.render(txt, True, color), pos)
@@ -86,68 +102,6 @@ class Button:
                 event.button == 1 and
                 self.rect.collidepoint(event.pos))
 
-def checkInput(username, password):
-    if "'" not in username and '"' not in username and "'" not in password and '"' not in password:
-        return True
-    return False
-
-def login(username, password):
-    message1 = "invalid input"
-    if checkInput(username, password):
-        exists = False
-        conn = sqlite3.connect('cyber.db')
-        c = conn.cursor()
-        c.execute("SELECT username,password FROM login")
-        rows = c.fetchall()
-        print(rows)
-        for row in rows:
-            if username == row[0]:
-                if password == row[1]:
-                    message1 = "hello welcome back"
-                    exists = True
-                    break
-                else:
-                    message1 = "wrong password"
-                    exists = True
-                    break
-            else:
-                exists = False
-        if not exists:
-            message1 = "username does not exist"
-
-        conn.commit()
-    return message1
-
-def signup(username, password):
-    exists = False
-    message1 = "invalid input"
-    if checkInput(username, password):
-        conn = sqlite3.connect('cyber.db')
-        c = conn.cursor()
-        c.execute("SELECT username,password FROM login")
-        rows = c.fetchall()
-        print(rows)
-        for row in rows:
-            if username == row[0]:
-                    message1 = "username already exists"
-                    exists = True
-                    break
-            else:
-                exists = False
-        if not exists:
-            id = random.randint(1, 100)
-            c.execute("INSERT INTO login(player_id, username, password) VALUES (?, ?, ?)", (id, username, password))
-            message1 = "signup successful"
-            # add to players
-            x = 0
-            y = 0
-            c.execute("INSERT INTO players VALUES (?,?,?)", (id, x, y))
-
-        # get results
-        conn.commit()
-    return message1
-
-
 # -------- Layout --------
 panel_rect = pygame.Rect(90, 60, 580, 330)
 
@@ -173,6 +127,7 @@ MODE_SIGNUP = "signup"
 mode = MODE_LOGIN
 
 message = ""   # <---- הודעות למשתמש
+pending = None  # login / signup still running in the account service
 
 # -------- Main Loop --------
 while True:
@@ -180,10 +135,12 @@ while True:
 
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
+            ACCOUNTS.close()
             pygame.quit()
             sys.exit()
 
         if btn_quit.clicked(event):
+            ACCOUNTS.close()
             pygame.quit()
             sys.exit()
 
@@ -197,8 +154,9 @@ while True:
 
                 if not username or not password:
                     message = "Please fill both username and password."
-                else:
-                    message = login(username, password)
+                elif pending is None:
+                    pending = ACCOUNTS.submit_login(username, password)
+                    message = "checking..."
 
 
             if btn_to_signup.clicked(event):
@@ -219,13 +177,28 @@ while True:
                     message = "Please fill all fields."
                 elif p1 != p2:
                     message = "Passwords do not match."
-                else:
-                    message = signup(u, p1)
+                elif pending is None:
+                    pending = ACCOUNTS.submit_signup(u, p1)
+                    message = "checking..."
 
             if btn_back_login.clicked(event):
                 mode = MODE_LOGIN
                 message = ""
 
+    if pending is not None and pending.done():
+        try:
+            message, player_id = pending.result()
+        except Exception as e:  # the database failed, not the user: let them try again
+            print("account request failed:", e)
+            failed = "Login failed" if mode == MODE_LOGIN else "Sign up failed"
+            message, player_id = f"{failed}, please try again.", None
+        if mode == MODE_LOGIN and player_id is not None:
+            start_game(player_id)
+            ACCOUNTS.close()
+            pygame.quit()
+            sys.exit()
+        pending = None
+
     # -------- Draw --------
     screen.fill(BG)
     pygame.draw.rect(screen, PANEL, panel_rect, border_radius=16)
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import struct
+import sys
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from loopback import LoopbackClient
+
+# Cost of sending world updates to a crowd: PLAYERS loopback players spread
+# over a few chunks, MOVING of them moving every tick. The same ticks run
+# with per-viewer packing (CHUNK_UPDATES off) and with shared chunk blocks.
+# Only the sending is timed; moving and collisions are the same both ways.
+# Out of view updates go out in each client's turn, every FAR_UPDATE_EVERY
+# ticks, when chunk blocks are on. Bytes per viewer are what reached each
+# loopback client, against its UPDATE_BUDGET for the blocks of its view
+# plus the far scheduler's share.
+PLAYERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+MOVING = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+TICKS = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+SPREAD = int(sys.argv[4]) if len(sys.argv) > 4 else 2000  # pixels, the crowd stands in a square this wide
+
+
+def counted(function, counts):
+    """Wraps world_update so every struct.pack of an entity is counted"""
+    def wrapper(entity):
+        counts["packed"] += 1
+        return function(entity)
+    return wrapper
+
+
+def send():
+    start = time.perf_counter()
+    server.send_world_updates()
+    server.flush_outboxes()
+    return time.perf_counter() - start
+
+
+def run(clients, movers, chunked, counts):
+    server.CHUNK_UPDATES = chunked
+    players = [client.protocol for client in clients]
+    for client in players:
+        client.unsent.clear()
+        server.CHUNKS.unsubscribe(client)
+    send()  # everyone gets their first full view out of the way
+
+    counts["packed"] = 0
+    received = [client.received_bytes for client in clients]
+    elapsed = 0.0
+    for tick in range(TICKS):
+        server.TICK_COUNT += 1
+        for client in movers:
+            client.x += 1 if tick % 2 else -1  # stays in its chunk, like most real moves
+            client.broadcast_world_state()
+        elapsed += send()
+
+    per_viewer = [(client.received_bytes - before) / TICKS for client, before in zip(clients, received)]
+    name = "chunks" if chunked else "per viewer"
+    print(f"{name:10} send {elapsed / TICKS * 1e3:.2f}ms per tick, {counts['packed'] / TICKS:.0f} updates packed per tick, "
+          f"{sum(per_viewer) / len(per_viewer):.0f}B per viewer per tick (max {max(per_viewer):.0f}B)")
+
+
+async def main():
+    await server.load_world(spawn_npcs=False)
+
+    clients = [LoopbackClient(server.GameServerProtocol) for _ in range(PLAYERS)]
+    for client in clients:
+        client.connect()
+        client.send(struct.pack("!B", 9))
+    while len(server.CONNECTED_CLIENTS) < PLAYERS:
+        await asyncio.sleep(0.01)
+
+    players = [client.protocol for client in clients]
+    for i, player in enumerate(players):
+        player.x = (i * 7919) % SPREAD - SPREAD / 2
+        player.y = (i * 104729) % SPREAD - SPREAD / 2
+        server.CHUNKS.place(player)
+    movers = players[:int(PLAYERS * MOVING)]
+    chunks = len({player.chunk for player in players})
+    print(f"{PLAYERS} players in {chunks} chunks, {len(movers)} moving, {TICKS} ticks")
+
+    counts = {"packed": 0}
+    server.GameServerProtocol.world_update = counted(server.GameServerProtocol.world_update, counts)
+    run(clients, movers, False, counts)
+    run(clients, movers, True, counts)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
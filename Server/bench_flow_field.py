@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from flow_field import FlowField, FlowFieldService
+from npc import HABITAT_GROUND, NpcWorld
+
+# Flow field cost on the real map: building a field, AGENTS agents sharing
+# one lookup, and patching cached fields after tile changes compared to
+# building them again. Patched fields must equal rebuilt ones.
+AGENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+FIELDS = 50
+CHANGES = 200
+SEED = 44
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def rebuilt(paths, field):
+    height, width = field.height - 2, field.width - 2
+    goal_rows, goal_columns = np.nonzero(field.goal)
+    goal = (goal_columns.min() + field.x0 - 1, goal_rows.min() + field.y0 - 1,
+            goal_columns.max() + field.x0, goal_rows.max() + field.y0)
+    return FlowField(paths.passable, goal, (field.x0, field.y0, field.x0 + width, field.y0 + height))
+
+
+async def main():
+    tile_dict, _ = await server.load_tile_map(server.MAP_PATH)
+    npcs = NpcWorld(server.TILE_SIZE)
+    npcs.set_map(tile_dict)
+    paths = FlowFieldService(npcs.grid == HABITAT_GROUND, max_fields=FIELDS)
+    rng = np.random.default_rng(SEED)
+
+    rows, columns = paths.passable.shape
+    chunks_x, chunks_y = columns // paths.chunk, rows // paths.chunk
+    goals = [(int(cx), int(cy)) for cx, cy in zip(rng.integers(0, chunks_x, FIELDS), rng.integers(0, chunks_y, FIELDS))]
+
+    build_times = []
+    for cx, cy in goals:
+        start = time.perf_counter()
+        paths.field(cx, cy)
+        build_times.append(time.perf_counter() - start)
+    print(f"build  p50 {percentile(build_times, 0.5) * 1e3:.2f}ms p99 {percentile(build_times, 0.99) * 1e3:.2f}ms "
+          f"({paths.chunk}x{paths.chunk} tile goal, {paths.radius} chunks around)")
+
+    # everyone heading to the same chunk from around it
+    cx, cy = goals[0]
+    field = paths.field(cx, cy)
+    tx = rng.integers(field.x0, field.x0 + field.width - 2, AGENTS)
+    ty = rng.integers(field.y0, field.y0 + field.height - 2, AGENTS)
+    start = time.perf_counter()
+    for _ in range(100):
+        dx, dy = paths.directions(cx, cy, tx, ty)
+    lookup = (time.perf_counter() - start) / 100
+    print(f"lookup {AGENTS} agents {lookup * 1e6:.0f}us, {int(((dx != 0) | (dy != 0)).sum())} with a step")
+
+    # tile changes inside the cached fields
+    patch_times = []
+    for _ in range(CHANGES):
+        field = paths.fields[goals[int(rng.integers(0, FIELDS))]]
+        x = int(rng.integers(field.x0, field.x0 + field.width - 2))
+        y = int(rng.integers(field.y0, field.y0 + field.height - 2))
+        start = time.perf_counter()
+        paths.set_passable(x, y, not paths.passable[y, x])
+        patch_times.append(time.perf_counter() - start)
+
+    rebuild_times = []
+    for field in paths.fields.values():
+        start = time.perf_counter()
+        fresh = rebuilt(paths, field)
+        rebuild_times.append(time.perf_counter() - start)
+        assert np.array_equal(fresh.dist, field.dist), "patched distances differ from a rebuild"
+        assert np.array_equal(fresh.direction, field.direction), "patched directions differ from a rebuild"
+    print(f"patch  p50 {percentile(patch_times, 0.5) * 1e3:.2f}ms p99 {percentile(patch_times, 0.99) * 1e3:.2f}ms "
+          f"for all {len(paths.fields)} cached fields, rebuilding them {sum(rebuild_times) * 1e3:.1f}ms")
+    print("patched fields match rebuilt ones")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+import asyncio
+import gc
+import os
+import sys
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from gc_pause import GcPacer
+
+# GC pauses with the server's tile map loaded: TICKS ticks that each leave
+# some cyclic garbage behind, first with the interpreter's own collection,
+# then with the map frozen and full collections paced into the tick slack.
+TICKS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+GARBAGE_PER_TICK = 300  # small reference cycles per tick
+WORK = 0.004  # seconds of pretend simulation per tick
+
+
+class Node:
+    def __init__(self):
+        self.other = None
+
+
+def tick_garbage():
+    for _ in range(GARBAGE_PER_TICK):
+        a, b = Node(), Node()
+        a.other, b.other = b, a  # only the cyclic collector frees these
+
+
+def run(pacer):
+    tick_times = []
+    for _ in range(TICKS):
+        start = time.perf_counter()
+        tick_garbage()
+        while time.perf_counter() - start < WORK:
+            pass
+        tick_times.append(time.perf_counter() - start)
+        pacer.collect_in_slack(start + server.SERVER_TICK)
+    return max(tick_times)
+
+
+def full_collection():
+    start = time.perf_counter()
+    gc.collect()
+    return time.perf_counter() - start
+
+
+def report(name, pacer, slowest):
+    metrics = pacer.metrics()
+    print(f"{name:8} collections {metrics['collections']}, longest full {metrics['pause_max'][2] * 1e3:.1f}ms, "
+          f"longest inside a tick {metrics['in_tick_pause_max'] * 1e3:.1f}ms, slowest tick {slowest * 1e3:.1f}ms")
+
+
+async def main():
+    await server.load_world(spawn_npcs=False)
+    print(f"{len(server.TILE_DICT)} tiles loaded, {TICKS} ticks of {WORK * 1e3:.0f}ms")
+    print(f"one full collection: {full_collection() * 1e3:.1f}ms")
+
+    pacer = GcPacer()
+    pacer.watch()
+    report("default", pacer, run(pacer))
+    pacer.unwatch()
+
+    pacer = GcPacer()
+    frozen = pacer.take_over()
+    report("paced", pacer, run(pacer))
+    print(f"{frozen} objects frozen, {pacer.slack_collections} collections ran in slack")
+    print(f"one full collection: {full_collection() * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
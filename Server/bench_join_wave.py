@@ -0,0 +1,149 @@
+import asyncio
+import os
+import ssl
+import struct
+import sys
+import tempfile
+import time
+
+from aioquic.asyncio import connect, QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import ConnectionTerminated, HandshakeCompleted, StreamDataReceived
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # certificates are next to the server
+
+import quick_server_noredis as server
+
+# Join wave: WAVE guests join at once while ONLINE players are already in.
+# Playable = the joining client has its own spawn (type 0) and its view:
+# the roster, or with CHUNK_UPDATES the first world update.
+# The server keeps its players in a throwaway database.
+ONLINE = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+WAVE = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+PORT = 4433
+PING_INTERVAL = 2.0  # well inside the server's heartbeat timeout
+VIEW_TYPE = 1 if server.CHUNK_UPDATES else 10  # the message that completes a join
+
+
+class BenchClient(QuicConnectionProtocol):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recv_buffers = {}
+        self.started = time.perf_counter()
+        self.playable = asyncio.get_event_loop().create_future()
+        self.messages = 0
+        self.spawned = False
+        self.stream_id = None  # ours, opened once the handshake completes
+
+    def send(self, payload):
+        self._quic.send_stream_data(self.stream_id, struct.pack("!H", len(payload)) + payload)
+        self.transmit()
+
+    def quic_event_received(self, event):
+        if isinstance(event, HandshakeCompleted):
+            self.stream_id = self._quic.get_next_available_stream_id(True)
+            self.send(struct.pack("!B", 9))  # guest join
+
+        elif isinstance(event, ConnectionTerminated):
+            if not self.playable.done():
+                self.playable.set_exception(ConnectionError(f"closed before playable: {event.reason_phrase}"))
+
+        elif isinstance(event, StreamDataReceived):
+            buffer = self.recv_buffers.setdefault(event.stream_id, bytearray())
+            buffer.extend(event.data)
+
+            while len(buffer) >= 2:
+                msg_len = struct.unpack("!H", buffer[:2])[0]
+                if len(buffer) < 2 + msg_len:
+                    break
+                msg_type = buffer[2]
+                del buffer[:2 + msg_len]
+
+                self.messages += 1
+                if msg_type == 0:
+                    self.spawned = True
+                elif msg_type == VIEW_TYPE and self.spawned and not self.playable.done():
+                    self.playable.set_result(time.perf_counter() - self.started)
+
+
+async def join(configuration, results, stop):
+    async with connect("127.0.0.1", PORT, configuration=configuration,
+                       create_protocol=BenchClient) as client:
+        results.append(client)
+        await client.playable
+        stopped = asyncio.create_task(stop.wait())
+        await asyncio.wait((stopped, asyncio.create_task(client.wait_closed())),
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not stop.is_set():
+            raise ConnectionError("closed during the benchmark")
+
+
+async def keep_alive(*groups):
+    """Pings like a real client, so nobody times out while the wave joins"""
+    ping = struct.pack("!BH", 5, 1)
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        for clients in groups:
+            for client in clients:
+                client.send(ping)
+
+
+def check(tasks):
+    """Raises what ended a join or the server, they all run until the benchmark stops"""
+    for task in tasks:
+        if task.done():
+            task.result()
+            raise RuntimeError("a task ended before the benchmark stopped")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as db_dir:
+        server.PLAYER_STORE.path = os.path.join(db_dir, "cyber.db")  # keep the real database out of it
+        await run()
+
+
+async def run():
+    await server.load_world(spawn_npcs=False)
+    server_task = asyncio.create_task(server.start_server())
+    await asyncio.sleep(0.3)
+
+    configuration = QuicConfiguration(is_client=True, alpn_protocols=["mmo"])
+    configuration.verify_mode = ssl.CERT_REQUIRED
+    configuration.load_verify_locations("ca.cert.pem")
+    configuration.server_name = "game-server.local"
+
+    stop = asyncio.Event()
+    online, wave = [], []
+
+    tasks = [server_task, asyncio.create_task(keep_alive(online, wave))]
+    tasks += [asyncio.create_task(join(configuration, online, stop)) for _ in range(ONLINE)]
+    while len(online) < ONLINE or not all(c.playable.done() for c in online):
+        check(tasks)
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+    before = sum(c.messages for c in online)
+
+    start = time.perf_counter()
+    tasks += [asyncio.create_task(join(configuration, wave, stop)) for _ in range(WAVE)]
+    while len(wave) < WAVE or not all(c.playable.done() for c in wave):
+        check(tasks)
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.2)
+    check(tasks)
+
+    times = sorted(c.playable.result() for c in wave)
+    print(f"{WAVE} joins with {ONLINE} online: wave done in {elapsed * 1e3:.0f}ms")
+    print(f"handshake-to-playable p50 {times[len(times) // 2] * 1e3:.1f}ms "
+          f"p99 {times[min(len(times) - 1, int(len(times) * 0.99))] * 1e3:.1f}ms")
+    print(f"messages to players already online: {sum(c.messages for c in online) - before}")
+
+    stop.set()
+    tasks[1].cancel()
+    await asyncio.gather(*tasks[2:], return_exceptions=True)
+    server_task.cancel()
+    await asyncio.gather(server_task, return_exceptions=True)  # the store writes out and closes its database
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import random
+import struct
+import sys
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from loopback import LoopbackClient
+
+# Game logic throughput without QUIC: CLIENTS guests join over the loopback
+# transport, then MOVING of them send intents at 30 Hz for SECONDS while
+# everyone pings every 2s, the way real clients do. The real movement tick,
+# heartbeat checks and outboxes run; only the network is missing.
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+MOVING = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1  # share of clients holding a key
+SECONDS = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+INPUT_RATE = 30
+PING_INTERVAL = 2.0
+SEED = 42
+
+
+def timed(function, totals, name):
+    """Wraps a server function so the time spent in it is added to totals[name]"""
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            totals[name] += time.perf_counter() - start
+    return wrapper
+
+
+async def keep_alive(clients):
+    """Pings like a real client, so nobody times out during a long join"""
+    ping = struct.pack("!BH", 5, 1)
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        for client in clients:
+            client.send(ping)
+
+
+async def drive(clients, stop, totals):
+    rng = random.Random(SEED)
+    movers = rng.sample(clients, int(len(clients) * MOVING))
+    intents = {client: rng.choice((1, 2, 4, 8, 3, 6, 9, 12)) for client in movers}
+    seqs = dict.fromkeys(movers, 0)
+
+    while not stop.is_set():
+        await asyncio.sleep(1 / INPUT_RATE)
+        start = time.perf_counter()
+
+        for client in movers:
+            seqs[client] = (seqs[client] + 1) & 0xFFFF
+            client.send(struct.pack("!BBH", 1, intents[client], seqs[client]))
+
+        totals["clients"] += time.perf_counter() - start
+
+
+async def main():
+    await server.load_world(spawn_npcs=False)
+
+    totals = dict.fromkeys(("simulate", "flush", "clients"), 0.0)
+    server.simulate_tick = timed(server.simulate_tick, totals, "simulate")
+    server.flush_outboxes = timed(server.flush_outboxes, totals, "flush")
+
+    tasks = [
+        asyncio.create_task(server.server_movement_tick()),
+        asyncio.create_task(server.check_heartbeats()),
+    ]
+
+    # --- join ---
+    start = time.perf_counter()
+    clients = [LoopbackClient(server.GameServerProtocol) for _ in range(CLIENTS)]
+    tasks.append(asyncio.create_task(keep_alive(clients)))
+    for client in clients:
+        client.connect()
+        client.send(struct.pack("!B", 9))  # guest join
+    while len(server.CONNECTED_CLIENTS) < CLIENTS:
+        await asyncio.sleep(0.05)
+    print(f"{CLIENTS} clients joined in {time.perf_counter() - start:.2f}s")
+
+    # --- play ---
+    for name in totals:
+        totals[name] = 0.0
+    received = sum(client.received_bytes for client in clients)
+    first_tick = server.TICK_COUNT
+    stop = asyncio.Event()
+    driver = asyncio.create_task(drive(clients, stop, totals))
+
+    start = time.perf_counter()
+    await asyncio.sleep(SECONDS)
+    stop.set()
+    await driver
+    elapsed = time.perf_counter() - start
+
+    ticks = server.TICK_COUNT - first_tick
+    received = sum(client.received_bytes for client in clients) - received
+    print(f"{int(CLIENTS * MOVING)} moving: {ticks / elapsed:.1f} ticks/s (target {1 / server.SERVER_TICK:.0f}), "
+          f"overload level {server.OVERLOAD.level}")
+    print(f"per tick: simulate {totals['simulate'] / ticks * 1e3:.2f}ms, "
+          f"flush {totals['flush'] / ticks * 1e3:.2f}ms, "
+          f"virtual clients {totals['clients'] / ticks * 1e3:.2f}ms")
+    print(f"{received / elapsed / 1e6:.1f} MB/s to clients, {len(server.CONNECTED_CLIENTS)} still connected")
+
+    for task in tasks:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import struct
+import tempfile
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from loopback import LoopbackClient
+from map_chunks import CHUNK_REQUEST, MapChunkCache
+
+# Client startup with the map streamed by the server, against parsing the
+# whole map file the way the client did before. A loopback client joins,
+# gets the manifest and fetches the chunks around its spawn: first with an
+# empty disk cache, then again with the cache the first run filled. Last, a
+# camera sprints across the map to show how many tiles a client holds.
+SCREEN = (1200, 700)
+WALK_STEP = 1800  # pixels per step of the walk, about a second of sprinting
+
+
+class MapClient(LoopbackClient):
+    """Keeps every message that comes back"""
+
+    def __init__(self, create_protocol):
+        super().__init__(create_protocol)
+        self.buffers = {}  # stream_id -> bytearray
+        self.messages = []
+
+    def receive(self, stream_id, data):
+        super().receive(stream_id, data)
+        buffer = self.buffers.setdefault(stream_id, bytearray())
+        buffer += data
+        while len(buffer) >= 2:
+            length = struct.unpack_from("!H", buffer)[0]
+            if len(buffer) < 2 + length:
+                break
+            self.messages.append(bytes(buffer[2:2 + length]))
+            del buffer[:2 + length]
+
+
+def parse_map_file(path):
+    """What the client's load_tile_map did, minus the images"""
+    tiles = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for ty, line in enumerate(f):
+            for tx, ch in enumerate(line.strip("\n")):
+                tiles[(tx, ty)] = (ch, tx * server.TILE_SIZE - server.MAP_HALF_WIDTH,
+                                   ty * server.TILE_SIZE - server.MAP_HALF_HEIGHT, ch != "#")
+    return tiles
+
+
+def load_chunk(tiles, cx, cy, rows, chunk_tiles):
+    for ty, line in enumerate(rows, cy * chunk_tiles):
+        for tx, ch in enumerate(line, cx * chunk_tiles):
+            tiles[(tx, ty)] = (ch, tx * server.TILE_SIZE - server.MAP_HALF_WIDTH,
+                               ty * server.TILE_SIZE - server.MAP_HALF_HEIGHT, ch != "#")
+
+
+def unload_chunk(tiles, cx, cy, chunk_tiles):
+    for ty in range(cy * chunk_tiles, (cy + 1) * chunk_tiles):
+        for tx in range(cx * chunk_tiles, (cx + 1) * chunk_tiles):
+            tiles.pop((tx, ty), None)
+
+
+def screen_tiles(x, y):
+    left = int((x - SCREEN[0] // 2 + server.MAP_HALF_WIDTH) // server.TILE_SIZE)
+    top = int((y - SCREEN[1] // 2 + server.MAP_HALF_HEIGHT) // server.TILE_SIZE)
+    return left, top, left + SCREEN[0] // server.TILE_SIZE, top + SCREEN[1] // server.TILE_SIZE
+
+
+def apply(cache, tiles, loaded, dropped):
+    for cx, cy in dropped:
+        unload_chunk(tiles, cx, cy, cache.chunk_tiles)
+    for cx, cy, rows in loaded:
+        load_chunk(tiles, cx, cy, rows, cache.chunk_tiles)
+
+
+async def join(cache_dir):
+    """Joins, then streams the chunks around the spawn. Returns (seconds, cache, tiles)"""
+    start = time.perf_counter()
+    client = MapClient(server.GameServerProtocol)
+    client.connect()
+    client.send(struct.pack("!B", 9))
+
+    cache = MapChunkCache(cache_dir)
+    tiles = {}
+    view = None
+    while True:
+        await asyncio.sleep(0)  # the handshake runs as a task
+        server.flush_outboxes()
+
+        for message in client.messages:
+            if message[0] == 0:
+                _, x, y, _ = struct.unpack("!16sfff", message[1:])
+                view = screen_tiles(x, y)
+            elif message[0] == 11:
+                cache.set_manifest(message)
+            elif message[0] == 13:
+                chunk = cache.receive(message)
+                if chunk is not None:
+                    load_chunk(tiles, *chunk, cache.chunk_tiles)
+        client.messages.clear()
+
+        if view is None or not cache.hashes:
+            continue
+        requests, loaded, dropped = cache.update(*view)
+        apply(cache, tiles, loaded, dropped)
+        for cx, cy in requests:
+            client.send(CHUNK_REQUEST.pack(12, cx, cy))
+        if not requests and not cache.requested:
+            break
+
+    elapsed = time.perf_counter() - start
+    client.protocol.connection_loss(park=False)
+    return elapsed, cache, tiles
+
+
+def walk(cache):
+    """Sprints the camera across the map, requests answered straight from the server's chunks"""
+    tiles = {}
+    most = 0
+    for x in range(-server.MAP_HALF_WIDTH + SCREEN[0], server.MAP_HALF_WIDTH - SCREEN[0], WALK_STEP):
+        requests, loaded, dropped = cache.update(*screen_tiles(x, 0))
+        apply(cache, tiles, loaded, dropped)
+        for cx, cy in requests:
+            chunk = cache.receive(server.MAP_CHUNKS.packet(cx, cy)[2:])
+            if chunk is not None:
+                load_chunk(tiles, *chunk, cache.chunk_tiles)
+        most = max(most, len(tiles))
+    return most
+
+
+def report(name, elapsed, cache, tiles):
+    print(f"{name:13} {elapsed * 1e3:7.1f}ms to the first full screen, {cache.fetched} chunks fetched "
+          f"({cache.fetched_bytes / 1024:.1f}KB), {cache.disk_hits} from disk, {len(tiles)} tiles held")
+
+
+async def main():
+    with open(server.MAP_PATH, "r", encoding="utf-8") as f:
+        rows = [line.strip("\n") for line in f]
+    start = time.perf_counter()
+    server.MAP_CHUNKS.load(rows)
+    print(f"server: {len(server.MAP_CHUNKS.hashes)} chunks hashed in {(time.perf_counter() - start) * 1e3:.0f}ms, "
+          f"manifest {len(server.MAP_CHUNKS.manifest) / 1024:.1f}KB")
+
+    start = time.perf_counter()
+    tiles = parse_map_file(server.MAP_PATH)
+    print(f"{'whole file':13} {(time.perf_counter() - start) * 1e3:7.1f}ms to parse "
+          f"{os.path.getsize(server.MAP_PATH) / 1024 / 1024:.1f}MB, {len(tiles)} tiles held")
+    del tiles
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report("cold cache", *await join(cache_dir))
+        report("warm cache", *await join(cache_dir))
+
+        cache = MapChunkCache(cache_dir)
+        cache.set_manifest(server.MAP_CHUNKS.manifest[2:])
+        print(f"{'walk':13} across the map in {WALK_STEP}px steps: at most {walk(cache)} tiles held")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from loopback import LoopbackClient
+from npc import HABITAT_GROUND, HABITAT_LAVA, NpcWorld
+
+# NPC tick cost: NPCS NPCs (a quarter of them lava dwellers) and PLAYERS
+# loopback players standing among them, so targeting, chasing, collisions
+# and the per-viewer updates all have work to do.
+NPCS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+PLAYERS = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+TICKS = int(sys.argv[3]) if len(sys.argv) > 3 else 600
+SEED = 43
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def main():
+    tile_dict, _ = await server.load_tile_map(server.MAP_PATH)
+
+    npcs = NpcWorld(server.TILE_SIZE, seed=SEED)
+    npcs.set_map(tile_dict)
+    npcs.spawn(NPCS - NPCS // 4, HABITAT_GROUND)
+    npcs.spawn(NPCS // 4, HABITAT_LAVA)
+
+    players = []
+    for i in range(PLAYERS):
+        client = LoopbackClient(server.GameServerProtocol)
+        client.connect()
+        client.send(struct.pack("!B", 9))
+        players.append(client)
+    while len(server.CONNECTED_CLIENTS) < PLAYERS:
+        await asyncio.sleep(0.01)
+
+    viewers = [client.protocol for client in players]
+    for i, viewer in enumerate(viewers):
+        npc = i * npcs.count // PLAYERS  # everyone starts next to some NPC
+        viewer.x = float(npcs.x[npc]) + 60
+        viewer.y = float(npcs.y[npc])
+    px = np.array([viewer.x for viewer in viewers])
+    py = np.array([viewer.y for viewer in viewers])
+
+    step_times = []
+    send_times = []
+    sent = sum(client.received_bytes for client in players)
+    for tick in range(TICKS):
+        start = time.perf_counter()
+        npcs.step(px, py, tick)
+        middle = time.perf_counter()
+        npcs.send_updates(viewers, tick)
+        server.flush_outboxes()
+        step_times.append(middle - start)
+        send_times.append(time.perf_counter() - middle)
+    sent = sum(client.received_bytes for client in players) - sent
+
+    chasing = int((npcs.state == 1).sum())
+    print(f"{npcs.count} NPCs, {PLAYERS} players, {TICKS} ticks ({chasing} chasing at the end)")
+    print(f"step  p50 {percentile(step_times, 0.5) * 1e3:.2f}ms p99 {percentile(step_times, 0.99) * 1e3:.2f}ms")
+    print(f"send  p50 {percentile(send_times, 0.5) * 1e3:.2f}ms p99 {percentile(send_times, 0.99) * 1e3:.2f}ms")
+    print(f"tick budget {server.SERVER_TICK * 1e3:.1f}ms, "
+          f"{sent / TICKS / PLAYERS:.0f} bytes of NPC updates per player per tick")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,230 @@
+from movement import MAP_HALF_HEIGHT, MAP_HALF_WIDTH
+
+# ===========================
+# CHUNK SNAPSHOTS
+# ===========================
+# The world is cut into square chunks. Entities that changed during a tick
+# are encoded once per chunk into one bytes block, and every viewer near that
+# chunk gets the same block: packing costs O(changed entities) per tick
+# instead of O(changed entities x viewers). A viewer that comes into view of
+# a chunk gets a block with everyone in it, also built once per tick and
+# shared.
+#
+# Only viewers with something new are visited: the ones watching a chunk
+# that changed, and the ones whose view changed (joined, crossed into
+# another chunk, caught up after lagging). A tick costs nothing for clients
+# in quiet parts of the world.
+#
+# A viewer can be given a byte budget per tick. When its blocks do not fit,
+# its own chunk goes first, then the chunks that waited longest and are
+# nearest. The ones left out are unsubscribed and come as full blocks once
+# their turn comes; budget left unused is saved up for them.
+#
+# An entity is anything with x, y, a `chunk` attribute (None until placed)
+# and world_update() returning its framed update. A viewer also has
+# `subscribed`, the frozenset of chunks it was sent, `waiting`, a dict of
+# the ticks each chunk it was not sent has waited, and `saved`, the bytes
+# of budget it saved up. Entities placed with viewer=False are only seen,
+# never sent anything.
+
+SAVED_TICKS = 8  # ticks of budget a viewer may save up, a block bigger than that never goes
+
+
+class ChunkSnapshots:
+    def __init__(self, chunk_size, view_chunks):
+        self.chunk_size = chunk_size  # pixels
+        self.view_chunks = view_chunks  # chunks seen in every direction around your own
+
+        self.members = {}  # chunk -> {entity: None}, insertion ordered
+        self.dirty = {}  # chunk -> {entity: None} changed this tick
+        self.blocks = {}  # chunk -> bytes of this tick's changes
+        self.full = {}  # chunk -> bytes of everyone in it, built when first asked for this tick
+        self.views = {}  # chunk -> frozenset of the chunks seen from it
+        self.watchers = {}  # chunk -> {viewer: None} subscribed to it
+        self.stale = {}  # viewers whose view has to be sent again, {viewer: None}
+
+        self.encoded = 0  # updates packed, for benchmarks
+
+    def chunk_of(self, x, y):
+        return int((x + MAP_HALF_WIDTH) // self.chunk_size), int((y + MAP_HALF_HEIGHT) // self.chunk_size)
+
+    def place(self, entity, viewer=True):
+        """Moves the entity to the chunk of its current position"""
+        chunk = self.chunk_of(entity.x, entity.y)
+        if chunk == entity.chunk:
+            return
+
+        if entity.chunk is not None:
+            self.forget(entity)
+        entity.chunk = chunk
+        self.members.setdefault(chunk, {})[entity] = None
+        if viewer:
+            self.stale[entity] = None  # sees other chunks from here
+
+    def remove(self, entity):
+        if entity.chunk is not None:
+            self.forget(entity)
+            entity.chunk = None
+        self.unsubscribe(entity)
+        self.stale.pop(entity, None)
+
+    def forget(self, entity):
+        members = self.members[entity.chunk]
+        del members[entity]
+        if not members:
+            del self.members[entity.chunk]
+
+        dirty = self.dirty.get(entity.chunk)
+        if dirty is not None:
+            dirty.pop(entity, None)
+
+    def mark(self, entity):
+        """The entity changed, it goes out with its chunk's block this tick"""
+        self.place(entity)
+        self.dirty.setdefault(entity.chunk, {})[entity] = None
+
+    def encode(self):
+        """Packs this tick's blocks. Call once per tick, after everything moved"""
+        self.blocks = {}
+        for chunk, entities in self.dirty.items():
+            if entities:
+                self.blocks[chunk] = b"".join([entity.world_update() for entity in entities])
+                self.encoded += len(entities)
+        self.dirty = {}
+        self.full = {}
+
+    def full_block(self, chunk):
+        block = self.full.get(chunk)
+        if block is None:
+            members = self.members.get(chunk, ())
+            block = self.full[chunk] = b"".join([entity.world_update() for entity in members])
+            self.encoded += len(members)
+        return block
+
+    def neighbours(self, chunk, reach=1):
+        """Entities in chunk and the chunks up to reach away from it, 3x3 chunks by default"""
+        cx, cy = chunk
+        span = range(-reach, reach + 1)
+        if len(self.members) < len(span) * len(span):
+            # fewer occupied chunks than the square has, look at those instead
+            for (mx, my), members in self.members.items():
+                if abs(mx - cx) <= reach and abs(my - cy) <= reach:
+                    yield from members
+            return
+        for key in ((cx + dx, cy + dy) for dx in span for dy in span):
+            members = self.members.get(key)
+            if members:
+                yield from members
+
+    def square(self, chunk, reach):
+        """Chunks up to reach away from chunk, including itself"""
+        cx, cy = chunk
+        span = range(-reach, reach + 1)
+        return {(cx + dx, cy + dy) for dx in span for dy in span}
+
+    def members_in(self, chunks):
+        for key in chunks:
+            members = self.members.get(key)
+            if members:
+                yield from members
+
+    def view(self, chunk):
+        """Chunks seen from chunk, including itself"""
+        seen = self.views.get(chunk)
+        if seen is None:
+            cx, cy = chunk
+            reach = range(-self.view_chunks, self.view_chunks + 1)
+            seen = self.views[chunk] = frozenset((cx + dx, cy + dy) for dx in reach for dy in reach)
+        return seen
+
+    def audience(self):
+        """Viewers that have something to get this tick"""
+        viewers = dict(self.stale)
+        for chunk in self.blocks:
+            watchers = self.watchers.get(chunk)
+            if watchers:
+                viewers.update(watchers)
+        return viewers
+
+    def updates_for(self, viewer, budget=None):
+        """Bytes for viewer, whose subscription moves to what it sees from where it is now.
+
+        Chunks that are new to the viewer come as full blocks, the others only
+        with their changes. With a budget, at most that many bytes unless the
+        viewer's own chunk alone is bigger.
+        """
+        seen = self.view(viewer.chunk)
+        subscribed = viewer.subscribed
+        if seen is subscribed:
+            if len(self.blocks) < len(seen):
+                parts = [block for key, block in self.blocks.items() if key in seen]
+            else:
+                parts = [self.blocks[key] for key in seen if key in self.blocks]
+            if budget is None or sum(len(part) for part in parts) <= budget:
+                self.stale.pop(viewer, None)
+                return b"".join(parts)
+
+        keyed = [(key, self.full_block(key) if key not in subscribed else self.blocks.get(key, b"")) for key in seen]
+        if budget is not None and sum(len(part) for _, part in keyed) > budget:
+            keyed = self.by_priority(viewer, keyed, budget)
+        elif viewer.waiting:
+            viewer.waiting = {}
+            viewer.saved = 0
+
+        sent = frozenset(key for key, _ in keyed)
+        for key in subscribed - sent:
+            self.unwatch(key, viewer)
+        for key in sent - subscribed:
+            self.watchers.setdefault(key, {})[viewer] = None
+
+        self.stale.pop(viewer, None)
+        if len(sent) == len(seen):
+            viewer.subscribed = seen
+        else:
+            viewer.subscribed = sent
+            self.stale[viewer] = None  # the rest goes out in the next ticks
+        return b"".join(part for _, part in keyed)
+
+    def by_priority(self, viewer, keyed, budget):
+        """The (chunk, bytes) that fit in budget and what the viewer saved. Our
+        own chunk always goes, the others gain priority every tick they wait,
+        faster the nearer they are.
+        """
+        own = viewer.chunk
+        cx, cy = own
+        waiting = viewer.waiting
+        allowance = budget + viewer.saved
+
+        chosen = []
+        ranked = []
+        for key, part in keyed:
+            if key == own or not part:
+                chosen.append((key, part))
+                allowance -= len(part)
+            else:
+                priority = (waiting.get(key, 0) + 1) / (1 + max(abs(key[0] - cx), abs(key[1] - cy)))
+                ranked.append((-priority, key, part))
+        ranked.sort()
+
+        viewer.waiting = {}
+        for _, key, part in ranked:
+            if len(part) <= allowance:
+                chosen.append((key, part))
+                allowance -= len(part)
+            else:
+                viewer.waiting[key] = waiting.get(key, 0) + 1
+        viewer.saved = max(0, min(allowance, budget * SAVED_TICKS)) if viewer.waiting else 0
+        return chosen
+
+    def unsubscribe(self, viewer):
+        """Stops sending to viewer until its view is sent again in full"""
+        for key in viewer.subscribed:
+            self.unwatch(key, viewer)
+        viewer.subscribed = frozenset()
+        self.stale[viewer] = None
+
+    def unwatch(self, key, viewer):
+        watchers = self.watchers[key]
+        del watchers[viewer]
+        if not watchers:
+            del self.watchers[key]
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# ===========================
+# FLOW FIELDS
+# ===========================
+# A flow field holds, for every tile in a window around a goal chunk, the
+# number of steps to that chunk and the neighbour to step to. Everyone walking
+# to the same chunk shares one field, and a tick costs each group of agents
+# one array lookup. Fields are built with a breadth first search on numpy
+# frontiers, kept in an LRU cache keyed by goal chunk, and patched in place
+# when a tile changes.
+
+UNREACHED = np.iinfo(np.int32).max
+NO_DIRECTION = 8
+
+# the 8 neighbours as (row, column) offsets, orthogonal ones first
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+# unit step per direction index, the last row is "stay"
+DIRECTION_VECTORS = np.array(
+    [(dc / np.hypot(dr, dc), dr / np.hypot(dr, dc)) for dr, dc in NEIGHBOURS] + [(0.0, 0.0)]
+)
+
+
+class FlowField:
+    """Distances and directions towards one goal chunk, inside a window of the map.
+
+    The arrays have a one tile border that is never passable, so neighbour
+    offsets on flat indices need no bounds checks.
+    """
+
+    def __init__(self, passable, goal, window):
+        (x0, y0, x1, y1), (gx0, gy0, gx1, gy1) = window, goal
+        self.x0, self.y0 = x0, y0
+        self.height, self.width = y1 - y0 + 2, x1 - x0 + 2
+
+        self.passable = np.zeros((self.height, self.width), dtype=bool)
+        self.passable[1:-1, 1:-1] = passable[y0:y1, x0:x1]
+
+        self.goal = np.zeros((self.height, self.width), dtype=bool)
+        self.goal[gy0 - y0 + 1:gy1 - y0 + 1, gx0 - x0 + 1:gx1 - x0 + 1] = True
+
+        w = self.width
+        self.orthogonal = np.array([-w, w, -1, 1])
+
+        self.dist = np.full((self.height, self.width), UNREACHED, dtype=np.int32)
+        self.direction = np.full((self.height, self.width), NO_DIRECTION, dtype=np.int8)
+
+        seeds = np.flatnonzero(self.goal & self.passable)
+        self.dist.flat[seeds] = 0
+        self.relax(seeds)
+        self.update_directions(0, self.height, 0, self.width)
+
+    def relax(self, frontier):
+        """Lowers distances outwards from frontier until nothing improves.
+
+        Returns the flat indices whose distance changed.
+        """
+        dist = self.dist.ravel()
+        passable = self.passable.ravel()
+
+        changed = []
+        while frontier.size:
+            neighbours = (frontier[:, None] + self.orthogonal[None, :]).ravel()
+            offered = np.repeat(dist[frontier] + 1, len(self.orthogonal))
+
+            better = passable[neighbours] & (offered < dist[neighbours])
+            neighbours = neighbours[better]
+            if neighbours.size == 0:
+                break
+
+            np.minimum.at(dist, neighbours, offered[better])
+            frontier = np.unique(neighbours)
+            changed.append(frontier)
+        return np.concatenate(changed) if changed else np.zeros(0, dtype=np.intp)
+
+    def update_directions(self, top, bottom, left, right):
+        """Recomputes the step direction for rows top:bottom, columns left:right"""
+        top, left = max(top, 1), max(left, 1)
+        bottom, right = min(bottom, self.height - 1), min(right, self.width - 1)
+        if top >= bottom or left >= right:
+            return
+
+        own = self.dist[top:bottom, left:right].astype(np.int64)
+        options = np.empty((len(NEIGHBOURS),) + own.shape, dtype=np.int64)
+        for i, (dr, dc) in enumerate(NEIGHBOURS):
+            options[i] = self.dist[top + dr:bottom + dr, left + dc:right + dc]
+            if dr and dc:
+                # no cutting corners: both orthogonal tiles must be passable
+                corner = (self.passable[top + dr:bottom + dr, left:right]
+                          & self.passable[top:bottom, left + dc:right + dc])
+                options[i][~corner] = UNREACHED
+
+        best = options.argmin(axis=0)
+        lowest = np.take_along_axis(options, best[None], axis=0)[0]
+        stuck = (lowest >= own) | (own == UNREACHED) | (own == 0)
+        self.direction[top:bottom, left:right] = np.where(stuck, NO_DIRECTION, best)
+
+    def set_passable(self, tx, ty, passable):
+        """Patches the field after map tile (tx, ty) changed"""
+        r, c = ty - self.y0 + 1, tx - self.x0 + 1
+        if not (1 <= r < self.height - 1 and 1 <= c < self.width - 1):
+            return
+        if self.passable[r, c] == passable:
+            return
+
+        index = r * self.width + c
+        dist = self.dist.ravel()
+        self.passable[r, c] = passable
+
+        if passable:
+            # distances only get shorter: spread out from the opened tile
+            around = dist[index + self.orthogonal].min()
+            if self.goal[r, c]:
+                dist[index] = 0
+            elif around != UNREACHED:
+                dist[index] = around + 1
+            touched = [np.array([index])]
+            if dist[index] != UNREACHED:
+                touched.append(self.relax(np.array([index])))
+        else:
+            # distances only get longer, and only for tiles whose every
+            # shortest path went through this one. Unlink those level by
+            # level, then refill them from the tiles around that kept theirs
+            level = dist[index]
+            dist[index] = UNREACHED
+            frontier = np.array([index])
+            touched = [frontier]
+            while frontier.size and level != UNREACHED:
+                children = np.unique((frontier[:, None] + self.orthogonal[None, :]).ravel())
+                children = children[dist[children] == level + 1]
+                supported = (dist[children[:, None] + self.orthogonal[None, :]] == level).any(axis=1)
+                frontier = children[~supported]
+                dist[frontier] = UNREACHED
+                touched.append(frontier)
+                level += 1
+
+            orphans = np.concatenate(touched)
+            edge = np.unique((orphans[:, None] + self.orthogonal[None, :]).ravel())
+            edge = edge[self.passable.ravel()[edge] & (dist[edge] != UNREACHED)]
+            touched.append(self.relax(edge))
+
+        rows, columns = np.divmod(np.concatenate(touched), self.width)
+        self.update_directions(rows.min() - 1, rows.max() + 2, columns.min() - 1, columns.max() + 2)
+
+    def lookup(self, tx, ty):
+        """Direction index for every (tx, ty), NO_DIRECTION outside the window"""
+        r = ty - self.y0 + 1
+        c = tx - self.x0 + 1
+        inside = (r >= 1) & (r < self.height - 1) & (c >= 1) & (c < self.width - 1)
+        direction = np.full(len(tx), NO_DIRECTION, dtype=np.int8)
+        direction[inside] = self.direction[r[inside], c[inside]]
+        return direction
+
+
+# ===========================
+# SERVICE
+# ===========================
+
+class FlowFieldService:
+    """Flow fields over one walkability grid, cached per goal chunk.
+
+    passable is a [ty, tx] bool array. A field covers its goal chunk plus
+    radius chunks around it, agents further out get no direction and have to
+    find their own way closer first.
+    """
+
+    def __init__(self, passable, chunk=16, radius=3, max_fields=64):
+        self.passable = np.array(passable, dtype=bool)
+        self.chunk = chunk
+        self.radius = radius
+        self.max_fields = max_fields
+        self.fields = OrderedDict()  # (cx, cy) -> FlowField, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def chunk_of(self, tx, ty):
+        return tx // self.chunk, ty // self.chunk
+
+    def field(self, cx, cy, build=True):
+        """The field towards chunk (cx, cy), built on first use.
+
+        With build=False a field that is not cached yet is None instead.
+        """
+        key = (cx, cy)
+        field = self.fields.get(key)
+        if field is not None:
+            self.hits += 1
+            self.fields.move_to_end(key)
+            return field
+        if not build:
+            return None
+
+        self.misses += 1
+        height, width = self.passable.shape
+        goal = (cx * self.chunk, cy * self.chunk,
+                min((cx + 1) * self.chunk, width), min((cy + 1) * self.chunk, height))
+        reach = self.radius * self.chunk
+        window = (max(goal[0] - reach, 0), max(goal[1] - reach, 0),
+                  min(goal[2] + reach, width), min(goal[3] + reach, height))
+        field = self.fields[key] = FlowField(self.passable, goal, window)
+        if len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
+
+    def directions(self, cx, cy, tx, ty, build=True):
+        """Unit steps (dx, dy) towards chunk (cx, cy) for tiles tx, ty (int arrays).
+
+        (0, 0) where there is no step: inside the goal chunk, cut off from it,
+        outside the field's window, or no field and build=False.
+        """
+        field = self.field(cx, cy, build)
+        if field is None:
+            vectors = np.zeros((len(tx), 2))
+        else:
+            vectors = DIRECTION_VECTORS[field.lookup(tx, ty)]
+        return vectors[:, 0], vectors[:, 1]
+
+    def set_passable(self, tx, ty, passable):
+        """Changes one tile and patches every cached field that covers it"""
+        if self.passable[ty, tx] == passable:
+            return
+        self.passable[ty, tx] = passable
+        for field in self.fields.values():
+            field.set_passable(tx, ty, passable)
@@ -0,0 +1,89 @@
+import asyncio
+import struct
+
+from aioquic.quic.events import ConnectionTerminated, HandshakeCompleted, StreamDataReceived
+
+# ===========================
+# LOOPBACK TRANSPORT
+# ===========================
+# GameServerProtocol only uses a small part of QuicConnection: it opens
+# streams, writes to them, closes the connection and calls transmit().
+# LoopbackConnection is that part and nothing else. Written bytes go straight
+# to a LoopbackClient in the same process, which feeds its messages back as
+# the same aioquic events a real connection produces. No sockets, no TLS and
+# no packets, so many thousands of clients fit in one process.
+
+
+class LoopbackConnection:
+    """Stands in for aioquic's QuicConnection under a GameServerProtocol"""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.protocol = None
+        self.closed = False
+        self._streams = {}  # no send buffers, the peer always has everything
+        self._next_stream_ids = {False: 1, True: 3}  # server initiated: bidirectional, unidirectional
+
+    def get_next_available_stream_id(self, is_unidirectional=False):
+        stream_id = self._next_stream_ids[is_unidirectional]
+        self._next_stream_ids[is_unidirectional] += 4
+        return stream_id
+
+    def send_stream_data(self, stream_id, data, end_stream=False):
+        if not self.closed:
+            self.peer.receive(stream_id, data)
+
+    def close(self, error_code=0, frame_type=None, reason_phrase=""):
+        if self.closed:
+            return
+        self.closed = True
+        self.peer.closed = True
+        # a real connection reports this later from its event loop, not from inside close()
+        event = ConnectionTerminated(error_code=error_code, frame_type=frame_type, reason_phrase=reason_phrase)
+        asyncio.get_running_loop().call_soon(self.terminate, event)
+
+    def terminate(self, event):
+        self.protocol.quic_event_received(event)
+        self.protocol._closed.set()
+
+    # called by QuicConnectionProtocol.transmit()
+    def datagrams_to_send(self, now):
+        return []
+
+    def get_timer(self):
+        return None
+
+
+class LoopbackClient:
+    """The client end: sends framed messages in, counts what comes back"""
+
+    def __init__(self, create_protocol):
+        self.connection = LoopbackConnection(self)
+        self.protocol = create_protocol(self.connection)
+        self.connection.protocol = self.protocol
+
+        self.stream_id = 0  # first client initiated bidirectional stream
+        self.closed = False
+        self.received_bytes = 0
+        self.received_writes = 0
+
+    def connect(self):
+        self.protocol.quic_event_received(
+            HandshakeCompleted(alpn_protocol="mmo", early_data_accepted=False, session_resumed=False)
+        )
+
+    def send(self, payload):
+        if self.closed:
+            return
+        packet = struct.pack("!H", len(payload)) + payload
+        self.protocol.quic_event_received(
+            StreamDataReceived(data=packet, end_stream=False, stream_id=self.stream_id)
+        )
+
+    def receive(self, stream_id, data):
+        self.received_bytes += len(data)
+        self.received_writes += 1
+
+    def close(self):
+        if not self.closed:
+            self.connection.close(reason_phrase="client closed")
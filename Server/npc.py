@@ -0,0 +1,483 @@
+import os
+
+import numpy as np
+
+from flow_field import FlowFieldService
+from movement import MAP_HALF_HEIGHT, MAP_HALF_WIDTH, MAP_HEIGHT, MAP_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH
+
+# ===========================
+# NPC WORLD
+# ===========================
+# Every NPC is a row in a handful of numpy arrays and a tick moves all of
+# them in one batched step. NPCs collide with players by the per-axis test
+# movement.collide did before it swept moves: NPC steps are a few pixels,
+# far shorter than a player, so they cannot skip over one and the vectorised
+# test stays cheap. They stay on their habitat: ground NPCs on walkable tiles,
+# lava NPCs on lava. They do not collide with each other. Chasers follow a
+# flow field per habitat towards their player's chunk, so they walk around
+# whatever is in the way instead of getting stuck against it.
+#
+# Only NPCs near players are stepped every tick. The map is cut into regions,
+# a region a player left a while ago is stepped every few ticks with longer
+# steps, and one nobody came near for longer than that sleeps: its NPCs cost
+# nothing until a player comes back. Every region knows its residents, so a
+# tick only looks at the NPCs of regions that are not asleep.
+
+HABITAT_LAVA = 0  # tiles TILE_DICT marks as not walkable
+HABITAT_GROUND = 1  # tiles TILE_DICT marks as walkable
+OFF_MAP = -1  # also solid tiles, TILE_DICT marks them None
+
+WANDER = 0
+CHASE = 1
+
+FOOT_OFFSET = PLAYER_HEIGHT - 15  # same foot point as GameServerProtocol.foot_tile
+
+# one framed NPC update (type 14), laid out like a player's world update.
+# NPCs get their own type so clients keep them apart from players: they are
+# not solid to a player's movement, on either end.
+NPC_UPDATE = 14
+UPDATE_DTYPE = np.dtype([
+    ("length", ">u2"),
+    ("type", "u1"),
+    ("id", "V16"),
+    ("x", ">f4"),
+    ("y", ">f4"),
+    ("hp", ">f4"),
+])
+
+CHUNK = 2048  # NPC rows per NPC x player comparison, bounds the temporary arrays
+CELL_SIZE = 128  # pixels, for the quick "is any player near" test
+REGION_COST = 32  # NPCs a numpy pass gets through in the time of one region lookup
+
+
+class NpcWorld:
+    def __init__(self, tile_size, wander_speed=1.5, chase_speed=2.5, aggro_range=400,
+                 turn_chance=1 / 120, retarget_every=6, view_distance=1200,
+                 updates_per_tick=16, priority_distance=600, path_chunk=16, path_radius=3,
+                 path_fields=256, path_builds_per_tick=1, region_size=640, sleep_after=600,
+                 drowsy_every=4, seed=None):
+        self.tile_size = tile_size
+        self.wander_speed = wander_speed
+        self.chase_speed = chase_speed  # below SPEED, a walking player gets away
+        self.aggro_range = aggro_range
+        self.leash_range = aggro_range * 1.5  # chasers give up past this
+        self.turn_chance = turn_chance  # per tick, for a wanderer to pick a new heading
+        self.retarget_every = retarget_every  # wanderers look for players every this many ticks
+        self.view_distance = view_distance
+        self.updates_per_tick = updates_per_tick  # NPC updates per viewer per tick
+        self.priority_distance = priority_distance
+        self.path_chunk = path_chunk  # tiles per flow field goal chunk
+        self.path_radius = path_radius  # chunks a field reaches out from its goal
+        self.path_fields = path_fields  # cached fields per habitat
+        self.path_builds_per_tick = path_builds_per_tick  # new fields per tick, the rest go straight
+        self.region_size = region_size  # pixels
+        self.wake_range = max(view_distance, self.leash_range)  # regions this close to a player are awake
+        self.sleep_after = sleep_after  # ticks without a player nearby before a region sleeps
+        self.drowsy_every = drowsy_every  # regions on their way to sleep step every this many ticks
+        self.rng = np.random.default_rng(seed)
+
+        # [ry, rx] -> last tick a player was within wake_range, long ago to start with
+        self.last_seen = np.full((MAP_HEIGHT // region_size + 1, MAP_WIDTH // region_size + 1),
+                                 -2 * sleep_after, dtype=np.int64)
+        self.residents = {}  # flat region (ry * columns + rx) -> {row: None}, only regions with NPCs
+        self.resident_rows = {}  # flat region -> residents as an array, until someone crosses its border
+        self.population = np.zeros(self.last_seen.size, dtype=np.int64)  # NPCs per flat region
+
+        self.paths = {}  # habitat -> FlowFieldService
+        self.grid = np.full((0, 0), OFF_MAP, dtype=np.int8)  # [ty, tx] -> habitat
+
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.hp = np.zeros(0, dtype=np.float32)
+        self.habitat = np.zeros(0, dtype=np.int8)
+        self.state = np.zeros(0, dtype=np.int8)
+        self.heading = np.zeros(0)
+        self.moved = np.zeros(0, dtype=bool)
+        self.frames = np.zeros(0, dtype=UPDATE_DTYPE)
+        self.region = np.zeros(0, dtype=np.intp)  # flat region of every NPC, see residents
+
+    @property
+    def count(self):
+        return len(self.x)
+
+    def set_map(self, tile_dict):
+        """Habitat grid from TILE_DICT's walkable flags"""
+        width = max(tx for tx, _ in tile_dict) + 1
+        height = max(ty for _, ty in tile_dict) + 1
+        self.grid = np.full((height, width), OFF_MAP, dtype=np.int8)
+        for (tx, ty), walkable in tile_dict.items():
+            self.grid[ty, tx] = habitat_of(walkable)
+        self.paths = {
+            habitat: FlowFieldService(self.grid == habitat, self.path_chunk, self.path_radius, self.path_fields)
+            for habitat in (HABITAT_GROUND, HABITAT_LAVA)
+        }
+
+    def set_tile(self, tx, ty, walkable):
+        """One tile changed, the cached flow fields get patched"""
+        self.grid[ty, tx] = habitat_of(walkable)
+        for habitat, paths in self.paths.items():
+            paths.set_passable(tx, ty, self.grid[ty, tx] == habitat)
+
+    def spawn(self, count, habitat):
+        """count NPCs on random tiles of their habitat"""
+        tiles = np.flatnonzero(self.grid.ravel() == habitat)
+        if count <= 0 or tiles.size == 0:
+            return
+
+        ty, tx = np.divmod(self.rng.choice(tiles, count), self.grid.shape[1])
+        half = self.tile_size / 2
+        x = tx * self.tile_size - MAP_HALF_WIDTH + half
+        y = ty * self.tile_size - MAP_HALF_HEIGHT + half - FOOT_OFFSET
+
+        frames = np.zeros(count, dtype=UPDATE_DTYPE)
+        frames["length"] = UPDATE_DTYPE.itemsize - 2
+        frames["type"] = NPC_UPDATE
+        frames["id"] = np.frombuffer(os.urandom(16 * count), dtype="V16")
+
+        self.x = np.concatenate((self.x, x))
+        self.y = np.concatenate((self.y, y))
+        self.hp = np.concatenate((self.hp, np.full(count, 100, dtype=np.float32)))
+        self.habitat = np.concatenate((self.habitat, np.full(count, habitat, dtype=np.int8)))
+        self.state = np.concatenate((self.state, np.full(count, WANDER, dtype=np.int8)))
+        self.heading = np.concatenate((self.heading, self.rng.uniform(0, 2 * np.pi, count)))
+        self.moved = np.concatenate((self.moved, np.ones(count, dtype=bool)))
+        # concatenate hands back native byte order, the wire wants big-endian
+        self.frames = np.concatenate((self.frames, frames)).astype(UPDATE_DTYPE)
+
+        first = len(self.region)
+        self.region = np.concatenate((self.region, np.full(count, -1, dtype=np.intp)))
+        self.relocate(np.arange(first, self.count))
+
+    # ===========================
+    # STEP
+    # ===========================
+
+    def step(self, px, py, tick):
+        """Moves the NPCs that are awake. px, py are the player positions as arrays"""
+        self.moved = np.zeros(self.count, dtype=bool)
+        rows, scale = self.awake(px, py, tick)
+        if rows.size == 0:
+            return
+
+        x = self.x[rows]
+        y = self.y[rows]
+        state = self.state[rows]
+        heading = self.heading[rows]
+        habitat = self.habitat[rows]
+
+        # --- targets: chasers every tick, wanderers in turns ---
+        look = (state == CHASE) | (rows % self.retarget_every == tick % self.retarget_every)
+        tx = x.copy()
+        ty = y.copy()
+        if len(px):
+            # nobody within leash range: nothing to chase
+            idx = np.flatnonzero(look)
+            near = near_players(x[idx], y[idx], self.leash_range, px, py)
+            state[idx[~near]] = WANDER
+            idx = idx[near]
+            for start in range(0, idx.size, CHUNK):
+                part = idx[start:start + CHUNK]
+                ddx = px[None, :] - x[part, None]
+                ddy = py[None, :] - y[part, None]
+                dist = ddx * ddx + ddy * ddy
+                nearest = dist.argmin(axis=1)
+                best = np.sqrt(dist[np.arange(part.size), nearest])
+
+                chasing = state[part] == CHASE
+                keep = np.where(chasing, best <= self.leash_range, best <= self.aggro_range)
+                state[part] = np.where(keep, CHASE, WANDER)
+                tx[part] = px[nearest]
+                ty[part] = py[nearest]
+        else:
+            state[:] = WANDER
+
+        # --- velocity, drowsy NPCs make up for the ticks they sat out ---
+        chase = state == CHASE
+        turn = ~chase & (self.rng.random(rows.size) < self.turn_chance * scale)
+        heading[turn] = self.rng.uniform(0, 2 * np.pi, int(turn.sum()))
+
+        to_x = tx - x
+        to_y = ty - y
+        length = np.maximum(np.hypot(to_x, to_y), 1e-9)
+        dx = np.where(chase, to_x / length * self.chase_speed, np.cos(heading) * self.wander_speed * scale)
+        dy = np.where(chase, to_y / length * self.chase_speed, np.sin(heading) * self.wander_speed * scale)
+        self.follow_paths(chase, x, y, habitat, tx, ty, dx, dy)
+        # a chaser already touching its player stays put
+        touching = chase & (np.abs(to_x) < PLAYER_WIDTH) & (np.abs(to_y) < PLAYER_HEIGHT)
+        dx[touching] = 0.0
+        dy[touching] = 0.0
+
+        # --- players block NPCs like they block each other ---
+        allow_x, allow_y = self.player_collisions(x, y, dx, dy, px, py)
+
+        # --- terrain: each axis may only end on the NPC's habitat ---
+        allow_x &= self.on_habitat(x + dx, y, habitat)
+        new_x = np.where(allow_x, x + dx, x)
+        allow_y &= self.on_habitat(new_x, y + dy, habitat)
+        new_y = np.where(allow_y, y + dy, y)
+
+        # wanderers that hit the edge of their habitat turn around
+        bounced = ~chase & (~allow_x | ~allow_y)
+        heading[bounced] += np.pi
+
+        new_x = np.clip(new_x, -MAP_HALF_WIDTH, MAP_HALF_WIDTH - PLAYER_WIDTH)
+        new_y = np.clip(new_y, -MAP_HALF_HEIGHT, MAP_HALF_HEIGHT - PLAYER_HEIGHT)
+
+        self.moved[rows] = (new_x != x) | (new_y != y)
+        self.x[rows] = new_x
+        self.y[rows] = new_y
+        self.state[rows] = state
+        self.heading[rows] = heading
+        self.relocate(rows[self.moved[rows]])
+
+    def awake(self, px, py, tick):
+        """Rows to step this tick, and how many ticks of movement each one makes up.
+
+        Regions within wake_range of a player step every tick. Regions a
+        player was near less than sleep_after ticks ago are drowsy: their NPCs
+        step every drowsy_every ticks, in turns. The rest sleep.
+
+        While few regions are live only their residents are looked at; once
+        most of the world is, one pass over every NPC's region is cheaper.
+        """
+        if len(px):
+            self.last_seen[player_grid(px, py, self.wake_range, self.region_size)] = tick
+
+        age = tick - self.last_seen.ravel()
+        live = (self.population > 0) & (age < self.sleep_after)
+        regions = np.flatnonzero(live)
+        if regions.size * REGION_COST < self.count:
+            rows = np.sort(self.gather(regions))
+        else:
+            rows = np.flatnonzero(live[self.region])
+
+        awake = age[self.region[rows]] == 0
+        keep = awake | (rows % self.drowsy_every == tick % self.drowsy_every)
+        return rows[keep], np.where(awake[keep], 1.0, float(self.drowsy_every))
+
+    def gather(self, regions):
+        """Rows of the NPCs in the given flat regions"""
+        parts = []
+        for region in regions.tolist():
+            rows = self.resident_rows.get(region)
+            if rows is None:
+                rows = self.resident_rows[region] = np.fromiter(self.residents[region], dtype=np.intp)
+            parts.append(rows)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.intp)
+
+    def relocate(self, rows):
+        """Files rows whose position changed under the region they are in now"""
+        if rows.size == 0:
+            return
+        rx, ry = self.region_of(self.x[rows], self.y[rows])
+        region = ry * self.last_seen.shape[1] + rx
+        changed = region != self.region[rows]
+        rows, old, new = rows[changed], self.region[rows[changed]], region[changed]
+
+        for row, left, entered in zip(rows.tolist(), old.tolist(), new.tolist()):
+            if left >= 0:
+                residents = self.residents[left]
+                del residents[row]
+                if not residents:
+                    del self.residents[left]
+                self.resident_rows.pop(left, None)
+            self.residents.setdefault(entered, {})[row] = None
+            self.resident_rows.pop(entered, None)
+        np.subtract.at(self.population, old[old >= 0], 1)
+        np.add.at(self.population, new, 1)
+        self.region[rows] = new
+
+    def region_of(self, x, y):
+        rows, columns = self.last_seen.shape
+        rx = ((x + MAP_HALF_WIDTH) / self.region_size).astype(np.intp).clip(0, columns - 1)
+        ry = ((y + MAP_HALF_HEIGHT) / self.region_size).astype(np.intp).clip(0, rows - 1)
+        return rx, ry
+
+    def follow_paths(self, chase, x, y, habitat, tx, ty, dx, dy):
+        """Points chasers outside their target's chunk along its flow field.
+
+        Chasers with the same habitat and target chunk share one field lookup.
+        Where there is no step (no field yet, out of its reach, cut off) the
+        straight line in dx, dy stays.
+        """
+        rows = np.flatnonzero(chase)
+        if rows.size == 0 or not self.paths:
+            return
+
+        own_tx, own_ty = self.tile_of(x[rows], y[rows])
+        goal_tx, goal_ty = self.tile_of(tx[rows], ty[rows])
+        goal_cx = goal_tx // self.path_chunk
+        goal_cy = goal_ty // self.path_chunk
+        away = (own_tx // self.path_chunk != goal_cx) | (own_ty // self.path_chunk != goal_cy)
+        if not away.any():
+            return
+        rows, own_tx, own_ty = rows[away], own_tx[away], own_ty[away]
+        goal_cx, goal_cy, habitat = goal_cx[away], goal_cy[away], habitat[rows]
+
+        # one group per (habitat, goal chunk)
+        key = (habitat.astype(np.int64) << 40) | (goal_cy.astype(np.int64) << 20) | goal_cx
+        order = np.argsort(key, kind="stable")
+        _, starts = np.unique(key[order], return_index=True)
+        builds = 0
+        for group in np.split(order, starts[1:]):
+            first = group[0]
+            paths = self.paths[int(habitat[first])]
+            cx, cy = int(goal_cx[first]), int(goal_cy[first])
+            build = builds < self.path_builds_per_tick
+            builds += build and (cx, cy) not in paths.fields
+
+            step_x, step_y = paths.directions(cx, cy, own_tx[group], own_ty[group], build)
+            found = (step_x != 0) | (step_y != 0)
+            chasers = rows[group[found]]
+            dx[chasers] = step_x[found] * self.chase_speed
+            dy[chasers] = step_y[found] * self.chase_speed
+
+    def tile_of(self, x, y):
+        """Foot tile of positions. Off the edge counts as the edge tile,
+        positions get clamped to the map anyway. Division and truncation,
+        numpy's float // is several times slower
+        """
+        height, width = self.grid.shape
+        tx = ((x + MAP_HALF_WIDTH) / self.tile_size).astype(np.intp).clip(0, width - 1)
+        ty = ((y + FOOT_OFFSET + MAP_HALF_HEIGHT) / self.tile_size).astype(np.intp).clip(0, height - 1)
+        return tx, ty
+
+    def player_collisions(self, x, y, dx, dy, px, py):
+        """Per axis allow flags against every player, an axis is blocked when its end position overlaps one"""
+        allow_x = np.ones(len(x), dtype=bool)
+        allow_y = np.ones(len(x), dtype=bool)
+        if len(px) == 0:
+            return allow_x, allow_y
+
+        # only NPCs that could touch a player this step need the full comparison
+        reach = PLAYER_HEIGHT + max(float(np.abs(dx).max()), float(np.abs(dy).max()))
+        rows = np.flatnonzero(near_players(x, y, reach, px, py))
+        if rows.size == 0:
+            return allow_x, allow_y
+
+        x = x[rows, None]
+        y = y[rows, None]
+        mx = dx[rows, None]
+        my = dy[rows, None]
+
+        overlap_x = np.abs(x - px[None, :]) < PLAYER_WIDTH
+        overlap_y = np.abs(y - py[None, :]) < PLAYER_HEIGHT
+        both = overlap_x & overlap_y
+
+        # overlapping: only moving away is allowed, otherwise: do not move into them
+        block_x = np.where(both, (x - px[None, :]) * mx < 0, (np.abs(x + mx - px[None, :]) < PLAYER_WIDTH) & overlap_y)
+        block_y = np.where(both, (y - py[None, :]) * my < 0, overlap_x & (np.abs(y + my - py[None, :]) < PLAYER_HEIGHT))
+
+        allow_x[rows] = ~((block_x & (mx != 0)).any(axis=1))
+        allow_y[rows] = ~((block_y & (my != 0)).any(axis=1))
+        return allow_x, allow_y
+
+    def on_habitat(self, x, y, habitat):
+        tx, ty = self.tile_of(x, y)
+        return self.grid[ty, tx] == habitat
+
+    # ===========================
+    # UPDATES
+    # ===========================
+
+    def send_updates(self, viewers, tick):
+        """Queues NPC updates (type 14) for NPCs that moved near each viewer.
+
+        Same idea as send_scheduled_updates: an NPC's priority grows with the
+        ticks since this viewer last got it and falls with distance.
+        """
+        moved = np.flatnonzero(self.moved)
+        if moved.size == 0 or not viewers:
+            return
+
+        frames = self.frames
+        frames["x"][moved] = self.x[moved]
+        frames["y"][moved] = self.y[moved]
+        frames["hp"][moved] = self.hp[moved]
+
+        mx = self.x[moved]
+        my = self.y[moved]
+
+        # only viewers near a region where something moved have anything to get
+        active = np.zeros(self.last_seen.shape, dtype=bool)
+        rx, ry = self.region_of(mx, my)
+        active[ry, rx] = True
+        vx = np.fromiter((viewer.x for viewer in viewers), dtype=float, count=len(viewers))
+        vy = np.fromiter((viewer.y for viewer in viewers), dtype=float, count=len(viewers))
+        near = any_within(active, vx, vy, self.view_distance, self.region_size)
+
+        for i in np.flatnonzero(near).tolist():
+            viewer = viewers[i]
+            if viewer.lagging:
+                continue
+
+            distance = np.abs(mx - viewer.x) + np.abs(my - viewer.y)
+            in_view = distance < self.view_distance
+            if not in_view.any():
+                continue
+
+            candidates = moved[in_view]
+            if viewer.npc_sent is None or len(viewer.npc_sent) < self.count:
+                sent = np.full(self.count, -1, dtype=np.int64)
+                if viewer.npc_sent is not None:
+                    sent[:len(viewer.npc_sent)] = viewer.npc_sent
+                viewer.npc_sent = sent
+
+            if candidates.size > self.updates_per_tick:
+                waited = tick - viewer.npc_sent[candidates]
+                priority = waited / (1.0 + distance[in_view] / self.priority_distance)
+                top = np.argpartition(-priority, self.updates_per_tick)[:self.updates_per_tick]
+                candidates = candidates[top]
+
+            viewer.npc_sent[candidates] = tick
+            viewer.queue_state(frames[candidates].tobytes())
+
+
+def habitat_of(walkable):
+    """Habitat of a TILE_DICT flag: solid tiles (None) are nobody's"""
+    if walkable is None:
+        return OFF_MAP
+    return HABITAT_GROUND if walkable else HABITAT_LAVA
+
+
+def player_grid(px, py, reach, cell_size):
+    """Cells of cell_size pixels that have a player within reach (give or take a cell)"""
+    columns = MAP_WIDTH // cell_size + 1
+    rows = MAP_HEIGHT // cell_size + 1
+    occupied = np.zeros((rows, columns), dtype=bool)
+
+    left = ((px - reach + MAP_HALF_WIDTH) / cell_size).astype(np.intp).clip(0, columns - 1)
+    right = ((px + reach + MAP_HALF_WIDTH) / cell_size).astype(np.intp).clip(0, columns - 1)
+    top = ((py - reach + MAP_HALF_HEIGHT) / cell_size).astype(np.intp).clip(0, rows - 1)
+    bottom = ((py + reach + MAP_HALF_HEIGHT) / cell_size).astype(np.intp).clip(0, rows - 1)
+    for l, r, t, b in zip(left.tolist(), right.tolist(), top.tolist(), bottom.tolist()):
+        occupied[t:b + 1, l:r + 1] = True
+    return occupied
+
+
+def near_players(x, y, reach, px, py):
+    """False where no player is within reach, tested on a grid of CELL_SIZE cells.
+
+    A True only means maybe, the caller still compares exact distances.
+    """
+    occupied = player_grid(px, py, reach, CELL_SIZE)
+    rows, columns = occupied.shape
+    column = ((x + MAP_HALF_WIDTH) / CELL_SIZE).astype(np.intp).clip(0, columns - 1)
+    row = ((y + MAP_HALF_HEIGHT) / CELL_SIZE).astype(np.intp).clip(0, rows - 1)
+    return occupied[row, column]
+
+
+def any_within(grid, x, y, reach, cell_size):
+    """For each (x, y): is any cell of grid set within reach of it (give or take a cell).
+
+    Window sums over a summed area table, so the cost does not depend on reach.
+    """
+    rows, columns = grid.shape
+    table = np.zeros((rows + 1, columns + 1), dtype=np.int32)
+    table[1:, 1:] = grid.cumsum(axis=0).cumsum(axis=1)
+
+    left = ((x - reach + MAP_HALF_WIDTH) / cell_size).astype(np.intp).clip(0, columns - 1)
+    right = ((x + reach + MAP_HALF_WIDTH) / cell_size).astype(np.intp).clip(0, columns - 1) + 1
+    top = ((y - reach + MAP_HALF_HEIGHT) / cell_size).astype(np.intp).clip(0, rows - 1)
+    bottom = ((y + reach + MAP_HALF_HEIGHT) / cell_size).astype(np.intp).clip(0, rows - 1) + 1
+    return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left] > 0
@@ -0,0 +1,44 @@
+# ===========================
+# OVERLOAD CONTROLLER
+# ===========================
+
+
+class OverloadController:
+    """Turns tick timings into a degradation level.
+
+    Every tick reports how long its work took and how late it started. The
+    smoothed share of the tick budget that was used moves the level up when
+    it passes `high` and down when it falls under `low`, one level at a time
+    and at most once per `hold` seconds so it does not flap.
+    """
+
+    def __init__(self, budget, max_level=3, high=0.9, low=0.5, smoothing=0.1, hold=1.0):
+        self.budget = budget
+        self.max_level = max_level
+        self.high = high
+        self.low = low
+        self.smoothing = smoothing
+        self.hold = hold
+
+        self.level = 0
+        self.load = 0.0  # smoothed share of the tick budget in use
+        self.last_change = 0.0
+
+    def record(self, work, late, now):
+        sample = (work + late) / self.budget
+        self.load += (sample - self.load) * self.smoothing
+
+        if now - self.last_change < self.hold:
+            return self.level
+
+        if self.load > self.high and self.level < self.max_level:
+            self.level += 1
+            self.last_change = now
+            print(f"overload level {self.level} (load {self.load:.2f})")
+
+        elif self.load < self.low and self.level > 0:
+            self.level -= 1
+            self.last_change = now
+            print(f"overload level {self.level} (load {self.load:.2f})")
+
+        return self.level
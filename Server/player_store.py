@@ -0,0 +1,155 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+
+
+# ===========================
+# WRITE-BEHIND PLAYER STORE
+# ===========================
+
+
+class PlayerStore:
+    """Write-behind persistence of player position and HP.
+
+    The event loop only records dirty states in memory. A background thread
+    owns the SQLite connection and writes every dirty player in one
+    transaction each flush interval, so a crash loses at most one interval.
+    """
+
+    def __init__(self, path, flush_interval=1.0, load_timeout=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.load_timeout = load_timeout  # seconds a load waits for the thread
+
+        self.dirty = {}  # player_id -> (x, y, hp)
+        self.lock = threading.Lock()
+
+        self.requests = queue.Queue()  # loads from the event loop
+        self.running = False
+        self.thread = None
+
+    # ===========================
+    # EVENT LOOP SIDE
+    # ===========================
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="player-store", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)  # wake the thread for its final flush
+        if self.thread is not None:
+            self.thread.join()
+
+    def mark_dirty(self, player_id, x, y, hp):
+        with self.lock:
+            self.dirty[player_id] = (x, y, hp)
+
+    async def load(self, player_id):
+        """Return (x, y, hp) for a player, or None if it was never saved.
+
+        Raises RuntimeError when the thread is not running and
+        asyncio.TimeoutError when it does not answer within load_timeout.
+        """
+        with self.lock:
+            state = self.dirty.get(player_id)
+        if state is not None:
+            return state  # newer than whatever is on disk
+
+        # only the thread resolves the future, without it we would wait forever
+        if self.thread is None or not self.thread.is_alive():
+            raise RuntimeError("player store is not running")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((player_id, loop, future))
+        return await asyncio.wait_for(future, self.load_timeout)
+
+    # ===========================
+    # BACKGROUND THREAD
+    # ===========================
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema(conn)
+
+        next_flush = time.monotonic() + self.flush_interval
+
+        while self.running:
+            timeout = max(0.0, next_flush - time.monotonic())
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                request = None
+
+            if request is not None:
+                self._answer_load(conn, *request)
+
+            if time.monotonic() >= next_flush:
+                self._flush(conn)
+                next_flush = time.monotonic() + self.flush_interval
+
+        self._flush(conn)
+        conn.close()
+
+    def _ensure_schema(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS players(
+            player_id INTEGER PRIMARY KEY, last_x INTEGER,
+            last_y INTEGER, health INTEGER)""")
+
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(players)")]
+        if "health" not in columns:  # older databases were created without it
+            conn.execute("ALTER TABLE players ADD COLUMN health INTEGER")
+        conn.commit()
+
+    def _answer_load(self, conn, player_id, loop, future):
+        try:
+            row = conn.execute(
+                "SELECT last_x, last_y, health FROM players WHERE player_id = ?",
+                (player_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            loop.call_soon_threadsafe(_set_exception, future, e)
+            return
+
+        state = None
+        if row is not None and row[2] is not None:
+            state = (float(row[0]), float(row[1]), float(row[2]))
+
+        loop.call_soon_threadsafe(_set_result, future, state)
+
+    def _flush(self, conn):
+        with self.lock:
+            if not self.dirty:
+                return
+            batch, self.dirty = self.dirty, {}
+
+        try:
+            with conn:  # one transaction for the whole batch
+                conn.executemany(
+                    """INSERT INTO players(player_id, last_x, last_y, health) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(player_id) DO UPDATE SET
+                    last_x = excluded.last_x, last_y = excluded.last_y, health = excluded.health""",
+                    [(pid, x, y, hp) for pid, (x, y, hp) in batch.items()]
+                )
+        except sqlite3.Error as e:
+            print("player store flush failed:", e)
+            with self.lock:
+                for pid, state in batch.items():
+                    self.dirty.setdefault(pid, state)  # retry next interval, keep newer states
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
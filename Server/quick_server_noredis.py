@@ -1,48 +1,55 @@
 import json
-import math
+import os
 import socket
+import sys
 import time
 import uuid
 import asyncio
+import heapq
+import itertools
 import struct
+import zlib
+from collections import deque
 from aioquic.asyncio import serve, QuicConnectionProtocol
 from aioquic.quic.configuration import QuicConfiguration
-from aioquic.quic.events import HandshakeCompleted, StreamDataReceived
+from aioquic.quic.events import ConnectionTerminated, HandshakeCompleted, StreamDataReceived
+import numpy as np
+
+from overload import OverloadController
+from player_store import PlayerStore
+from rate_limit import TokenBucket
+from replay_log import ReplayRecorder
+from ticket_store import SessionTicketStore
+from timing_wheel import TimingWheel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from gc_pause import GcPacer
+from map_chunks import CHUNK_REQUEST, MapChunks
+from movement import (DIR_MASK, INTENT_DELTAS, INTENT_MASK, MAP_HALF_HEIGHT, MAP_HALF_WIDTH,
+                      PLAYER_HEIGHT, PLAYER_WIDTH, collide)
+from session_token import TOKEN_SIZE, load_secret, verify_token
+from terrain import TerrainLayer
+
+from chunk_snapshot import ChunkSnapshots  # needs movement from Shared
+from npc import HABITAT_GROUND, HABITAT_LAVA, NpcWorld  # needs movement from Shared
 
 # ===========================
 # GLOBALS
 # ===========================
 MAP_PATH = "new_map.txt"
+DB_PATH = "../SQL/cyber.db"
+SESSION_KEY_PATH = "../SQL/session.key"
 
 SERVER_TICK = 1/60
 
 CONNECTED_CLIENTS = set()
-
-SPEED = 3
-SPRINT_SPEED = 60
-CROUCH_SPEED = 1
-
-UP = 1 << 0
-LEFT = 1 << 1
-DOWN = 1 << 2
-RIGHT = 1 << 3
-SPRINT = 1 << 4
-CROUCH = 1 << 5
-
-DIR_MASK = UP | LEFT | DOWN | RIGHT
-
-MAP_WIDTH = 1920 * 40 # 76800 pixels
-MAP_HEIGHT = 1080 * 40 # 43200 pixels
-MAP_HALF_WIDTH  = MAP_WIDTH // 2
-MAP_HALF_HEIGHT = MAP_HEIGHT // 2
-
-PLAYER_WIDTH = 37
-PLAYER_HEIGHT = 56
+PLAYERS_BY_ID = {}  # player_id -> connection, authenticated players only
 
 TILE_SIZE =40
 TILE_DEFS = {
     '#': False,
     '.': True,
+    '■': None,  # rock, solid: see terrain.SOLID_TILES
 
     '←': True,
     '→': True,
@@ -60,20 +67,134 @@ TILE_DEFS = {
     '⇩': True,
 }
 TILE_DICT = {}
+TERRAIN = TerrainLayer(TILE_SIZE)  # solid tiles merged into rectangles, empty until the map loads
+MAP_CHUNKS = MapChunks()  # the map as clients download it, chunk by chunk
 
 LAVA_DAMAGE = 2.5
 LAVA_INTERVAL = 0.5
 
+# Hazards: which tiles hurt and how. Damage is due `interval` seconds after
+# stepping onto the tile and every `interval` after that while staying on it.
+TILE_HAZARDS = {
+    '#': "lava",
+}
+HAZARDS = {
+    "lava": {"damage": LAVA_DAMAGE, "interval": LAVA_INTERVAL},
+}
+HAZARD_TILES = {}  # (tx, ty) -> hazard, only tiles that have one
+HAZARD_QUEUE = []  # heap of (due, order, client, hazard_generation)
+HAZARD_ORDER = itertools.count()  # tie breaker, clients do not compare
+
+# Server simulated NPCs, spawned once the map is loaded
+NPC_SPAWNS = {
+    HABITAT_GROUND: 1500,
+    HABITAT_LAVA: 500,
+}
+NPCS = NpcWorld(TILE_SIZE)
+
 SEQ_BITS = 16
 SEQ_MAX = 1 << SEQ_BITS
 SEQ_HALF = SEQ_MAX >> 1
 
+HEARTBEAT_TIMEOUT = 7.0
+HEARTBEAT_WHEEL = TimingWheel(tick=0.5, slots=64)  # connection deadlines
+PENDING_PONGS = set()  # clients owed a pong on the next flush
+DIRTY_CLIENTS = set()  # clients with queued messages, flushed once per tick
+MOVERS = set()  # clients with an intent for the next tick, the only ones the tick moves
+SCHEDULED = set()  # clients with entries in unsent
+
+ROSTER_CHUNK = 1000  # players per roster message, keeps a compressed message well below 64 KB
+
+PERSIST_INTERVAL = 1.0  # seconds between write-behind flushes
+PLAYER_STORE = PlayerStore(DB_PATH, flush_interval=PERSIST_INTERVAL)
+
+SESSION_SECRET = b""  # loaded in main, shared with the account service
+
+RECONNECT_GRACE = 10.0  # seconds a dropped player waits for its owner to come back
+PARKED_PLAYERS = {}  # player_id -> ParkedBody of a dropped player, still in CHUNKS
+GRACE_WHEEL = TimingWheel(tick=0.5, slots=64)  # when parked players finally leave
+
+# Inbound message limits, per connection
+MESSAGE_LENGTHS = {  # msg_type -> allowed payload lengths
+    0: {2},                   # disconnect
+    1: {4},                   # movement intent
+    5: {1, 3},                # ping, optionally with the client's RTT
+    9: {1, 1 + TOKEN_SIZE},   # join, guest or with a session token
+    12: {CHUNK_REQUEST.size}, # map chunk request
+}
+MAX_MESSAGE_SIZE = max(max(lengths) for lengths in MESSAGE_LENGTHS.values())
+MESSAGE_RATES = {  # msg_type -> (messages per second, burst)
+    0: (1, 2),
+    1: (60, 30),   # clients send at most 30 intents a second
+    5: (2, 5),     # clients ping every 2 seconds
+    9: (1, 2),
+    12: (60, 64),  # a new client asks for the chunks around it at once
+}
+DROP_RATE = 10  # dropped messages per second a connection may cause...
+DROP_BURST = 200  # ...and in a burst, before it is disconnected
+DROP_COUNTS = {}  # msg_type -> messages dropped, all connections
+
+# Update scheduler, per client
+UPDATE_SIZE = 2 + struct.calcsize("!B16sfff")  # one framed world update
+UPDATE_BUDGET = 1500  # bytes of world updates per tick at a good RTT, chunk blocks first
+MIN_UPDATE_BUDGET = 300
+BUDGET_RTT = 0.1  # seconds, above this the budget shrinks with RTT
+PRIORITY_DISTANCE = 600  # pixels, an entity this far away gains priority half as fast
+
+# Near updates: changes are packed once per chunk and the same bytes go to
+# everyone who sees that chunk, every tick. The scheduler above only handles
+# entities outside the chunks a client sees
+CHUNK_UPDATES = True
+CHUNK_TILES = 16  # chunk side in tiles, 640 pixels
+VIEW_CHUNKS = 2  # chunks seen in every direction around your own
+FAR_UPDATE_EVERY = 4  # ticks between a client's turns of the scheduler, for what is out of its view
+FAR_VIEW_CHUNKS = 4  # chunks in every direction whose players get our out of view updates.
+                     # Players know each other exactly while their chunks are this close
+FAR_TURNS = itertools.count()  # spreads the clients' turns over the ticks
+CHUNKS = ChunkSnapshots(TILE_SIZE * CHUNK_TILES, VIEW_CHUNKS)
+
+# Load shedding, levels go up while ticks overrun SERVER_TICK
+OVERLOAD = OverloadController(SERVER_TICK)
+LEVEL_FAR_HALF_RATE = 1  # far entities are only sent every other tick
+LEVEL_SLOW_CHECKS = 2  # hazard and heartbeat checks run half as often
+LEVEL_BATCH_JOINS = 3  # joins wait in a queue and are admitted a few per tick
+FAR_DISTANCE = 1500  # pixels
+JOINS_PER_TICK = 5
+JOIN_QUEUE = deque()  # (connection, player_id) waiting to be admitted
+QUEUE_KEEPALIVE = 2.0  # seconds between the queue positions (msg 15) a waiting join gets
+NEXT_KEEPALIVE = 0.0
+
+# Garbage collection: pauses are always measured. Paced, the static world data
+# is frozen after loading and full collections only run between ticks
+GC_PACED = True
+GC_PACER = GcPacer()
+TICK_COUNT = 0
+
+# Slow consumers
+BACKLOG_LIMIT = 64 * 1024  # unacknowledged bytes before a client only gets the freshest positions
+BACKLOG_RESUME = BACKLOG_LIMIT // 2  # back to normal below this
+BACKLOG_HARD_LIMIT = 1024 * 1024  # disconnected at once above this
+LAG_CUTOFF = 10.0  # seconds a client may stay over BACKLOG_LIMIT
+
+MAX_SESSION_TICKETS = 10_000
+TICKET_STORE = SessionTicketStore(MAX_SESSION_TICKETS)  # TLS resumption for reconnects
+
+# Metrics, rewritten as JSON for whoever watches the server
+METRICS_PATH = "metrics.json"
+METRICS_INTERVAL = 5.0  # seconds
+
+# Input recording, played back offline with replay.py
+RECORD_INPUTS = False
+RECORDER = ReplayRecorder("inputs.replay")
+RECORD_IDS = itertools.count(1)  # connection numbers in the log
+
 # ===========================
 # QUIC GAME SERVER
 # ===========================
 
 
 class GameServerProtocol(QuicConnectionProtocol):
+    viewer = True  # gets chunk blocks and updates, unlike a ParkedBody
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -83,6 +204,9 @@ class GameServerProtocol(QuicConnectionProtocol):
         self.hp = 100
 
         self.client_id: uuid.UUID | None = None
+        self.player_id = 0  # 0 = guest, never persisted
+        self.joining = False
+        self.queued = False  # in JOIN_QUEUE, it gets pongs and keepalives before it is admitted
         self.last_seq = 0
         self.damage_seq = 0
 
@@ -91,10 +215,48 @@ class GameServerProtocol(QuicConnectionProtocol):
 
         self.recv_buffer = bytearray()
 
-        self.last_heartbeat = time.time()
-        self.heartbeat_timeout = 7.0
+        now = time.monotonic()
+        self.rate_limits = {
+            msg_type: TokenBucket(rate, burst, now)
+            for msg_type, (rate, burst) in MESSAGE_RATES.items()
+        }
+        self.drop_budget = TokenBucket(DROP_RATE, DROP_BURST, now)
+        self.drops = {}  # msg_type -> messages dropped on this connection
+        self.kicked = False
+
+        self.control_outbox = bytearray()
+        self.state_outbox = bytearray()
+
+        # backpressure: while lagging only the latest position per entity is kept
+        self.lagging = False
+        self.lag_since = 0.0
+        self.backlog_bytes = 0
+        self.superseded_updates = 0
+        self.pending_self_movement = None
+
+        # entities that changed since we last sent them: client_id -> [priority, entity]
+        self.unsent = {}
+        self.chunk = None  # the chunk we are in, see ChunkSnapshots
+        self.subscribed = frozenset()  # chunks whose blocks we got last tick
+        self.waiting = {}  # chunk -> ticks it waited for our budget, see ChunkSnapshots.by_priority
+        self.saved = 0  # bytes of budget saved up for those chunks
+        self.block_bytes = 0  # chunk block bytes sent since our last scheduler turn...
+        self.block_turn = None  # ...counted for this turn, see far_turn_of
+        self.far_turn = next(FAR_TURNS) % FAR_UPDATE_EVERY
+        self.rtt = 0.0  # reported by the client in its pings
+        self.npc_sent = None  # tick each NPC was last sent to us, see NpcWorld.send_updates
+
+        self.last_heartbeat = time.monotonic()
+        self.heartbeat_timeout = HEARTBEAT_TIMEOUT
 
         self.current_intent = 0
+        self.record_id = 0  # our connection number in the replay log
+
+        # the tile under our feet and the hazard it has, see update_tile
+        self.tile = None
+        self.hazard = None
+        self.hazard_since = 0.0
+        self.hazard_generation = 0
 
     # ===========================
     # QUIC EVENTS
@@ -103,46 +265,106 @@ class GameServerProtocol(QuicConnectionProtocol):
     def quic_event_received(self, event): # This is the only function QUIC calls.
 
         if isinstance(event, HandshakeCompleted):
-            asyncio.create_task(self.safe_handle_handshake())
+            # the player is spawned once its join message arrives
+            self.last_heartbeat = time.monotonic()
+            HEARTBEAT_WHEEL.schedule(self, self.last_heartbeat + self.heartbeat_timeout)
             print("Hand shake complete")
 
         elif isinstance(event, StreamDataReceived):
+            if self.kicked:
+                return
+            self.last_heartbeat = time.monotonic()  # any inbound data proves the client is alive
             self.recv_buffer.extend(event.data)
-            self.process_recv_buffer()
+            self.process_recv_buffer(self.last_heartbeat)
+
+        elif isinstance(event, ConnectionTerminated):
+            # aioquic never calls connection_lost for a single connection
+            self.connection_loss()
 
     # ===========================
     # HANDSHAKE
     # ===========================
 
-    async def handle_handshake(self):
+    async def handle_handshake(self, player_id):
         print("Client connected")
 
-        self.client_id = uuid.uuid4()
+        self.player_id = player_id
+        if self.player_id:
+            self.client_id = uuid.UUID(int=self.player_id)  # same entity id on every login
 
-        self.control_stream_id = self._quic.get_next_available_stream_id(False)
-        self.state_stream_id = self._quic.get_next_available_stream_id(True)
+            old = PLAYERS_BY_ID.get(self.player_id)
+            if old is not None:  # logged in again somewhere else, drop the old session
+                old.connection_loss()
+                try:
+                    old._quic.close()
+                except:
+                    pass
+            PLAYERS_BY_ID[self.player_id] = self
+        else:
+            self.client_id = uuid.uuid4()
+
+        self.open_streams()
 
         # First time players
         self.x = -PLAYER_WIDTH // 2
         self.y = -PLAYER_HEIGHT // 2
         self.hp = 100
 
+        # Players back within the grace period take over their parked state,
+        # everyone else still sees them so nobody needs a leave or a join
+        resumed = self.player_id in PARKED_PLAYERS
+        if resumed:
+            GRACE_WHEEL.cancel(self.player_id)
+            body = unpark_player(self.player_id)
+            self.client_id, self.x, self.y, self.hp = body.client_id, body.x, body.y, body.hp
+
+        # Returning players continue where they left off
+        elif self.player_id:
+            state = await PLAYER_STORE.load(self.player_id)
+            if self.kicked or self._closed.is_set() or PLAYERS_BY_ID.get(self.player_id) is not self:
+                return  # quit, dropped or logged in elsewhere while the store looked us up
+            if state is not None:
+                self.x, self.y, self.hp = state
+                if self.hp <= 0:
+                    self.x = -PLAYER_WIDTH // 2
+                    self.y = -PLAYER_HEIGHT // 2
+                    self.hp = 100
+
         CONNECTED_CLIENTS.add(self)
+        CHUNKS.place(self)
+        self.learn_far_players()
+        self.update_tile(time.monotonic())
+
+        self.record_id = next(RECORD_IDS)
+        RECORDER.join(TICK_COUNT, self.record_id, self.client_id, self.x, self.y, self.hp)
 
         payload = struct.pack("!B16sfff", 0, self.client_id.bytes, self.x, self.y, self.hp)
         packet = struct.pack("!H", len(payload)) + payload
+
+        # the roster and the map manifest follow on the same stream, so they always arrive after message 0.
+        # With CHUNK_UPDATES a joining player is new to CHUNKS: the next ticks send it its whole view
+        # as chunk blocks, the ones other viewers share, so it needs no roster of its own
+        if not CHUNK_UPDATES:
+            packet += self.build_roster()
+        packet += MAP_CHUNKS.manifest
         self._quic.send_stream_data(self.control_stream_id, packet, end_stream=False)
         self.transmit()
 
-        await asyncio.sleep(0.5)
+        if resumed:
+            print(f"Client {self.client_id} resumed")
+            return  # everyone else still has this player
 
         self.broadcast_new_connection()
 
-        self.broadcast_online_clients()
+    def open_streams(self):
+        """Our two streams to the client, opened once: a queued join gets its keepalives on them"""
+        if self.control_stream_id is None:
+            self.control_stream_id = self._quic.get_next_available_stream_id(False)
+            self.state_stream_id = self._quic.get_next_available_stream_id(True)
 
-    async def safe_handle_handshake(self):
+    async def safe_handle_handshake(self, player_id):
         try:
-            await self.handle_handshake()
+            await self.handle_handshake(player_id)
         except Exception as e:
             print("handshake failed:", e)
             try:
@@ -154,20 +376,52 @@ class GameServerProtocol(QuicConnectionProtocol):
     # MESSAGE HANDLING
     # ===========================
 
-    def process_recv_buffer(self):
-        while True:
+    def process_recv_buffer(self, now):
+        while not self.kicked:
             if len(self.recv_buffer) < 2:
                 return  # Not enough for length
 
             msg_len = struct.unpack("!H", self.recv_buffer[:2])[0]
 
+            if msg_len == 0 or msg_len > MAX_MESSAGE_SIZE:
+                # no message is this big, the stream cannot be trusted anymore
+                self.kick(f"bad frame length {msg_len}")
+                return
+
             if len(self.recv_buffer) < 2 + msg_len:
                 return  # Wait for full message
 
             payload = self.recv_buffer[2:2 + msg_len]
             del self.recv_buffer[:2 + msg_len]
 
-            self.handle_message(payload)
+            if self.accept_message(payload, now):
+                self.handle_message(payload)
+
+    def accept_message(self, data, now):
+        """Length and rate checks, a message that fails them is dropped and counted"""
+        msg_type = data[0]
+
+        lengths = MESSAGE_LENGTHS.get(msg_type)
+        if lengths is not None and len(data) in lengths and self.rate_limits[msg_type].allow(now):
+            return True
+
+        self.drops[msg_type] = self.drops.get(msg_type, 0) + 1
+        DROP_COUNTS[msg_type] = DROP_COUNTS.get(msg_type, 0) + 1
+
+        if not self.drop_budget.allow(now):
+            self.kick(f"flooding, dropped {sum(self.drops.values())} messages")
+        return False
+
+    def kick(self, reason, park=False):
+        print(f"Client {self.client_id} kicked: {reason}")
+        self.kicked = True
+        self.recv_buffer.clear()
+        self.connection_loss(park=park)
+        try:
+            self._quic.close(reason_phrase=reason)
+            self.transmit()
+        except:
+            pass
 
     def handle_message(self, data):
         msg_type = data[0]  # We use binary protocol. The first byte is the message type
@@ -176,7 +430,7 @@ class GameServerProtocol(QuicConnectionProtocol):
             typee = struct.unpack("!B", data[1:])
             typee = int(typee[0])
             if typee == 0:
-                self.connection_loss()
+                self.connection_loss(park=False)  # the player quit on purpose
 
         elif msg_type == 1:  # If msg type is 1 (aka I chose it to be intent movement)
             intent, seq = struct.unpack("!BH", data[1:])  # Unpack the data as a structure
@@ -186,120 +440,96 @@ class GameServerProtocol(QuicConnectionProtocol):
             if seq_newer(seq, self.last_seq):
                 self.last_seq = seq
                 self.current_intent = intent
+                if self in CONNECTED_CLIENTS:
+                    MOVERS.add(self)
+                RECORDER.input(TICK_COUNT, self.record_id, intent, seq)
 
-        elif msg_type == 5:
-            self.last_heartbeat = time.time()
+        elif msg_type == 9:  # join, the first message a client sends
+            if self.joining:
+                return
+            self.joining = True
+
+            token = data[1:]
+            if not token:
+                player_id = 0  # guest
+            else:
+                player_id = verify_token(SESSION_SECRET, token)  # no database round trip
+                if player_id is None:
+                    print("join rejected: bad session token")
+                    self._quic.close()
+                    self.transmit()
+                    return
+
+            if OVERLOAD.level >= LEVEL_BATCH_JOINS or JOIN_QUEUE:
+                JOIN_QUEUE.append((self, player_id))  # admitted by the movement tick
+                self.queued = True
+                self.open_streams()
+                return
 
-            payload = struct.pack("!B", 6) # msg type 6 = pong
-            packet = struct.pack("!H", len(payload)) + payload
-            self._quic.send_stream_data(self.control_stream_id, packet, end_stream=False)
-            self.transmit()
+            asyncio.create_task(self.safe_handle_handshake(player_id))
+
+        elif msg_type == 5:
+            # liveness was already refreshed when the data arrived,
+            # the pong goes out with the next flush
+            if len(data) == 3:
+                self.rtt = struct.unpack("!H", data[1:])[0] / 1000
+            PENDING_PONGS.add(self)
+
+        elif msg_type == 12:  # map chunk request, the client only asks for what its cache lacks
+            if self not in CONNECTED_CLIENTS:
+                return
+            _, cx, cy = CHUNK_REQUEST.unpack(data)
+            packet = MAP_CHUNKS.packet(cx, cy)
+            if packet is not None:
+                self.queue_control(packet)
 
     # ===========================
     # MOVEMENT & COLLISIONS
     # ===========================
 
     def change_pos(self, intent):
-        dx = dy = 0
-
-        if intent & SPRINT and not intent & CROUCH:
-            if intent & UP:
-                dy -= SPRINT_SPEED
-            if intent & DOWN:
-                dy += SPRINT_SPEED
-            if intent & LEFT:
-                dx -= SPRINT_SPEED
-            if intent & RIGHT:
-                dx += SPRINT_SPEED
-        elif intent & CROUCH and not intent & SPRINT:
-            if intent & UP:
-                dy -= CROUCH_SPEED
-            if intent & DOWN:
-                dy += CROUCH_SPEED
-            if intent & LEFT:
-                dx -= CROUCH_SPEED
-            if intent & RIGHT:
-                dx += CROUCH_SPEED
-        else:
-            if intent & UP:
-                dy -= SPEED
-            if intent & DOWN:
-                dy += SPEED
-            if intent & LEFT:
-                dx -= SPEED
-            if intent & RIGHT:
-                dx += SPEED
-
-        if dx != 0 and dy != 0:
-            scale = 1 / math.sqrt(2)
-            dx *= scale
-            dy *= scale
-
+        dx, dy = INTENT_DELTAS[intent & INTENT_MASK]
         if dx != 0 or dy != 0:
             self.collisions(dx, dy)
 
     def collisions(self, dx, dy):
-        allow_x = True
-        allow_y = True
-
-        for client in list(CONNECTED_CLIENTS):
-            if client is self:
-                continue
-
-            # --- Check overlap ---
-            overlap_x = abs(self.x - client.x) < PLAYER_WIDTH
-            overlap_y = abs(self.y - client.y) < PLAYER_HEIGHT
-
-            # --- If overlapping: only allow moving AWAY ---
-            if overlap_x and overlap_y:
-                if dx != 0 and (self.x - client.x) * dx < 0:
-                    allow_x = False
-                if dy != 0 and (self.y - client.y) * dy < 0:
-                    allow_y = False
-                continue
-
-            # --- Normal collision ---
-            if dx != 0:
-                test_x = self.x + dx
-                if abs(test_x - client.x) < PLAYER_WIDTH and abs(self.y - client.y) < PLAYER_HEIGHT:
-                    allow_x = False
-
-            if dy != 0:
-                test_y = self.y + dy
-                if abs(self.x - client.x) < PLAYER_WIDTH and abs(test_y - client.y) < PLAYER_HEIGHT:
-                    allow_y = False
-
-        # --- Apply movement ONCE ---
-        if allow_x:
-            self.x += dx
-        if allow_y:
-            self.y += dy
-
-        # --- Clamp to map ---
-        self.x = max(
-            -MAP_HALF_WIDTH,
-            min(self.x, MAP_HALF_WIDTH - PLAYER_WIDTH)
-        )
-        self.y = max(
-            -MAP_HALF_HEIGHT,
-            min(self.y, MAP_HALF_HEIGHT - PLAYER_HEIGHT)
-        )
+        # a step reaches far less than a chunk, only the chunks next to ours can be hit
+        others = [(client.x, client.y) for client in CHUNKS.neighbours(self.chunk) if client is not self]
+        self.x, self.y = collide(self.x, self.y, dx, dy, others, TERRAIN.boxes_near(self.x, self.y, dx, dy))
 
     # ===========================
     # CONNECTION LOSS
     # ===========================
 
-    def connection_loss(self):
-        if self in CONNECTED_CLIENTS:
-            CONNECTED_CLIENTS.remove(self)
-
+    def connection_loss(self, park=True):
+        self.queued = False  # admit_joins skips us
+        HEARTBEAT_WHEEL.cancel(self)
+        PENDING_PONGS.discard(self)
+        DIRTY_CLIENTS.discard(self)
+        MOVERS.discard(self)
+        SCHEDULED.discard(self)
+
+        if PLAYERS_BY_ID.get(self.player_id) is self:
+            del PLAYERS_BY_ID[self.player_id]
+
+        if self not in CONNECTED_CLIENTS:
+            return  # never joined or already removed
+
+        CONNECTED_CLIENTS.remove(self)
+        CHUNKS.remove(self)
+        self.save_state()
+
+        if park and self.player_id:
+            # keep the player in the world for a while in case it reconnects
+            RECORDER.park(TICK_COUNT, self.record_id)
+            park_player(self.player_id, self)
+            GRACE_WHEEL.schedule(self.player_id, time.monotonic() + RECONNECT_GRACE)
+            print(f"Client {self.client_id} dropped, parked for {RECONNECT_GRACE}s")
+            return
+
+        RECORDER.leave(TICK_COUNT, self.record_id)
         print(f"Client {self.client_id} disconnected")
-
-        for client in list(CONNECTED_CLIENTS):
-                payload = struct.pack ("!B16s",3,self.client_id.bytes)
-                packet = struct.pack("!H", len(payload)) + payload
-                client._quic.send_stream_data(client.state_stream_id, packet, end_stream=False)
-                client.transmit()
+        broadcast_leave(self.client_id)
 
     def connection_lost(self, exc):
         self.connection_loss()
@@ -309,50 +539,118 @@ class GameServerProtocol(QuicConnectionProtocol):
     # ===========================
 
     def broadcast_world_state(self):
-        for client in list(CONNECTED_CLIENTS):
-            if client is not self:
-                payload = struct.pack(
-                    "!B16sfff",           # means transfer one byte 16 bytes and two floats
-                    1,                    # msg_type = world update
-                    self.client_id.bytes,     # who moved in bytes format
-                    self.x,
-                    self.y,
-                    self.hp
-                )
-
-                packet = struct.pack("!H", len(payload)) + payload
-                client._quic.send_stream_data(client.state_stream_id, packet, end_stream=False)
-                client.transmit()
-
-    def broadcast_online_clients(self):
-        for client in list(CONNECTED_CLIENTS):
-            payload = struct.pack(
-                "!B16sfff",
-                2,                    # msg_type = online members
-                client.client_id.bytes,
-                client.x,
-                client.y,
-                client.hp
-            )
-
-            packet = struct.pack("!H", len(payload)) + payload
-            self._quic.send_stream_data(self.state_stream_id, packet, end_stream=False)
-            self.transmit()
+        # marks us as changed for the players around us, the update scheduler decides when it
+        # goes out. Clients that see our chunk get us with its block instead, those further
+        # than FAR_VIEW_CHUNKS forgot us when we left their range
+        old_chunk = self.chunk
+        if CHUNK_UPDATES:
+            CHUNKS.mark(self)
+        else:
+            CHUNKS.place(self)  # collisions still look players up by chunk
+        if old_chunk is not None and self.chunk != old_chunk:
+            self.cross_chunks(old_chunk)
+
+        # the view squares are symmetric: who sees our chunk is who stands in a chunk we see
+        seen_from = CHUNKS.view(self.chunk) if CHUNK_UPDATES else ()
+        for client in CHUNKS.neighbours(self.chunk, FAR_VIEW_CHUNKS):
+            if client is not self and client.viewer and client.chunk not in seen_from:
+                client.schedule(self)
+
+    def cross_chunks(self, old_chunk):
+        """We moved from old_chunk: players that are no longer within FAR_VIEW_CHUNKS
+        of us and we drop each other, the ones that came within it are scheduled for
+        us. They get us from our own update.
+        """
+        before = CHUNKS.square(old_chunk, FAR_VIEW_CHUNKS)
+        after = CHUNKS.square(self.chunk, FAR_VIEW_CHUNKS)
+
+        for other in CHUNKS.members_in(before - after):
+            if other.viewer:
+                other.drop_from_view(self.client_id)
+            self.drop_from_view(other.client_id)
+
+        for other in CHUNKS.members_in(after - before):
+            if other is not self:
+                self.schedule(other)
+
+        if CHUNK_UPDATES:
+            # only blocks kept us current on the chunks we no longer see, and we miss their last ones
+            for other in CHUNKS.members_in((CHUNKS.view(old_chunk) - CHUNKS.view(self.chunk)) & after):
+                self.schedule(other)
+
+    def learn_far_players(self):
+        """On join: players beyond our view chunks but within FAR_VIEW_CHUNKS, who
+        would otherwise stay unknown until they move. The view chunks come in full.
+        """
+        ring = CHUNKS.square(self.chunk, FAR_VIEW_CHUNKS) - CHUNKS.view(self.chunk)
+        for other in CHUNKS.members_in(ring):
+            self.schedule(other)
+
+    def schedule(self, entity):
+        """entity changed, it goes out with our next turn of the update scheduler"""
+        if entity.client_id in self.unsent:
+            self.superseded_updates += 1  # the newer state replaces the unsent one
+        else:
+            self.unsent[entity.client_id] = [0.0, entity]
+            SCHEDULED.add(self)
+
+    def drop_from_view(self, client_id):
+        """The player went out of our range, we hear nothing more about it until it comes back"""
+        self.unsent.pop(client_id, None)  # would bring the player back
+        payload = struct.pack("!B16s", 3, client_id.bytes)
+        self.queue_state(struct.pack("!H", len(payload)) + payload)
+
+    def world_update(self):
+        payload = struct.pack(
+            "!B16sfff",           # means transfer one byte 16 bytes and two floats
+            1,                    # msg_type = world update
+            self.client_id.bytes,     # who moved in bytes format
+            self.x,
+            self.y,
+            self.hp
+        )
+        return struct.pack("!H", len(payload)) + payload
+
+    def build_roster(self):
+        """Everyone in the chunks we see, parked players too, as compressed roster messages (type 10).
+
+        Players further away, up to FAR_VIEW_CHUNKS, come from the update
+        scheduler, see learn_far_players.
+        """
+        entries = [
+            struct.pack("!16sfff", client.client_id.bytes, client.x, client.y, client.hp)
+            for client in CHUNKS.neighbours(self.chunk, VIEW_CHUNKS)
+            if client is not self
+        ]
+
+        packets = bytearray()
+        for i in range(0, max(len(entries), 1), ROSTER_CHUNK):  # an empty world still gets one
+            chunk = entries[i:i + ROSTER_CHUNK]
+            payload = struct.pack("!BH", 10, len(chunk)) + zlib.compress(b"".join(chunk))
+            packets += struct.pack("!H", len(payload)) + payload
+        return bytes(packets)
 
     def broadcast_new_connection(self):
-        for client in list(CONNECTED_CLIENTS):
-            payload = struct.pack(
-                "!B16sfff",
-                2,
-                self.client_id.bytes,
-                self.x,
-                self.y,
-                self.hp
-            )
-
-            packet = struct.pack("!H", len(payload)) + payload
-            client._quic.send_stream_data(client.state_stream_id, packet, end_stream=False)
-            client.transmit()
+        payload = struct.pack(
+            "!B16sfff",
+            2,
+            self.client_id.bytes,
+            self.x,
+            self.y,
+            self.hp
+        )
+        packet = struct.pack("!H", len(payload)) + payload
+
+        # goes out with the next batched update of everyone who sees us,
+        # the others within FAR_VIEW_CHUNKS get us from the update scheduler
+        seen_from = CHUNKS.view(self.chunk)
+        for client in CHUNKS.neighbours(self.chunk, FAR_VIEW_CHUNKS):
+            if client is self or not client.viewer:
+                continue
+            if client.chunk in seen_from:
+                client.queue_state(packet)
+            else:
+                client.schedule(self)
 
     def send_self_movement(self):
         payload = struct.pack(
@@ -365,8 +663,25 @@ class GameServerProtocol(QuicConnectionProtocol):
         )
 
         packet = struct.pack("!H", len(payload)) + payload
-        self._quic.send_stream_data(self.control_stream_id, packet, end_stream=False)
-        self.transmit()
+
+        if self.lagging:
+            if self.pending_self_movement is not None:
+                self.superseded_updates += 1
+            self.pending_self_movement = packet  # only the newest one matters
+            DIRTY_CLIENTS.add(self)
+            return
+
+        self.queue_control(packet)
+
+    def send_queue_position(self, position):
+        payload = struct.pack("!BH", 15, min(position, 0xFFFF))  # msg type 15 = still queued, at position
+        packet = struct.pack("!H", len(payload)) + payload
+        self.queue_control(packet)
+
+    def send_pong(self):
+        payload = struct.pack("!B", 6) # msg type 6 = pong
+        packet = struct.pack("!H", len(payload)) + payload
+        self.queue_control(packet)
 
     def send_hp_update(self):
         payload = struct.pack(
@@ -378,8 +693,7 @@ class GameServerProtocol(QuicConnectionProtocol):
         )
 
         packet = struct.pack("!H", len(payload)) + payload
-        self._quic.send_stream_data(self.control_stream_id, packet, end_stream=False)
-        self.transmit()
+        self.queue_control(packet)
 
     def broadcast_hp_update(self):
         payload = struct.pack(
@@ -395,13 +709,150 @@ class GameServerProtocol(QuicConnectionProtocol):
             if client is self:
                 continue
 
-            client._quic.send_stream_data(client.control_stream_id, packet, end_stream=False)
-            client.transmit()
+            client.queue_control(packet)
+
+    # ===========================
+    # OUTBOX
+    # ===========================
+
+    def queue_control(self, packet):
+        self.control_outbox += packet
+        DIRTY_CLIENTS.add(self)
 
-    def respawn(self):
+    def queue_state(self, packet):
+        self.state_outbox += packet
+        DIRTY_CLIENTS.add(self)
+
+    # ===========================
+    # UPDATE SCHEDULER
+    # ===========================
+
+    def update_budget(self):
+        """Bytes of world updates we may send this tick, smaller on slow links"""
+        if self.rtt <= BUDGET_RTT:
+            return UPDATE_BUDGET
+        return max(MIN_UPDATE_BUDGET, int(UPDATE_BUDGET * BUDGET_RTT / self.rtt))
+
+    def send_scheduled_updates(self):
+        """Priority accumulator: every changed entity gains priority each tick,
+        more the closer it is. The highest ones that fit in the budget are sent
+        and reset, the rest carry their priority over to the next tick.
+        """
+        if self.lagging:
+            return  # they keep accumulating until the client catches up
+
+        # under load far entities sit out every other tick
+        skip_far = OVERLOAD.level >= LEVEL_FAR_HALF_RATE and TICK_COUNT % 2
+
+        # our view chunks reach us as blocks sooner or later, even the ones our budget holds back
+        seen = CHUNKS.view(self.chunk) if CHUNK_UPDATES else ()
+        candidates = []
+        for client_id, entry in list(self.unsent.items()):
+            entity = entry[1]
+            if entity.chunk in seen:
+                del self.unsent[client_id]  # came into view, its chunk block has it
+                continue
+            distance = abs(entity.x - self.x) + abs(entity.y - self.y)
+            entry[0] += 1.0 / (1.0 + distance / PRIORITY_DISTANCE)
+
+            if not (skip_far and distance > FAR_DISTANCE):
+                candidates.append(client_id)
+
+        budget = self.update_budget()
+        if CHUNK_UPDATES:
+            # a turn covers all the ticks since the last one, less what the chunk blocks took
+            blocks = self.block_bytes if self.block_turn == self.far_turn_of(TICK_COUNT) else 0
+            budget = max(MIN_UPDATE_BUDGET, budget - blocks // FAR_UPDATE_EVERY) * FAR_UPDATE_EVERY
+        count = budget // UPDATE_SIZE
+        if len(candidates) <= count:
+            chosen = candidates
+        else:
+            chosen = heapq.nlargest(count, candidates, key=lambda cid: self.unsent[cid][0])
+
+        for client_id in chosen:
+            entity = self.unsent.pop(client_id)[1]
+            self.queue_state(entity.world_update())
+
+    def send_chunk_updates(self):
+        """The shared blocks of the chunks around us"""
+        if self.lagging:
+            CHUNKS.unsubscribe(self)  # after catching up everything comes in full
+            return
+
+        packet = CHUNKS.updates_for(self, self.update_budget())
+        if packet:
+            self.queue_state(packet)
+
+            # counted against our next turn of the scheduler
+            turn = self.far_turn_of(TICK_COUNT)
+            if self.block_turn != turn:
+                self.block_turn = turn
+                self.block_bytes = 0
+            self.block_bytes += len(packet)
+
+    def far_turn_of(self, tick):
+        """Our turn of the update scheduler that covers tick"""
+        return (tick - self.far_turn - 1) // FAR_UPDATE_EVERY
+
+    def stream_backlog(self):
+        """Bytes written to our streams that the client has not acknowledged yet"""
+        backlog = 0
+        for stream_id in (self.control_stream_id, self.state_stream_id):
+            stream = self._quic._streams.get(stream_id)
+            if stream is not None:
+                backlog += stream.sender._buffer_stop - stream.sender._buffer_start
+        return backlog
+
+    def update_backpressure(self, now):
+        self.backlog_bytes = self.stream_backlog()
+
+        if self.backlog_bytes > BACKLOG_HARD_LIMIT or (
+            self.lagging and now - self.lag_since > LAG_CUTOFF
+        ):
+            self.kick(f"too slow, {self.backlog_bytes} bytes behind", park=True)
+            return
+
+        if not self.lagging and self.backlog_bytes > BACKLOG_LIMIT:
+            self.lagging = True
+            self.lag_since = now
+            print(f"Client {self.client_id} is lagging, {self.backlog_bytes} bytes behind")
+
+        elif self.lagging and self.backlog_bytes < BACKLOG_RESUME:
+            self.lagging = False
+
+        if self.lagging:
+            DIRTY_CLIENTS.add(self)  # check again next tick
+            return
+
+        # caught up, the scheduler sends the held back positions again
+        if self.pending_self_movement is not None:
+            self.control_outbox += self.pending_self_movement
+            self.pending_self_movement = None
+
+    def flush(self, now):
+        self.update_backpressure(now)
+        if self.kicked:
+            return
+
+        # one write per stream and one transmit, however many messages were queued
+        if self.control_outbox:
+            self._quic.send_stream_data(self.control_stream_id, bytes(self.control_outbox), end_stream=False)
+            self.control_outbox.clear()
+        if self.state_outbox:
+            self._quic.send_stream_data(self.state_stream_id, bytes(self.state_outbox), end_stream=False)
+            self.state_outbox.clear()
+        self.transmit()
+
+    def save_state(self):
+        if self.player_id:
+            PLAYER_STORE.mark_dirty(self.player_id, self.x, self.y, self.hp)
+
+    def respawn(self, now):
         self.x = -PLAYER_WIDTH // 2
         self.y = -PLAYER_HEIGHT // 2
         self.hp = 100
+        self.save_state()
+        self.update_tile(now)
 
         # important: new authoritative event
         self.damage_seq = (self.damage_seq + 1) & 0xFFFF
@@ -411,15 +862,100 @@ class GameServerProtocol(QuicConnectionProtocol):
         self.send_self_movement()
         self.broadcast_world_state()
 
+    # ===========================
+    # HAZARDS
+    # ===========================
+
+    def foot_tile(self):
+        tx = int((self.x + MAP_HALF_WIDTH) // TILE_SIZE)
+        ty = int((self.y + (PLAYER_HEIGHT - 15) + MAP_HALF_HEIGHT) // TILE_SIZE)
+        return tx, ty
+
+    def update_tile(self, now):
+        """Called after we moved. Only stepping onto a tile with a different
+        hazard does anything, and that is the only place damage gets scheduled.
+        """
+        tile = self.foot_tile()
+        if tile == self.tile:
+            return
+        self.tile = tile
+
+        hazard = HAZARD_TILES.get(tile)
+        if hazard == self.hazard:
+            return
+
+        self.hazard = hazard
+        self.hazard_generation += 1  # deadlines of the previous hazard no longer count
+
+        if hazard is not None:
+            self.hazard_since = now
+            schedule_hazard(self, now + HAZARDS[hazard]["interval"])
+
+    def take_hazard_damage(self, damage, now):
+        self.damage_seq = (self.damage_seq + 1) & 0xFFFF
+        self.hp -= damage
+        self.save_state()
+
+        if self.hp <= 0:
+            self.respawn(now)
+            return
+
+        self.send_hp_update()
+        self.broadcast_hp_update()
+
+
+# ===========================
+# PARKED PLAYERS
+# ===========================
+class ParkedBody:
+    """A dropped player waiting for its owner to come back. It stays in
+    CHUNKS: it blocks movement and goes out in chunk blocks and rosters like
+    a connected player, but nothing is sent to it.
+    """
+    viewer = False
+
+    def __init__(self, client):
+        self.client_id = client.client_id
+        self.record_id = client.record_id
+        self.x = client.x
+        self.y = client.y
+        self.hp = client.hp
+        self.chunk = None
+        self.subscribed = frozenset()
+
+    world_update = GameServerProtocol.world_update
+
+
+def park_player(player_id, client):
+    body = PARKED_PLAYERS[player_id] = ParkedBody(client)
+    CHUNKS.place(body, viewer=False)
+    return body
+
+
+def unpark_player(player_id):
+    body = PARKED_PLAYERS.pop(player_id)
+    CHUNKS.remove(body)
+    return body
+
 
 # ===========================
 # ONE TIME FUNCTION
 # ===========================
+def broadcast_leave(client_id):
+    payload = struct.pack("!B16s", 3, client_id.bytes)
+    packet = struct.pack("!H", len(payload)) + payload
+
+    for client in list(CONNECTED_CLIENTS):
+        client.unsent.pop(client_id, None)  # would bring the player back
+        client.queue_state(packet)
+
+
 def seq_newer(a, b):
     return ((a - b) & (SEQ_MAX - 1)) < SEQ_HALF
 
 async def load_tile_map(path: str):
     tile_dict = {}
+    hazard_tiles = {}
 
     with open(path, "r", encoding="utf-8") as f:
         for ty, line in enumerate(f):
@@ -431,42 +967,220 @@ async def load_tile_map(path: str):
 
                 tile_dict[(tx, ty)] = walkable
 
-    return tile_dict
+                if ch in TILE_HAZARDS:
+                    hazard_tiles[(tx, ty)] = TILE_HAZARDS[ch]
+
+    return tile_dict, hazard_tiles
+
+async def load_world(spawn_npcs=True):
+    """Everything the map feeds: tiles and hazards, solid terrain, the chunks clients download and the NPCs.
+
+    The replay and the benchmarks call this too, so their players walk into the same walls.
+    """
+    global TILE_DICT, HAZARD_TILES
+
+    TILE_DICT, HAZARD_TILES = await load_tile_map(MAP_PATH)
+    with open(MAP_PATH, "r", encoding="utf-8") as f:
+        rows = [line.strip("\n") for line in f]
+    TERRAIN.load(rows)
+    MAP_CHUNKS.load(rows)
+
+    NPCS.set_map(TILE_DICT)
+    if spawn_npcs:
+        for habitat, count in NPC_SPAWNS.items():
+            NPCS.spawn(count, habitat)
 
 # ===========================
 # BACKGROUND TASKS
 # ===========================
 async def server_movement_tick():
+    global TICK_COUNT
+
     while True:
+        expected = time.perf_counter() + SERVER_TICK
         await asyncio.sleep(SERVER_TICK)
-        for client in list(CONNECTED_CLIENTS):
-            if client.current_intent & DIR_MASK:
-                client.change_pos(client.current_intent)
-                client.send_self_movement()
-                client.broadcast_world_state()
-                client.current_intent = 0
+        start = time.perf_counter()
+        TICK_COUNT += 1
 
+        admit_joins()
+        now = time.monotonic()
+        send_queue_keepalives(now)
+        RECORDER.tick(TICK_COUNT, now)
+        simulate_tick(now)
 
-async def check_tile():
-    while True:
-        await asyncio.sleep(LAVA_INTERVAL)
+        flush_pongs()
+        flush_outboxes()
 
-        for client in list(CONNECTED_CLIENTS):
-            tx = int((client.x + MAP_HALF_WIDTH) // TILE_SIZE)
-            ty = int((client.y + (PLAYER_HEIGHT - 15) + MAP_HALF_HEIGHT) // TILE_SIZE)
+        # how long we worked plus how late we woke up, the loop was busy either way
+        OVERLOAD.record(time.perf_counter() - start, max(0.0, start - expected), start)
 
-            walkable = TILE_DICT.get((tx, ty), True)
+        # what is left of this tick's budget is ours to collect garbage in
+        GC_PACER.collect_in_slack(start + SERVER_TICK)
 
-            if not walkable:
-                client.damage_seq = (client.damage_seq + 1) & 0xFFFF
-                client.hp -= LAVA_DAMAGE
 
-                if client.hp <= 0:
-                    client.respawn()
-                    continue
+def simulate_tick(now):
+    """Everything a tick does to the world, also run by replay.py without a network.
+
+    Only what is active costs anything: clients that sent an intent, hazards
+    that came due, NPCs near players and viewers of chunks that changed.
+    """
+    # in join order, so a replay moves everyone in the order the server did
+    movers = sorted(MOVERS, key=lambda client: client.record_id)
+    MOVERS.clear()
+    for client in movers:
+        if client.current_intent & DIR_MASK:
+            client.change_pos(client.current_intent)
+            client.update_tile(now)
+            client.save_state()
+            client.send_self_movement()
+            client.broadcast_world_state()
+            client.current_intent = 0
+
+    if OVERLOAD.level < LEVEL_SLOW_CHECKS or TICK_COUNT % 2 == 0:
+        process_hazards(now)
+
+    if NPCS.count and (OVERLOAD.level < LEVEL_SLOW_CHECKS or TICK_COUNT % 2 == 0):
+        step_npcs()
+
+    send_world_updates()
+
+
+def send_world_updates():
+    if CHUNK_UPDATES:
+        CHUNKS.encode()
+        for client in CHUNKS.audience():
+            client.send_chunk_updates()
 
-                client.send_hp_update()
-                client.broadcast_hp_update()
+    # out of view changes wait for the client's turn, so a tick only sees some of them
+    for client in list(SCHEDULED):
+        if CHUNK_UPDATES and (TICK_COUNT - client.far_turn) % FAR_UPDATE_EVERY:
+            continue
+        if client.unsent:
+            client.send_scheduled_updates()
+        if not client.unsent:
+            SCHEDULED.discard(client)
+
+
+def step_npcs():
+    players = list(CONNECTED_CLIENTS)
+    px = np.fromiter((client.x for client in players), dtype=float, count=len(players))
+    py = np.fromiter((client.y for client in players), dtype=float, count=len(players))
+
+    NPCS.step(px, py, TICK_COUNT)
+    NPCS.send_updates(players, TICK_COUNT)
+
+
+def admit_joins():
+    for _ in range(min(JOINS_PER_TICK, len(JOIN_QUEUE))):
+        client, player_id = JOIN_QUEUE.popleft()
+        if client.queued and not client.kicked and not client._closed.is_set():  # may have left while waiting
+            client.queued = False
+            asyncio.create_task(client.safe_handle_handshake(player_id))
+
+
+def send_queue_keepalives(now):
+    """Tells every waiting join its place in the queue now and then, so the
+    client hears from us while it waits and does not time out.
+    """
+    global NEXT_KEEPALIVE
+
+    if now < NEXT_KEEPALIVE or not JOIN_QUEUE:
+        return
+    NEXT_KEEPALIVE = now + QUEUE_KEEPALIVE
+
+    position = 0
+    for client, _ in JOIN_QUEUE:
+        if client.queued:
+            position += 1
+            client.send_queue_position(position)
+
+
+def schedule_hazard(client, due):
+    heapq.heappush(HAZARD_QUEUE, (due, next(HAZARD_ORDER), client, client.hazard_generation))
+
+
+def process_hazards(now):
+    # only players standing on a hazard have deadlines, so this costs nothing for everyone else
+    while HAZARD_QUEUE and HAZARD_QUEUE[0][0] <= now:
+        due, _, client, generation = heapq.heappop(HAZARD_QUEUE)
+
+        if generation != client.hazard_generation or client not in CONNECTED_CLIENTS:
+            continue  # stepped off, respawned or left
+
+        rule = HAZARDS[client.hazard]
+        schedule_hazard(client, due + rule["interval"])
+        client.take_hazard_damage(rule["damage"], now)
+
+
+def overload_metrics():
+    return {
+        "level": OVERLOAD.level,
+        "load": OVERLOAD.load,
+        "queued_joins": len(JOIN_QUEUE),
+    }
+
+
+def gc_metrics():
+    return GC_PACER.metrics()
+
+
+def flush_pongs():
+    # pongs ride along in the same write, clients time them to measure RTT
+    for client in list(PENDING_PONGS):
+        if client in CONNECTED_CLIENTS or client.queued:
+            client.send_pong()
+    PENDING_PONGS.clear()
+
+
+def flush_outboxes():
+    now = time.monotonic()
+    dirty = list(DIRTY_CLIENTS)
+    DIRTY_CLIENTS.clear()  # lagging clients add themselves back while flushing
+
+    for client in dirty:
+        if client in CONNECTED_CLIENTS or client.queued:
+            client.flush(now)
+
+
+def lag_metrics():
+    """Per-client backlog, for clients that are behind or were behind before"""
+    now = time.monotonic()
+    return {
+        client.client_id: {
+            "backlog_bytes": client.backlog_bytes,
+            "lagging_for": now - client.lag_since if client.lagging else 0.0,
+            "superseded_updates": client.superseded_updates,
+        }
+        for client in CONNECTED_CLIENTS
+        if client.lagging or client.superseded_updates
+    }
+
+
+def server_metrics():
+    """Everything the server measures about itself, ready for json"""
+    return {
+        "time": time.time(),
+        "tick": TICK_COUNT,
+        "players": len(CONNECTED_CLIENTS),
+        "parked": len(PARKED_PLAYERS),
+        "overload": overload_metrics(),
+        "lag": {str(client_id): lag for client_id, lag in lag_metrics().items()},
+        "gc": gc_metrics(),
+        "dropped_messages": {str(msg_type): count for msg_type, count in DROP_COUNTS.items()},
+    }
+
+
+async def publish_metrics():
+    """Background task that rewrites METRICS_PATH every METRICS_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        # write then rename, so a reader never gets half a file
+        try:
+            with open(METRICS_PATH + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(server_metrics(), f)
+            os.replace(METRICS_PATH + ".tmp", METRICS_PATH)
+        except OSError as e:
+            print("could not write metrics:", e)
 
 
 async def broadcast_server():
@@ -488,20 +1202,45 @@ async def broadcast_server():
 
 
 async def check_heartbeats():
-    """Background task to detect dead connections"""
+    """Background task to detect dead connections.
+
+    Only clients whose wheel slot came due are looked at. A client that was
+    active since it was scheduled just gets pushed to its new deadline.
+    """
     while True:
-        await asyncio.sleep(2)
-        current_time = time.time()
+        steps = 2 if OVERLOAD.level >= LEVEL_SLOW_CHECKS else 1
+        await asyncio.sleep(HEARTBEAT_WHEEL.tick * steps)
+        current_time = time.monotonic()
 
-        for client in list(CONNECTED_CLIENTS):
-            if current_time - client.last_heartbeat > client.heartbeat_timeout:
-                print(f"Client {client.client_id} timed out (no heartbeat)")
-                client.connection_loss()
-                try:
-                    client._quic.close()
-                except:
-                    print("cant close connection")
-                    pass
+        for client in HEARTBEAT_WHEEL.advance(current_time):
+            deadline = client.last_heartbeat + client.heartbeat_timeout
+
+            if current_time < deadline:
+                HEARTBEAT_WHEEL.schedule(client, deadline)
+                continue
+
+            print(f"Client {client.client_id} timed out (no heartbeat)")
+            client.connection_loss()
+            try:
+                client._quic.close()
+            except:
+                print("cant close connection")
+                pass
+
+
+async def expire_parked_players():
+    """Background task that lets parked players leave once their grace period is over"""
+    while True:
+        await asyncio.sleep(GRACE_WHEEL.tick)
+
+        for player_id in GRACE_WHEEL.advance(time.monotonic()):
+            if player_id not in PARKED_PLAYERS:
+                continue
+
+            body = unpark_player(player_id)
+            RECORDER.expire(TICK_COUNT, body.record_id)
+            print(f"Client {body.client_id} disconnected (grace period over)")
+            broadcast_leave(body.client_id)
 
 
 async def start_server():
@@ -516,27 +1255,43 @@ async def start_server():
     # The certificate contains my public key and the server identity info.
     # The certificate proves who you are and the private key proves you own it.
 
+    PLAYER_STORE.start()
+    if RECORD_INPUTS:
+        RECORDER.start()
+
     asyncio.create_task(check_heartbeats())
+    asyncio.create_task(expire_parked_players())
     asyncio.create_task(server_movement_tick())
-    asyncio.create_task(check_tile())
+    asyncio.create_task(publish_metrics())
 
     await serve(  # Pause the whole function until this is done (until server is fully started)
         "0.0.0.0",  # Anyone wanting to connect can connect
         4433,  # The server is on port 4433
         configuration=config,  # Set the configuration (rules of the connection)
-        create_protocol=GameServerProtocol  # For each client connection, create a new GameServerProtocol objet
+        create_protocol=GameServerProtocol,  # For each client connection, create a new GameServerProtocol objet
+        session_ticket_fetcher=TICKET_STORE.pop,  # resume known clients without a full handshake
+        session_ticket_handler=TICKET_STORE.add
     )
 
     try:
         await asyncio.Future()  # Run this forever
     except asyncio.CancelledError:
         print()
+    finally:
+        PLAYER_STORE.stop()  # write out the last dirty states
+        RECORDER.stop()
 
 
 async def main():
-    global TILE_DICT
+    global SESSION_SECRET
+
+    await load_world()
+    SESSION_SECRET = load_secret(SESSION_KEY_PATH)
 
-    TILE_DICT = await load_tile_map(MAP_PATH)
+    GC_PACER.watch()
+    if GC_PACED:
+        frozen = GC_PACER.take_over()  # everything loaded so far lives as long as the server
+        print(f"froze {frozen} objects, full collections run between ticks")
 
     server_task = asyncio.create_task(start_server())
     broadcast_task = asyncio.create_task(broadcast_server())
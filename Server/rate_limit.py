@@ -0,0 +1,25 @@
+# ===========================
+# TOKEN BUCKET
+# ===========================
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average and bursts of up to `burst`"""
+
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def allow(self, now, cost=1):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        if self.tokens < cost:
+            return False
+
+        self.tokens -= cost
+        return True
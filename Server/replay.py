@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import os
+import struct
+import sys
+import time
+import uuid
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # the map is next to the server
+
+import quick_server_noredis as server
+from loopback import LoopbackClient
+from replay_log import EXPIRE, INPUT, JOIN, LEAVE, PARK, TICK, read_replay
+
+# Headless replay: feeds a log written with RECORD_INPUTS = True back through
+# simulate_tick as fast as the CPU allows. No sockets and no sleeping, every
+# tick runs with the clock it had on the server so hazards fire the same way.
+# The checksum at the end covers every position and hp, at the end or when
+# the player left, so two tick engines can be compared on the same captured
+# traffic.
+LOG_PATH = sys.argv[1] if len(sys.argv) > 1 else "inputs.replay"
+SLOWEST = 5  # slowest ticks to list
+
+
+def headless_client():
+    """A GameServerProtocol on the loopback transport, nobody reads what it sends"""
+    return LoopbackClient(server.GameServerProtocol).protocol
+
+
+def apply(record, connections, left, now):
+    kind, tick, connection = record[:3]
+
+    if kind == JOIN:
+        raw_id, x, y, hp = record[3:]
+        client = headless_client()
+        client.client_id = uuid.UUID(bytes=raw_id)
+        client.x, client.y, client.hp = x, y, hp
+        client.record_id = connection
+        connections[connection] = client
+
+        # headless clients have no player_id, parked bodies go by client_id
+        resumed = client.client_id in server.PARKED_PLAYERS
+        if resumed:
+            server.unpark_player(client.client_id)
+        server.CONNECTED_CLIENTS.add(client)
+        server.CHUNKS.place(client)
+        client.learn_far_players()
+        client.update_tile(now)
+        if not resumed:
+            client.broadcast_new_connection()
+
+    elif kind == INPUT:
+        client = connections.get(connection)
+        if client is not None:
+            intent, seq = record[3:]
+            client.handle_message(struct.pack("!BBH", 1, intent, seq))
+
+    elif kind == LEAVE:
+        client = connections.pop(connection, None)
+        if client is not None:
+            left.append(client)
+            client.connection_loss(park=False)
+
+    elif kind == PARK:
+        client = connections.pop(connection, None)
+        if client is not None:
+            server.CONNECTED_CLIENTS.remove(client)
+            server.CHUNKS.remove(client)
+            server.park_player(client.client_id, client)
+
+    elif kind == EXPIRE:
+        body = next((body for body in server.PARKED_PLAYERS.values() if body.record_id == connection), None)
+        if body is not None:
+            server.unpark_player(body.client_id)
+            left.append(body)
+            server.broadcast_leave(body.client_id)
+
+
+def run_tick(tick, now, costs):
+    server.TICK_COUNT = tick
+    start = time.perf_counter()
+    server.simulate_tick(now)
+    costs.append((time.perf_counter() - start, tick))
+
+    # nothing goes out, only count what would have been sent
+    sent = 0
+    for client in server.DIRTY_CLIENTS:
+        sent += len(client.control_outbox) + len(client.state_outbox)
+        client.control_outbox.clear()
+        client.state_outbox.clear()
+    server.DIRTY_CLIENTS.clear()
+    return sent
+
+
+def checksum(left):
+    """Covers the players still on and those who left, as they were when they left"""
+    digest = hashlib.sha256()
+    for client in sorted(server.CONNECTED_CLIENTS | set(left), key=lambda c: (c.client_id.bytes, c.record_id)):
+        digest.update(struct.pack("!16sddd", client.client_id.bytes, client.x, client.y, client.hp))
+    return digest.hexdigest()[:16]
+
+
+async def main():
+    await server.load_world()  # same walls and NPCs as the recorded run
+
+    records = list(read_replay(LOG_PATH))
+
+    # records before the first tick (players who joined while the recording
+    # started) are applied with that tick's clock
+    first = now = next((record[2] for record in records if record[0] == TICK), None)
+    if first is None:
+        print(f"{LOG_PATH} has no ticks")
+        return
+
+    connections = {}
+    left = []  # clients that left, the checksum still covers them
+    costs = []
+    sent = 0
+
+    start = time.perf_counter()
+    for record in records:
+        if record[0] == TICK:
+            now = record[2]
+            sent += run_tick(record[1], now, costs)
+        else:
+            apply(record, connections, left, now)
+    elapsed = time.perf_counter() - start
+
+    simulated = now - first
+    ordered = sorted(cost for cost, _ in costs)
+    print(f"{len(records)} records, {len(costs)} ticks ({simulated:.1f}s of play) "
+          f"replayed in {elapsed:.2f}s, {simulated / elapsed:.0f}x real time")
+    print(f"tick cost p50 {ordered[len(ordered) // 2] * 1e3:.3f}ms "
+          f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3:.3f}ms "
+          f"max {ordered[-1] * 1e3:.3f}ms")
+    print("slowest ticks:", ", ".join(f"{t} ({c * 1e3:.2f}ms)" for c, t in sorted(costs, reverse=True)[:SLOWEST]))
+    print(f"{sent} bytes queued to clients, {len(server.CONNECTED_CLIENTS)} players left")
+    print("checksum", checksum(left))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import struct
+
+# ===========================
+# REPLAY LOG
+# ===========================
+# Append-only binary log of what went into the simulation: joins, accepted
+# inputs and leaves, each stamped with the server tick it arrived in, and
+# one record per tick with the clock the tick ran at.
+# Connections get a small number at join so inputs do not repeat the uuid.
+# A dropped player is parked instead of leaving; it either joins again with
+# the same client_id on a new connection or expires.
+
+MAGIC = b"MMOR\x01"
+
+JOIN = 0
+INPUT = 1
+LEAVE = 2
+TICK = 3
+PARK = 4
+EXPIRE = 5
+
+RECORD_FORMATS = {
+    JOIN: struct.Struct("!BII16sfff"),  # type, tick, connection, client_id, x, y, hp
+    INPUT: struct.Struct("!BIIBH"),  # type, tick, connection, intent, seq
+    LEAVE: struct.Struct("!BII"),  # type, tick, connection
+    TICK: struct.Struct("!BId"),  # type, tick, monotonic time
+    PARK: struct.Struct("!BII"),  # type, tick, connection that dropped
+    EXPIRE: struct.Struct("!BII"),  # type, tick, connection that dropped
+}
+
+
+class ReplayRecorder:
+    """Writes the log through a large buffer, a record costs one struct pack"""
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.file = None
+        self.records = 0
+
+    def start(self):
+        # one log per server run, connection numbers start over on restart
+        self.file = open(self.path, "wb", buffering=self.buffer_size)
+        self.file.write(MAGIC)
+        print(f"recording inputs to {self.path}")
+
+    def stop(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def tick(self, tick, now):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[TICK].pack(TICK, tick, now))
+
+    def join(self, tick, connection, client_id, x, y, hp):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[JOIN].pack(JOIN, tick, connection, client_id.bytes, x, y, hp))
+            self.records += 1
+
+    def input(self, tick, connection, intent, seq):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[INPUT].pack(INPUT, tick, connection, intent, seq))
+            self.records += 1
+
+    def leave(self, tick, connection):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[LEAVE].pack(LEAVE, tick, connection))
+            self.records += 1
+
+    def park(self, tick, connection):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[PARK].pack(PARK, tick, connection))
+            self.records += 1
+
+    def expire(self, tick, connection):
+        if self.file is not None:
+            self.file.write(RECORD_FORMATS[EXPIRE].pack(EXPIRE, tick, connection))
+            self.records += 1
+
+
+def read_replay(path):
+    """Yields the records of a log as tuples, a cut-off last record is ignored"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a replay log")
+
+    offset = len(MAGIC)
+    while offset < len(data):
+        record = RECORD_FORMATS.get(data[offset])
+        if record is None:
+            raise ValueError(f"unknown record type {data[offset]} at byte {offset}")
+        if offset + record.size > len(data):
+            return  # the server stopped mid-write
+        yield record.unpack_from(data, offset)
+        offset += record.size
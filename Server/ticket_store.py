@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+
+# ===========================
+# TLS SESSION TICKET STORE
+# ===========================
+
+
+class SessionTicketStore:
+    """Bounded store of the TLS session tickets handed out to clients.
+
+    A returning client presents its ticket and resumes without a full
+    handshake or certificate verification. Tickets are single use, which
+    also keeps a replayed 0-RTT join from resuming twice. The oldest
+    tickets are dropped once `max_tickets` is reached.
+    """
+
+    def __init__(self, max_tickets=10_000):
+        self.max_tickets = max_tickets
+        self.tickets = OrderedDict()  # ticket label -> SessionTicket
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def add(self, ticket):
+        self.tickets[ticket.ticket] = ticket
+        self.tickets.move_to_end(ticket.ticket)
+
+        while len(self.tickets) > self.max_tickets:
+            self.tickets.popitem(last=False)
+
+    def pop(self, label):
+        ticket = self.tickets.pop(label, None)
+        if ticket is None or not ticket.is_valid:
+            return None
+        return ticket
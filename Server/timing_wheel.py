@@ -0,0 +1,71 @@
+import math
+
+
+# ===========================
+# HASHED TIMING WHEEL
+# ===========================
+
+
+class TimingWheel:
+    """Hashed timing wheel for connection deadlines.
+
+    Items are hashed into a slot by their deadline tick, so advancing the
+    wheel only looks at the slots that became due instead of every item.
+    """
+
+    def __init__(self, tick=0.5, slots=64):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}  # item -> deadline tick
+
+        self.current_tick = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, item):
+        return item in self.deadlines
+
+    def _tick_of(self, when):
+        return math.ceil(when / self.tick)
+
+    def schedule(self, item, deadline):
+        self.cancel(item)
+
+        deadline_tick = self._tick_of(deadline)
+        if self.current_tick is not None and deadline_tick <= self.current_tick:
+            deadline_tick = self.current_tick + 1  # never schedule into the past
+
+        self.deadlines[item] = deadline_tick
+        self.slots[deadline_tick % len(self.slots)].add(item)
+
+    def cancel(self, item):
+        deadline_tick = self.deadlines.pop(item, None)
+        if deadline_tick is not None:
+            self.slots[deadline_tick % len(self.slots)].discard(item)
+
+    def advance(self, now):
+        """Return every item whose deadline tick has passed, removing them"""
+        now_tick = self._tick_of(now)
+
+        if self.current_tick is None:
+            self.current_tick = now_tick - 1
+
+        expired = []
+
+        # walking more than one full turn would only revisit the same slots
+        first = max(self.current_tick + 1, now_tick - len(self.slots) + 1)
+
+        for t in range(first, now_tick + 1):
+            slot = self.slots[t % len(self.slots)]
+            if not slot:
+                continue
+
+            for item in list(slot):
+                if self.deadlines[item] <= now_tick:  # items from later turns stay
+                    slot.discard(item)
+                    del self.deadlines[item]
+                    expired.append(item)
+
+        self.current_tick = max(self.current_tick, now_tick)
+        return expired
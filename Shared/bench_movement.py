@@ -0,0 +1,303 @@
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+import uuid
+
+from movement import (CROUCH, CROUCH_SPEED, DOWN, INTENT_DELTAS, INTENT_MASK, LEFT, MAP_HALF_HEIGHT, MAP_HALF_WIDTH,
+                      PLAYER_HEIGHT, PLAYER_WIDTH, RIGHT, SPEED, SPRINT, SPRINT_SPEED, UP, step)
+
+# the real server and client classes, the server finds its map and database from its own folder
+SHARED = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SHARED, "..", "Server"))
+sys.path.insert(0, os.path.join(SHARED, "..", "Player"))
+os.chdir(os.path.join(SHARED, "..", "Server"))
+STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+import quic_client as client  # needs pygame, like the client itself
+import quick_server_noredis as server
+from loopback import LoopbackClient
+
+# Movement kernel check and benchmark.
+#   1. every intent in the table matches the old branch cascade exactly
+#   2. a random walk through a crowd on the real map gives bit-identical
+#      positions from the server's GameServerProtocol.change_pos and the
+#      client's GameClientProtocol._prediction, each in its own copy of the
+#      world: the server's chunks and terrain, the client's players and the
+#      terrain it built from streamed map chunks
+#   3. the same walk against a frozen copy of the stepping from before the
+#      kernel was shared: identical on open ground, in a crowd it only
+#      differs where the swept collide stops flush instead of refusing the axis
+#   4. time per step: old cascade vs table lookup, and the full server step
+CROWD = 50
+SPREAD = 400  # pixels, the crowd stands in a square twice this wide around the spawn
+SEED = 38
+OLD_CLIENT_SPRINT_SPEED = 6  # what the client predicted with before the kernel was shared
+
+
+# ===========================
+# FROZEN BASELINE
+# ===========================
+# The server's change_pos / collisions as they were before movement.py,
+# kept here unchanged so the kernel is never compared with itself. The old
+# client ran the same code with its own sprint speed.
+
+def legacy_delta(intent, sprint_speed):
+    """The cascade that used to live in change_pos / _prediction"""
+    dx = dy = 0
+
+    if intent & SPRINT and not intent & CROUCH:
+        if intent & UP:
+            dy -= sprint_speed
+        if intent & DOWN:
+            dy += sprint_speed
+        if intent & LEFT:
+            dx -= sprint_speed
+        if intent & RIGHT:
+            dx += sprint_speed
+    elif intent & CROUCH and not intent & SPRINT:
+        if intent & UP:
+            dy -= CROUCH_SPEED
+        if intent & DOWN:
+            dy += CROUCH_SPEED
+        if intent & LEFT:
+            dx -= CROUCH_SPEED
+        if intent & RIGHT:
+            dx += CROUCH_SPEED
+    else:
+        if intent & UP:
+            dy -= SPEED
+        if intent & DOWN:
+            dy += SPEED
+        if intent & LEFT:
+            dx -= SPEED
+        if intent & RIGHT:
+            dx += SPEED
+
+    if dx != 0 and dy != 0:
+        scale = 1 / math.sqrt(2)
+        dx *= scale
+        dy *= scale
+
+    return dx, dy
+
+
+def legacy_collide(x, y, dx, dy, others):
+    """The per-axis test: an axis is refused when its end position overlaps someone"""
+    allow_x = True
+    allow_y = True
+
+    for ox, oy in others:
+        # --- Check overlap ---
+        overlap_x = abs(x - ox) < PLAYER_WIDTH
+        overlap_y = abs(y - oy) < PLAYER_HEIGHT
+
+        # --- If overlapping: only allow moving AWAY ---
+        if overlap_x and overlap_y:
+            if dx != 0 and (x - ox) * dx < 0:
+                allow_x = False
+            if dy != 0 and (y - oy) * dy < 0:
+                allow_y = False
+            continue
+
+        # --- Normal collision ---
+        if dx != 0:
+            test_x = x + dx
+            if abs(test_x - ox) < PLAYER_WIDTH and abs(y - oy) < PLAYER_HEIGHT:
+                allow_x = False
+
+        if dy != 0:
+            test_y = y + dy
+            if abs(x - ox) < PLAYER_WIDTH and abs(test_y - oy) < PLAYER_HEIGHT:
+                allow_y = False
+
+    # --- Apply movement ONCE ---
+    if allow_x:
+        x += dx
+    if allow_y:
+        y += dy
+
+    # --- Clamp to map ---
+    x = max(-MAP_HALF_WIDTH, min(x, MAP_HALF_WIDTH - PLAYER_WIDTH))
+    y = max(-MAP_HALF_HEIGHT, min(y, MAP_HALF_HEIGHT - PLAYER_HEIGHT))
+    return x, y
+
+
+def legacy_step(x, y, intent, others, sprint_speed):
+    dx, dy = legacy_delta(intent, sprint_speed)
+    if dx == 0 and dy == 0:
+        return x, y
+    return legacy_collide(x, y, dx, dy, others)
+
+
+# ===========================
+# WORLDS
+# ===========================
+
+def bits(x, y):
+    return float(x).hex(), float(y).hex()
+
+
+def spawn():
+    return float(-PLAYER_WIDTH // 2), float(-PLAYER_HEIGHT // 2)
+
+
+def outside(x, y):
+    sx, sy = spawn()
+    return abs(x - sx) >= SPREAD or abs(y - sy) >= SPREAD
+
+
+def load_map():
+    """The server loads the whole map, the client the chunks it would stream around the crowd"""
+    with open(server.MAP_PATH, "r", encoding="utf-8") as f:
+        rows = [line.strip("\n") for line in f]
+    server.TERRAIN.load(rows)
+    server.MAP_CHUNKS.load(rows)
+
+    size = server.MAP_CHUNKS.chunk_tiles * server.TILE_SIZE
+    sx, sy = spawn()
+    for cx in range(int((sx - 2 * SPREAD + MAP_HALF_WIDTH) // size), int((sx + 2 * SPREAD + MAP_HALF_WIDTH) // size) + 1):
+        for cy in range(int((sy - 2 * SPREAD + MAP_HALF_HEIGHT) // size),
+                        int((sy + 2 * SPREAD + MAP_HALF_HEIGHT) // size) + 1):
+            chunk_rows = server.MAP_CHUNKS.chunk_bytes(cx, cy).decode("utf-8").split("\n")
+            client.load_chunk(cx, cy, chunk_rows, server.MAP_CHUNKS.chunk_tiles)
+    return server.TERRAIN.rectangles, client.TERRAIN.rectangles
+
+
+def headless(x, y):
+    """A joined player on the server, without a network"""
+    player = LoopbackClient(server.GameServerProtocol).protocol
+    player.client_id = uuid.uuid4()
+    player.x, player.y = x, y
+    server.CONNECTED_CLIENTS.add(player)
+    server.CHUNKS.place(player)
+    return player
+
+
+def build_worlds(crowd):
+    """The mover and its crowd on the server, and the client that predicts for it"""
+    mover = headless(*spawn())
+    others = [headless(x, y) for x, y in crowd]
+
+    # only what _prediction touches, the window and its images are never made
+    predictor = client.GameClientProtocol.__new__(client.GameClientProtocol)
+    predictor.client_id = mover.client_id
+    predictor.players = {}
+    for player in [mover] + others:
+        ghost = client.Player()
+        ghost.x, ghost.y = player.x, player.y
+        predictor.players[player.client_id] = [ghost, None]
+    return mover, predictor
+
+
+def place(mover, predictor, x, y):
+    local = predictor.players[predictor.client_id][0]
+    mover.x, mover.y = local.x, local.y = x, y
+    server.CHUNKS.place(mover)
+
+
+def server_vs_client(mover, predictor, intents):
+    """Steps both ends with the same intents, returns the first step they disagree on or None"""
+    local = predictor.players[predictor.client_id][0]
+    for i, intent in enumerate(intents):
+        mover.change_pos(intent)
+        server.CHUNKS.place(mover)
+        predictor._prediction(intent)
+        if bits(mover.x, mover.y) != bits(local.x, local.y):
+            return i
+        # out of the crowd's square: start over at the spawn
+        if outside(mover.x, mover.y):
+            place(mover, predictor, *spawn())
+    return None
+
+
+def walk(stepper, intents, crowd):
+    x, y = spawn()
+    trace = []
+    for intent in intents:
+        x, y = stepper(x, y, intent, crowd)
+        trace.append(bits(x, y))
+        if outside(x, y):
+            x, y = spawn()
+    return trace
+
+
+def disagreements(stepper, other, intents, crowd):
+    """Steps where other, started from where stepper stands, ends somewhere else"""
+    x, y = spawn()
+    count = 0
+    for intent in intents:
+        if bits(*other(x, y, intent, crowd)) != bits(*stepper(x, y, intent, crowd)):
+            count += 1
+        x, y = stepper(x, y, intent, crowd)
+        if outside(x, y):
+            x, y = spawn()
+    return count
+
+
+async def main():
+    rng = random.Random(SEED)
+
+    # --- 1. table vs cascade ---
+    for intent in range(INTENT_MASK + 1):
+        assert bits(*INTENT_DELTAS[intent]) == bits(*legacy_delta(intent, SPRINT_SPEED)), intent
+    print(f"delta table: all {INTENT_MASK + 1} intents match the old cascade")
+
+    # --- 2. server vs client, each in its own world ---
+    intents = [rng.randrange(INTENT_MASK + 1) for _ in range(STEPS)]
+    sx, sy = spawn()
+    crowd = [(sx + rng.uniform(-SPREAD, SPREAD), sy + rng.uniform(-SPREAD, SPREAD)) for _ in range(CROWD)]
+
+    server_boxes, client_boxes = load_map()
+    mover, predictor = build_worlds(crowd)
+    diverged = server_vs_client(mover, predictor, intents)
+    assert diverged is None, f"server change_pos and client _prediction diverged at step {diverged}"
+    print(f"random walk of {STEPS} steps through {CROWD} players: change_pos == _prediction, bit for bit "
+          f"(terrain: {server_boxes} rectangles on the server, {client_boxes} streamed to the client)")
+
+    # --- 3. frozen baseline ---
+    def kernel(x, y, intent, others):
+        return step(x, y, intent, others)
+
+    def legacy_server(x, y, intent, others):
+        return legacy_step(x, y, intent, others, SPRINT_SPEED)
+
+    def legacy_client(x, y, intent, others):
+        return legacy_step(x, y, intent, others, OLD_CLIENT_SPRINT_SPEED)
+
+    assert walk(kernel, intents, ()) == walk(legacy_server, intents, ()), \
+        "kernel differs from the old server movement on open ground"
+    print(f"open ground: kernel == old server movement; in the crowd the swept collide "
+          f"ends elsewhere on {disagreements(kernel, legacy_server, intents, crowd)} of {STEPS} steps")
+    print(f"old client prediction disagreed with the old server on "
+          f"{disagreements(legacy_server, legacy_client, intents, crowd)} of {STEPS} steps")
+
+    # --- 4. timing (no crowd, so only the intent decoding is measured) ---
+    start = time.perf_counter()
+    for intent in intents:
+        dx, dy = legacy_delta(intent, SPRINT_SPEED)
+    cascade = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for intent in intents:
+        dx, dy = INTENT_DELTAS[intent & INTENT_MASK]
+    table = time.perf_counter() - start
+
+    print(f"intent decode: cascade {cascade / STEPS * 1e9:.0f}ns, table {table / STEPS * 1e9:.0f}ns "
+          f"({cascade / table:.1f}x)")
+
+    place(mover, predictor, *spawn())
+    start = time.perf_counter()
+    for intent in intents:
+        mover.change_pos(intent)
+        server.CHUNKS.place(mover)
+        if outside(mover.x, mover.y):
+            place(mover, predictor, *spawn())
+    full = time.perf_counter() - start
+    print(f"server change_pos with {CROWD} players around: {full / STEPS * 1e6:.2f}us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
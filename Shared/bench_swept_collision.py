@@ -0,0 +1,153 @@
+import math
+import random
+import sys
+import time
+
+from movement import (INTENT_DELTAS, MAP_HALF_HEIGHT, MAP_HALF_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH, SPEED, SPRINT,
+                      SPRINT_SPEED, collide)
+
+# Sprinting through a crowd: the swept collide against the per-axis test it
+# replaced, alone and sub-stepped. A move "tunnels" when its path went
+# through another player, "lands inside" when it ends overlapping one it did
+# not overlap before and "stops short" when an axis was cut off without
+# ending flush against anyone. Every method walks the same random intents,
+# at sprint speed and at FAST_SCALE times that, where a step is longer than
+# two players are wide.
+STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+CROWD = 60
+SPREAD = 800  # pixels, the crowd stands in a square this wide
+SEED = 48
+FAST_SCALE = 3
+
+
+def per_axis_collide(x, y, dx, dy, others):
+    """The collide used before: each axis blocked when its end position overlaps"""
+    allow_x = True
+    allow_y = True
+
+    for ox, oy in others:
+        overlap_x = abs(x - ox) < PLAYER_WIDTH
+        overlap_y = abs(y - oy) < PLAYER_HEIGHT
+
+        if overlap_x and overlap_y:
+            if dx != 0 and (x - ox) * dx < 0:
+                allow_x = False
+            if dy != 0 and (y - oy) * dy < 0:
+                allow_y = False
+            continue
+
+        if dx != 0:
+            if abs(x + dx - ox) < PLAYER_WIDTH and overlap_y:
+                allow_x = False
+
+        if dy != 0:
+            if overlap_x and abs(y + dy - oy) < PLAYER_HEIGHT:
+                allow_y = False
+
+    if allow_x:
+        x += dx
+    if allow_y:
+        y += dy
+
+    x = max(-MAP_HALF_WIDTH, min(x, MAP_HALF_WIDTH - PLAYER_WIDTH))
+    y = max(-MAP_HALF_HEIGHT, min(y, MAP_HALF_HEIGHT - PLAYER_HEIGHT))
+    return x, y
+
+
+def sub_stepped(substeps):
+    def move(x, y, dx, dy, others):
+        for _ in range(substeps):
+            x, y = per_axis_collide(x, y, dx / substeps, dy / substeps, others)
+        return x, y
+    return move
+
+
+def overlapping(x, y, others):
+    return {i for i, (ox, oy) in enumerate(others) if abs(x - ox) < PLAYER_WIDTH and abs(y - oy) < PLAYER_HEIGHT}
+
+
+def side(position, other, size):
+    """-1 or 1 when the boxes are apart on this axis, 0 when they overlap on it"""
+    if position + size <= other:
+        return -1
+    if position >= other + size:
+        return 1
+    return 0
+
+
+def passed_through(x0, y0, x1, y1, others):
+    """Players the move went through: on one side before, on the other after,
+    overlapping on the other axis the whole way"""
+    for ox, oy in others:
+        if abs(y0 - oy) < PLAYER_HEIGHT and abs(y1 - oy) < PLAYER_HEIGHT:
+            if side(x0, ox, PLAYER_WIDTH) * side(x1, ox, PLAYER_WIDTH) < 0:
+                return True
+        if abs(x0 - ox) < PLAYER_WIDTH and abs(x1 - ox) < PLAYER_WIDTH:
+            if side(y0, oy, PLAYER_HEIGHT) * side(y1, oy, PLAYER_HEIGHT) < 0:
+                return True
+    return False
+
+
+def flush(position, others, size):
+    """Ends against the side of some player on this axis"""
+    return any(abs(abs(position - other) - size) < 1e-6 for other in others)
+
+
+def walk(move, moves, crowd):
+    x, y = -18.0, -28.0
+    tunnels = inside = short = 0
+    for dx, dy in moves:
+        before = overlapping(x, y, crowd)
+        nx, ny = move(x, y, dx, dy, crowd)
+        if passed_through(x, y, nx, ny, crowd):
+            tunnels += 1
+        if overlapping(nx, ny, crowd) - before:
+            inside += 1
+        elif not before and (abs(nx - x - dx) > 1e-6 and not flush(nx, [ox for ox, _ in crowd], PLAYER_WIDTH) or
+                             abs(ny - y - dy) > 1e-6 and not flush(ny, [oy for _, oy in crowd], PLAYER_HEIGHT)):
+            short += 1
+        # out of the crowd's square: start over in the middle
+        x, y = (nx, ny) if abs(nx) < SPREAD and abs(ny) < SPREAD else (-18.0, -28.0)
+    return tunnels, inside, short
+
+
+def timed(move, moves, crowd):
+    x, y = -18.0, -28.0
+    start = time.perf_counter()
+    for dx, dy in moves:
+        x, y = move(x, y, dx, dy, crowd)
+        if abs(x) >= SPREAD or abs(y) >= SPREAD:
+            x, y = -18.0, -28.0
+    return (time.perf_counter() - start) / len(moves)
+
+
+def compare(speed, crowd, intents):
+    scale = speed / SPRINT_SPEED
+    moves = [(dx * scale, dy * scale) for dx, dy in (INTENT_DELTAS[intent] for intent in intents) if dx or dy]
+    substeps = math.ceil(speed / SPEED)  # as fine as walking
+
+    methods = [
+        ("per axis", per_axis_collide),
+        ("2 substeps", sub_stepped(2)),
+        (f"{substeps} substeps", sub_stepped(substeps)),
+        ("swept", collide),
+    ]
+    print(f"{len(moves)} steps of {speed}px through {CROWD} players ({PLAYER_WIDTH}x{PLAYER_HEIGHT})")
+    for name, move in methods:
+        tunnels, inside, short = walk(move, moves, crowd)
+        cost = timed(move, moves, crowd)
+        print(f"  {name:12} {cost * 1e6:7.2f}us per step, {tunnels} tunneled, {inside} landed inside, "
+              f"{short} stopped short")
+
+
+def main():
+    rng = random.Random(SEED)
+    crowd = [(rng.uniform(-SPREAD / 2, SPREAD / 2), rng.uniform(-SPREAD / 2, SPREAD / 2)) for _ in range(CROWD)]
+    intents = [rng.randrange(1, 16) | SPRINT for _ in range(STEPS)]
+
+    compare(SPRINT_SPEED, crowd, intents)
+    compare(SPRINT_SPEED * FAST_SCALE, crowd, intents)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+
+from movement import (INTENT_DELTAS, MAP_HALF_HEIGHT, MAP_HALF_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH, SPRINT, SPRINT_SPEED,
+                      collide)
+from terrain import SOLID_TILES, TerrainLayer
+
+# Static terrain collision on the real map: the rock the game blocks on, and
+# lava made solid as well for a map dense with terrain. The merged rectangle
+# layer is compared with looking up every tile under the player after each
+# axis moves. Walkers sprint around from random spots along the edges;
+# "inside" counts steps that ended overlapping a solid tile, and the
+# distance covered shows how far short of the edge a blocked step stopped.
+# Every timing is the median of REPEATS runs. Last, a player sprints
+# straight down into the rock wall below the spawn and has to stop on it.
+MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server", "new_map.txt")
+CASES = (("rock", SOLID_TILES), ("rock + lava", SOLID_TILES | frozenset("#")))
+TILE_SIZE = 40
+WALKERS = 200
+STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+REPEATS = 7
+SEED = 49
+SPAWN = (-PLAYER_WIDTH // 2, -PLAYER_HEIGHT // 2)
+
+
+def load_rows():
+    with open(MAP_PATH, "r", encoding="utf-8") as f:
+        return [line.strip("\n") for line in f]
+
+
+def solid_tiles(rows, solid_chars):
+    return {(tx, ty) for ty, row in enumerate(rows) for tx, ch in enumerate(row) if ch in solid_chars}
+
+
+def tiles_under(x, y):
+    tx0 = int((x + MAP_HALF_WIDTH) // TILE_SIZE)
+    tx1 = int((x + PLAYER_WIDTH - 1e-9 + MAP_HALF_WIDTH) // TILE_SIZE)
+    ty0 = int((y + MAP_HALF_HEIGHT) // TILE_SIZE)
+    ty1 = int((y + PLAYER_HEIGHT - 1e-9 + MAP_HALF_HEIGHT) // TILE_SIZE)
+    return [(tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)]
+
+
+def per_tile_collide(solid):
+    """Each axis moves unless the tiles under its end position include a solid one"""
+    def move(x, y, dx, dy):
+        if not any(tile in solid for tile in tiles_under(x + dx, y)):
+            x += dx
+        if not any(tile in solid for tile in tiles_under(x, y + dy)):
+            y += dy
+        return x, y
+    return move
+
+
+def layer_collide(terrain):
+    def move(x, y, dx, dy):
+        return collide(x, y, dx, dy, (), terrain.boxes_near(x, y, dx, dy))
+    return move
+
+
+def edge_spots(rows, solid, rng):
+    """Free spots with something solid a tile away"""
+    spots = []
+    while len(spots) < WALKERS:
+        tx, ty = rng.randrange(1, len(rows[0]) - 2), rng.randrange(1, len(rows) - 3)
+        x = tx * TILE_SIZE - MAP_HALF_WIDTH + 1
+        y = ty * TILE_SIZE - MAP_HALF_HEIGHT + 1
+        if any(tile in solid for tile in tiles_under(x, y)):
+            continue
+        if any((tx + dx, ty + dy) in solid for dx in (-1, 0, 1, 2) for dy in (-1, 0, 1, 2)):
+            spots.append((x, y))
+    return spots
+
+
+def timed(methods, spots, moves):
+    """Seconds per step of every method in each of REPEATS runs.
+
+    The methods take turns within a run and the collector is off, so a slow
+    moment of the machine hits all of them alike.
+    """
+    runs = {name: [] for name, _ in methods}
+    gc.disable()
+    try:
+        for _ in range(REPEATS):
+            for name, move in methods:
+                start = time.perf_counter()
+                for x, y in spots:
+                    for dx, dy in moves:
+                        x, y = move(x, y, dx, dy)
+                runs[name].append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    steps = len(spots) * len(moves)
+    return {name: [t / steps for t in times] for name, times in runs.items()}
+
+
+def walk(move, spots, moves, solid):
+    inside = 0
+    covered = 0.0
+    for x, y in spots:
+        for dx, dy in moves:
+            nx, ny = move(x, y, dx, dy)
+            covered += abs(nx - x) + abs(ny - y)
+            x, y = nx, ny
+            if any(tile in solid for tile in tiles_under(x, y)):
+                inside += 1
+    return inside, covered / (len(spots) * len(moves))
+
+
+def into_the_wall(rows, terrain):
+    """Sprints down from the spawn, returns (where the player stopped, top of the first rock below it)"""
+    x, y = SPAWN
+    tx = int((x + MAP_HALF_WIDTH) // TILE_SIZE)
+    ty = next(ty for ty in range(int((y + MAP_HALF_HEIGHT) // TILE_SIZE), len(rows))
+              if any(rows[ty][t] in SOLID_TILES for t in {tx, int((x + PLAYER_WIDTH - 1 + MAP_HALF_WIDTH) // TILE_SIZE)}))
+    top = ty * TILE_SIZE - MAP_HALF_HEIGHT
+
+    for _ in range(int((top - y) // SPRINT_SPEED) + 3):
+        x, y = collide(x, y, 0, SPRINT_SPEED, (), terrain.boxes_near(x, y, 0, SPRINT_SPEED))
+    return y + PLAYER_HEIGHT, top
+
+
+def compare(name, rows, solid_chars, rng):
+    start = time.perf_counter()
+    solid = solid_tiles(rows, solid_chars)
+    tiles_time = time.perf_counter() - start
+
+    terrain = TerrainLayer(TILE_SIZE, solid_chars)
+    start = time.perf_counter()
+    terrain.load(rows)
+    layer_time = time.perf_counter() - start
+    print(f"{name}: {len(solid)} solid tiles ({tiles_time * 1e3:.0f}ms to collect) merged into "
+          f"{terrain.rectangles} rectangles in {len(terrain.chunks)} chunks ({layer_time * 1e3:.0f}ms)")
+
+    spots = edge_spots(rows, solid, rng)
+    moves = [INTENT_DELTAS[rng.randrange(1, 16) | SPRINT] for _ in range(STEPS)]
+    moves = [(dx, dy) for dx, dy in moves if dx or dy]
+    print(f"  {WALKERS} walkers x {len(moves)} sprint steps from the edges, median of {REPEATS} runs")
+    methods = (("per tile", per_tile_collide(solid)), ("rectangles", layer_collide(terrain)))
+    costs = timed(methods, spots, moves)
+    for method, move in methods:
+        inside, covered = walk(move, spots, moves, solid)
+        times = costs[method]
+        print(f"  {method:10} {statistics.median(times) * 1e6:6.2f}us per step "
+              f"(runs {min(times) * 1e6:.2f}-{max(times) * 1e6:.2f}), {inside} steps ended inside, "
+              f"{covered:.1f}px covered per step")
+        if method == "rectangles":
+            assert inside == 0, f"{inside} steps ended inside {name}"
+    speedups = [tile / layer for tile, layer in zip(costs["per tile"], costs["rectangles"])]
+    print(f"  rectangles are {statistics.median(speedups):.2f}x as fast, runs {min(speedups):.2f}-{max(speedups):.2f}x")
+    return terrain
+
+
+def main():
+    rng = random.Random(SEED)
+    rows = load_rows()
+    for name, solid_chars in CASES:
+        terrain = compare(name, rows, solid_chars, rng)
+        if solid_chars == SOLID_TILES:
+            stopped, top = into_the_wall(rows, terrain)
+            assert stopped == top, f"sprinting down from the spawn stopped at {stopped}, the rock starts at {top}"
+            print(f"  sprinting down from the spawn stops on the rock wall at y={top}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import gc
+import time
+
+# ===========================
+# GC PAUSES
+# ===========================
+# The tile maps hold millions of entries that never change after loading, but
+# every full collection walks them again: around 100ms on the server's map,
+# in the middle of a tick, which players see as rubber-banding.
+# GcPacer freezes what was loaded so collections skip it, stops the
+# interpreter from starting full collections on its own and runs them in the
+# time left over after a tick instead. Every collection's pause is measured,
+# paced or not.
+
+NEVER = 1 << 30  # a gen 2 threshold the collection counter does not reach
+
+
+class GcPacer:
+    """Moves garbage collection into the idle time between ticks.
+
+    watch() only measures. take_over() freezes everything alive, turns off
+    automatic full collections and leaves them to collect_in_slack(), which
+    the tick loop calls with the time its next tick is due. A full collection
+    runs once `full_every` gen 1 collections have piled up and the slack is
+    longer than the last full collections took, or regardless once
+    `max_delay` seconds passed since the last one.
+    """
+
+    def __init__(self, full_every=10, max_delay=30.0, smoothing=0.2, clock=time.perf_counter):
+        self.full_every = full_every
+        self.max_delay = max_delay
+        self.smoothing = smoothing
+        self.clock = clock
+
+        self.watching = False
+        self.paced = False
+        self.thresholds = gc.get_threshold()
+        self.last_full = clock()
+        self.full_cost = 0.0  # smoothed seconds per full collection
+        self.young_cost = 0.0  # smoothed seconds per gen 0/1 collection
+
+        self.started = 0.0
+        self.ours = False  # the running collection was started by us, outside a tick
+        self.collections = [0, 0, 0]  # per generation
+        self.pause_total = [0.0, 0.0, 0.0]
+        self.pause_max = [0.0, 0.0, 0.0]
+        self.last_pause = 0.0
+        self.in_tick_pause_max = 0.0  # longest pause that did not run in slack
+        self.slack_collections = 0
+
+    def watch(self):
+        if not self.watching:
+            gc.callbacks.append(self.on_gc)
+            self.watching = True
+
+    def unwatch(self):
+        if self.watching:
+            gc.callbacks.remove(self.on_gc)
+            self.watching = False
+
+    def take_over(self):
+        """Freezes what is alive now and takes full collections off the interpreter.
+
+        Call it once the static world data is loaded.
+        """
+        self.watch()
+        self.collect(2)
+        gc.freeze()  # frozen objects are never looked at again
+        self.last_full = self.clock()
+
+        self.thresholds = gc.get_threshold()
+        gc.set_threshold(self.thresholds[0], self.thresholds[1], NEVER)
+        self.paced = True
+        return gc.get_freeze_count()
+
+    def collect_in_slack(self, deadline):
+        """Collects what fits before deadline (a self.clock() time). Returns the generation or None"""
+        if not self.paced:
+            return None
+
+        now = self.clock()
+        slack = deadline - now
+        young, middle, old = gc.get_count()
+
+        if old >= self.full_every and slack > self.full_cost or now - self.last_full >= self.max_delay:
+            generation = 2
+        elif young >= self.thresholds[0] // 2 and slack > self.young_cost:
+            generation = 1 if middle >= self.thresholds[1] // 2 else 0
+        else:
+            return None
+
+        self.collect(generation)
+        self.slack_collections += 1
+        return generation
+
+    def collect(self, generation):
+        self.ours = True
+        try:
+            gc.collect(generation)
+        finally:
+            self.ours = False
+
+    def on_gc(self, phase, info):
+        if phase == "start":
+            self.started = self.clock()
+            return
+
+        pause = self.clock() - self.started
+        generation = info["generation"]
+        self.collections[generation] += 1
+        self.pause_total[generation] += pause
+        self.pause_max[generation] = max(self.pause_max[generation], pause)
+        self.last_pause = pause
+        if not self.ours:
+            self.in_tick_pause_max = max(self.in_tick_pause_max, pause)
+
+        if generation == 2:
+            self.last_full = self.clock()
+            self.full_cost += (pause - self.full_cost) * self.smoothing
+        else:
+            self.young_cost += (pause - self.young_cost) * self.smoothing
+
+    def metrics(self):
+        return {
+            "paced": self.paced,
+            "frozen": gc.get_freeze_count(),
+            "collections": list(self.collections),
+            "pause_total": list(self.pause_total),
+            "pause_max": list(self.pause_max),
+            "last_pause": self.last_pause,
+            "in_tick_pause_max": self.in_tick_pause_max,
+            "slack_collections": self.slack_collections,
+        }
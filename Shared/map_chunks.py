@@ -0,0 +1,219 @@
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+# ===========================
+# MAP CHUNKS
+# ===========================
+# The server streams the tile map to clients in square chunks instead of
+# every client shipping and parsing the whole file. A client gets the
+# manifest on join: the map size and a hash of every chunk. It asks for the
+# chunks around its camera, keeps what it got in a disk cache under the
+# chunk's hash and from then on only asks for chunks whose hash changed.
+# Chunks the camera moved away from are dropped from memory.
+#
+# A chunk goes over the wire as its rows of tile characters, joined with
+# "\n", UTF-8 encoded and zlib compressed. The hash covers the uncompressed
+# bytes, so it names the content and not how it was packed.
+
+MAP_CHUNK_TILES = 32  # a chunk is 1280px square at 40px tiles, a screen sees at most 2x2
+HASH_SIZE = 8
+
+MANIFEST = struct.Struct("!BHHH")  # msg 11: width, height in tiles, chunk tiles; then a hash per chunk, rows first
+CHUNK_REQUEST = struct.Struct("!BHH")  # msg 12: cx, cy
+CHUNK_DATA = struct.Struct(f"!BHH{HASH_SIZE}s")  # msg 13: cx, cy, hash; then the compressed rows
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def frame(payload):
+    return struct.pack("!H", len(payload)) + payload
+
+
+def chunk_request(cx, cy):
+    return frame(CHUNK_REQUEST.pack(12, cx, cy))
+
+
+class MapChunks:
+    """Server side: the map cut into chunks, with their hashes and the
+    messages that carry them, built the first time someone asks.
+    """
+
+    def __init__(self, chunk_tiles=MAP_CHUNK_TILES):
+        self.chunk_tiles = chunk_tiles
+        self.load(())
+
+    def load(self, rows):
+        """Takes the map's rows of tile characters"""
+        self.rows = list(rows)
+        self.width = max((len(row) for row in self.rows), default=0)
+        self.height = len(self.rows)
+        self.columns = -(-self.width // self.chunk_tiles)
+        self.lines = -(-self.height // self.chunk_tiles)
+
+        self.hashes = {}
+        for cy in range(self.lines):
+            for cx in range(self.columns):
+                self.hashes[(cx, cy)] = chunk_hash(self.chunk_bytes(cx, cy))
+        self.packets = {}  # (cx, cy) -> framed msg 13
+
+        payload = MANIFEST.pack(11, self.width, self.height, self.chunk_tiles)
+        self.manifest = frame(payload + b"".join(self.hashes.values()))
+
+    def chunk_bytes(self, cx, cy):
+        x0 = cx * self.chunk_tiles
+        y0 = cy * self.chunk_tiles
+        rows = self.rows[y0:y0 + self.chunk_tiles]
+        return "\n".join(row[x0:x0 + self.chunk_tiles] for row in rows).encode("utf-8")
+
+    def packet(self, cx, cy):
+        """The framed chunk message, None for a chunk off the map"""
+        packet = self.packets.get((cx, cy))
+        if packet is None:
+            digest = self.hashes.get((cx, cy))
+            if digest is None:
+                return None
+            data = zlib.compress(self.chunk_bytes(cx, cy), 9)
+            packet = self.packets[(cx, cy)] = frame(CHUNK_DATA.pack(13, cx, cy, digest) + data)
+        return packet
+
+
+class MapChunkCache:
+    """Client side: the chunks around the camera, from the disk cache or the server.
+
+    update() is called every frame with the tiles on screen and says which
+    chunks to request, which were loaded from disk and which to drop.
+    receive() takes a chunk the server sent. Loaded chunks come back as
+    (cx, cy, rows) with rows as strings of tile characters. A request that
+    got no answer within request_timeout seconds is made again.
+    """
+
+    def __init__(self, cache_dir, margin=1, keep=2, max_requests=8, request_timeout=5.0, clock=time.monotonic):
+        self.cache_dir = cache_dir
+        self.margin = margin  # chunks loaded beyond the screen, in every direction
+        self.keep = keep  # chunks beyond the screen kept before they are dropped
+        self.max_requests = max_requests  # requests in flight
+        self.request_timeout = request_timeout
+        self.clock = clock
+
+        self.chunk_tiles = MAP_CHUNK_TILES
+        self.columns = self.lines = 0
+        self.hashes = {}  # (cx, cy) -> hash, from the manifest
+        self.loaded = {}  # (cx, cy) -> hash of what we hold
+        self.requested = {}  # (cx, cy) -> when we asked for it
+
+        self.disk_hits = 0
+        self.fetched = 0
+        self.fetched_bytes = 0
+
+    def set_manifest(self, payload):
+        """Takes msg 11. Returns the loaded chunks that changed, they have to be dropped"""
+        _, width, height, self.chunk_tiles = MANIFEST.unpack_from(payload)
+        self.columns = -(-width // self.chunk_tiles)
+        self.lines = -(-height // self.chunk_tiles)
+
+        self.hashes = {}
+        offset = MANIFEST.size
+        for cy in range(self.lines):
+            for cx in range(self.columns):
+                self.hashes[(cx, cy)] = bytes(payload[offset:offset + HASH_SIZE])
+                offset += HASH_SIZE
+
+        changed = [chunk for chunk, digest in self.loaded.items() if self.hashes.get(chunk) != digest]
+        for chunk in changed:
+            del self.loaded[chunk]
+        self.requested.clear()
+        return changed
+
+    def window(self, left, top, right, bottom, extra):
+        """Chunks over the tile rectangle, extra chunks further in every direction"""
+        size = self.chunk_tiles
+        cx0 = max(0, left // size - extra)
+        cx1 = min(self.columns - 1, right // size + extra)
+        cy0 = max(0, top // size - extra)
+        cy1 = min(self.lines - 1, bottom // size + extra)
+        return {(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)}
+
+    def update(self, left, top, right, bottom):
+        """Returns (requests, loaded, dropped) for the tiles on screen, ends inclusive"""
+        if not self.hashes:
+            return [], [], []
+
+        kept = self.window(left, top, right, bottom, self.keep)
+        dropped = [chunk for chunk in self.loaded if chunk not in kept]
+        for chunk in dropped:
+            del self.loaded[chunk]
+
+        # a request or its answer got lost, ask again if we still want the chunk
+        now = self.clock()
+        for chunk, asked in list(self.requested.items()):
+            if now - asked > self.request_timeout:
+                del self.requested[chunk]
+
+        requests = []
+        loaded = []
+        for chunk in sorted(self.window(left, top, right, bottom, self.margin)):
+            if chunk in self.loaded or chunk in self.requested:
+                continue
+            rows = self.read_cached(chunk)
+            if rows is not None:
+                self.loaded[chunk] = self.hashes[chunk]
+                self.disk_hits += 1
+                loaded.append(chunk + (rows,))
+            elif len(self.requested) < self.max_requests:
+                self.requested[chunk] = now
+                requests.append(chunk)
+        return requests, loaded, dropped
+
+    def receive(self, payload):
+        """Takes msg 13. Returns (cx, cy, rows), or None for a chunk we no longer want"""
+        _, cx, cy, digest = CHUNK_DATA.unpack_from(payload)
+        chunk = (cx, cy)
+        self.requested.pop(chunk, None)
+
+        data = zlib.decompress(payload[CHUNK_DATA.size:])
+        if chunk_hash(data) != digest or self.hashes.get(chunk) != digest:
+            return None  # the map changed since we asked, the next update asks again
+
+        self.fetched += 1
+        self.fetched_bytes += len(payload)
+        self.write_cached(chunk, digest, payload[CHUNK_DATA.size:])
+        self.loaded[chunk] = digest
+        return cx, cy, data.decode("utf-8").split("\n")
+
+    # ===========================
+    # DISK CACHE
+    # ===========================
+    # One file per chunk: its hash, then the compressed rows as the server sent them.
+
+    def path(self, chunk):
+        return os.path.join(self.cache_dir, f"{chunk[0]}_{chunk[1]}.chunk")
+
+    def read_cached(self, chunk):
+        try:
+            with open(self.path(chunk), "rb") as f:
+                digest = f.read(HASH_SIZE)
+                if digest != self.hashes[chunk]:
+                    return None
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+
+        if chunk_hash(data) != digest:
+            return None  # damaged on disk
+        return data.decode("utf-8").split("\n")
+
+    def write_cached(self, chunk, digest, data):
+        # write then rename, so a crash never leaves half a chunk behind
+        path = self.path(chunk)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(digest + data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass  # we only lose the cache, the chunk is asked for again next time
@@ -0,0 +1,179 @@
+import math
+
+# Movement kernel used by both the server simulation and the client prediction.
+# Keep every rule here: if the two ends disagree the client gets corrected
+# (rubber-banded) on every server update.
+
+SPEED = 3
+SPRINT_SPEED = 60
+CROUCH_SPEED = 1
+
+UP = 1 << 0
+LEFT = 1 << 1
+DOWN = 1 << 2
+RIGHT = 1 << 3
+SPRINT = 1 << 4
+CROUCH = 1 << 5
+
+DIR_MASK = UP | LEFT | DOWN | RIGHT
+INTENT_MASK = DIR_MASK | SPRINT | CROUCH  # 64 possible intents
+
+MAP_WIDTH = 1920 * 40 # 76800 pixels
+MAP_HEIGHT = 1080 * 40 # 43200 pixels
+MAP_HALF_WIDTH = MAP_WIDTH // 2
+MAP_HALF_HEIGHT = MAP_HEIGHT // 2
+
+PLAYER_WIDTH = 37
+PLAYER_HEIGHT = 56
+
+
+def intent_delta(intent):
+    """(dx, dy) of one step, the way the old per-intent branch cascade computed it"""
+    if intent & SPRINT and not intent & CROUCH:
+        speed = SPRINT_SPEED
+    elif intent & CROUCH and not intent & SPRINT:
+        speed = CROUCH_SPEED
+    else:
+        speed = SPEED
+
+    dx = dy = 0
+    if intent & UP:
+        dy -= speed
+    if intent & DOWN:
+        dy += speed
+    if intent & LEFT:
+        dx -= speed
+    if intent & RIGHT:
+        dx += speed
+
+    if dx != 0 and dy != 0:
+        scale = 1 / math.sqrt(2)
+        dx *= scale
+        dy *= scale
+
+    return dx, dy
+
+
+# intent -> (dx, dy), so a step never branches on the intent bits
+INTENT_DELTAS = tuple(intent_delta(intent) for intent in range(INTENT_MASK + 1))
+
+
+def player_box(ox, oy):
+    """The box a player standing at (ox, oy) keeps another player's (x, y) out of"""
+    return ox - PLAYER_WIDTH, oy - PLAYER_HEIGHT, ox + PLAYER_WIDTH, oy + PLAYER_HEIGHT
+
+
+def sweep(x, y, dx, dy, box):
+    """Time of impact of (x, y) moving by (dx, dy) against a box (left, top, right, bottom).
+
+    Boxes are in the moving player's (x, y): a position strictly inside one
+    overlaps what the box stands for. Returns (t, axis) with t in [0, 1) and
+    axis 0 when the hit is on the x side, 1 on the y side, or None when the
+    move does not run into it. Touching is not a hit, neither is a box the
+    position is already inside.
+    """
+    left, top, right, bottom = box
+
+    if dx > 0:
+        x_entry, x_exit = (left - x) / dx, (right - x) / dx
+    elif dx < 0:
+        x_entry, x_exit = (right - x) / dx, (left - x) / dx
+    elif left < x < right:
+        x_entry, x_exit = -math.inf, math.inf
+    else:
+        return None
+
+    if dy > 0:
+        y_entry, y_exit = (top - y) / dy, (bottom - y) / dy
+    elif dy < 0:
+        y_entry, y_exit = (bottom - y) / dy, (top - y) / dy
+    elif top < y < bottom:
+        y_entry, y_exit = -math.inf, math.inf
+    else:
+        return None
+
+    entry = max(x_entry, y_entry)
+    if entry < 0 or entry >= 1 or entry >= min(x_exit, y_exit):
+        return None
+    # the axis that started overlapping last is the side that was hit
+    return entry, 0 if x_entry >= y_entry else 1
+
+
+def first_hit(x, y, dx, dy, boxes):
+    """(t, axis, box) of the earliest hit, or None"""
+    first = None
+    for box in boxes:
+        hit = sweep(x, y, dx, dy, box)
+        if hit is not None and (first is None or hit[0] < first[0]):
+            first = hit + (box,)
+    return first
+
+
+def collide(x, y, dx, dy, others, solids=()):
+    """Move (x, y) by (dx, dy) against the other players' (x, y) positions
+    and the terrain's solid boxes (see terrain.TerrainLayer.boxes_near).
+
+    The move is swept: the player stops flush against the first thing in its
+    way, however fast it goes, and slides along it for the rest of the step.
+    Players that already overlap something may only move away from it. The
+    result is clamped to the map.
+    """
+    # --- Overlapping: only allow moving AWAY ---
+    # and keep only the boxes the swept position can reach
+    reach_x = PLAYER_WIDTH + abs(dx)
+    reach_y = PLAYER_HEIGHT + abs(dy)
+    candidates = []
+    for ox, oy in others:
+        if abs(x - ox) < reach_x and abs(y - oy) < reach_y:
+            candidates.append(player_box(ox, oy))
+    candidates.extend(solids)
+
+    boxes = []
+    for box in candidates:
+        left, top, right, bottom = box
+        if left < x < right and top < y < bottom:
+            if dx != 0 and (2 * x - left - right) * dx < 0:
+                dx = 0
+            if dy != 0 and (2 * y - top - bottom) * dy < 0:
+                dy = 0
+        else:
+            boxes.append(box)
+
+    # --- First hit along the whole move ---
+    first = first_hit(x, y, dx, dy, boxes)
+    if first is None:
+        x += dx
+        y += dy
+    else:
+        # --- Stop at the hit, slide the rest of the way along it ---
+        t, axis, (left, top, right, bottom) = first
+        if axis == 0:
+            x = left if dx > 0 else right
+            y += dy * t
+            dx, dy = 0, dy * (1 - t)
+        else:
+            x += dx * t
+            y = top if dy > 0 else bottom
+            dx, dy = dx * (1 - t), 0
+
+        slide = first_hit(x, y, dx, dy, boxes)
+        if slide is None:
+            x += dx
+            y += dy
+        elif axis == 0:
+            y = slide[2][1] if dy > 0 else slide[2][3]
+        else:
+            x = slide[2][0] if dx > 0 else slide[2][2]
+
+    # --- Clamp to map ---
+    x = max(-MAP_HALF_WIDTH, min(x, MAP_HALF_WIDTH - PLAYER_WIDTH))
+    y = max(-MAP_HALF_HEIGHT, min(y, MAP_HALF_HEIGHT - PLAYER_HEIGHT))
+    return x, y
+
+
+def step(x, y, intent, others, solids=()):
+    """One movement step for an intent bitmask, returns the new (x, y)"""
+    dx, dy = INTENT_DELTAS[intent & INTENT_MASK]
+    if dx == 0 and dy == 0:
+        return x, y
+    return collide(x, y, dx, dy, others, solids)
@@ -0,0 +1,62 @@
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+# Session tokens hand a login from the account service to the game server.
+# token = player_id (u32) | expires (u32 unix time) | truncated HMAC-SHA256
+# The server only needs the shared secret to check one, no database.
+
+TOKEN_HEADER = "!II"
+TOKEN_HEADER_SIZE = struct.calcsize(TOKEN_HEADER)
+TOKEN_MAC_SIZE = 16
+TOKEN_SIZE = TOKEN_HEADER_SIZE + TOKEN_MAC_SIZE
+
+TOKEN_TTL = 6 * 60 * 60  # seconds
+SECRET_SIZE = 32
+
+
+def load_secret(path):
+    """Read the shared secret, creating it the first time"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    secret = os.urandom(SECRET_SIZE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:  # someone else created it first
+        with open(path, "rb") as f:
+            return f.read()
+
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+def _mac(secret, header):
+    return hmac.new(secret, header, hashlib.sha256).digest()[:TOKEN_MAC_SIZE]
+
+
+def issue_token(secret, player_id, ttl=TOKEN_TTL):
+    header = struct.pack(TOKEN_HEADER, player_id, int(time.time()) + ttl)
+    return header + _mac(secret, header)
+
+
+def verify_token(secret, token, now=None):
+    """Return the player id a token was issued for, or None if it is forged or expired"""
+    if len(token) != TOKEN_SIZE:
+        return None
+
+    header = bytes(token[:TOKEN_HEADER_SIZE])
+    if not hmac.compare_digest(_mac(secret, header), bytes(token[TOKEN_HEADER_SIZE:])):
+        return None
+
+    player_id, expires = struct.unpack(TOKEN_HEADER, header)
+    if (time.time() if now is None else now) > expires:
+        return None
+
+    return player_id
@@ -0,0 +1,127 @@
+import re
+
+from movement import MAP_HALF_HEIGHT, MAP_HALF_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH
+
+# ===========================
+# STATIC TERRAIN
+# ===========================
+# Tiles nobody can walk through, preprocessed once when the map is loaded:
+# every run of solid tiles on a row is merged with the identical runs below
+# it into one rectangle, per chunk of CHUNK_TILES x CHUNK_TILES tiles. A move
+# only looks at the rectangles of the few chunks its swept box touches,
+# instead of every tile under the player. Server and client
+# prediction build the same layer from the same map, so they collide the same.
+
+# Map characters that block movement: rock. Lava hurts, it does not block.
+SOLID_TILES = frozenset("■")
+CHUNK_TILES = 8  # smaller chunks hand fewer rectangles to each move
+
+
+def merge_runs(runs):
+    """Rectangles (tx0, ty0, tx1, ty1), ends exclusive, from (ty, tx0, tx1) runs in row order"""
+    rectangles = []
+    open_runs = {}  # (tx0, tx1) -> index of the rectangle that ended on the previous row
+    row = None
+    below = {}
+    for ty, tx0, tx1 in runs:
+        if ty != row:
+            open_runs = below if row is not None and ty == row + 1 else {}
+            below = {}
+            row = ty
+
+        index = open_runs.pop((tx0, tx1), None)
+        if index is None:
+            index = len(rectangles)
+            rectangles.append([tx0, ty, tx1, ty + 1])
+        else:
+            rectangles[index][3] = ty + 1
+        below[(tx0, tx1)] = index
+    return [tuple(rectangle) for rectangle in rectangles]
+
+
+class TerrainLayer:
+    """Solid rectangles of a tile map, bucketed by chunk.
+
+    The rectangles are kept as boxes in a player's (x, y), the top left of
+    its sprite: movement.collide can sweep against them like against other
+    players.
+    """
+
+    def __init__(self, tile_size, solid_tiles=SOLID_TILES, chunk_tiles=CHUNK_TILES):
+        self.tile_size = tile_size
+        self.chunk_tiles = chunk_tiles
+        self.chunk_size = tile_size * chunk_tiles  # pixels
+        self.pattern = re.compile(f"[{re.escape(''.join(sorted(solid_tiles)))}]+") if solid_tiles else None
+
+        self.chunks = {}  # (cx, cy) -> tuple of boxes, only chunks with solid tiles
+        self.rectangles = 0
+
+    def load(self, lines):
+        """Builds the whole layer from the map's rows of tile characters"""
+        self.chunks = {}
+        self.rectangles = 0
+        self.set_tiles(0, 0, list(lines))
+
+    def set_tiles(self, tx0, ty0, rows):
+        """Replaces a region starting at tile (tx0, ty0), rows top down.
+
+        The region has to cover whole chunks: the chunks it touches are rebuilt
+        from its rows alone.
+        """
+        self.clear_tiles(tx0, ty0, tx0 + max((len(row) for row in rows), default=0), ty0 + len(rows))
+        if self.pattern is None:
+            return
+
+        runs = {}  # chunk -> [(ty, tx0, tx1)]
+        for row, line in enumerate(rows):
+            self.add_runs(runs, ty0 + row, tx0, line)
+        for chunk, chunk_runs in runs.items():
+            self.set_rectangles(chunk, merge_runs(chunk_runs))
+
+    def clear_tiles(self, tx0, ty0, tx1, ty1):
+        """Forgets the chunks of a region, ends exclusive"""
+        size = self.chunk_tiles
+        for cx in range(tx0 // size, -(-tx1 // size)):
+            for cy in range(ty0 // size, -(-ty1 // size)):
+                self.rectangles -= len(self.chunks.pop((cx, cy), ()))
+
+    def add_runs(self, runs, ty, tx_offset, line):
+        """Solid runs of one row, cut at chunk borders"""
+        for match in self.pattern.finditer(line):
+            start, end = match.start() + tx_offset, match.end() + tx_offset
+            while start < end:
+                cx = start // self.chunk_tiles
+                stop = min(end, (cx + 1) * self.chunk_tiles)
+                runs.setdefault((cx, ty // self.chunk_tiles), []).append((ty, start, stop))
+                start = stop
+
+    def set_rectangles(self, chunk, rectangles):
+        if not rectangles:
+            return
+        size = self.tile_size
+        self.chunks[chunk] = tuple(
+            (tx0 * size - MAP_HALF_WIDTH - PLAYER_WIDTH, ty0 * size - MAP_HALF_HEIGHT - PLAYER_HEIGHT,
+             tx1 * size - MAP_HALF_WIDTH, ty1 * size - MAP_HALF_HEIGHT)
+            for tx0, ty0, tx1, ty1 in rectangles
+        )
+        self.rectangles += len(rectangles)
+
+    def boxes_near(self, x, y, dx, dy):
+        """Solid boxes a player at (x, y) can touch moving by (dx, dy)"""
+        if not self.chunks:
+            return ()
+
+        size = self.chunk_size
+        cx0 = int((min(x, x + dx) + MAP_HALF_WIDTH) // size)
+        cx1 = int((max(x, x + dx) + PLAYER_WIDTH + MAP_HALF_WIDTH) // size)
+        cy0 = int((min(y, y + dy) + MAP_HALF_HEIGHT) // size)
+        cy1 = int((max(y, y + dy) + PLAYER_HEIGHT + MAP_HALF_HEIGHT) // size)
+
+        if cx0 == cx1 and cy0 == cy1:
+            return self.chunks.get((cx0, cy0), ())
+
+        boxes = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                boxes.extend(self.chunks.get((cx, cy), ()))
+        return boxes